@@ -9,8 +9,14 @@
 	  .. packageauthor:: Jordi Duarte-Campderros <jorge.duarte.campderros@cern.ch>
 """
 # Used when 'from dvAnUtils import *'
-__all__ = [ "clusterfactory","jobssender","workenvfactory"]
+__all__ = [ "clusterfactory","jobssender","workenvfactory","jobstore","evtcache","evtreaders","splitting","runhistory","executor"]
 # Used when 'import dvAnUtils'
 import clusterfactory
 import jobssender
 import workenvfactory
+import jobstore
+import evtcache
+import evtreaders
+import splitting
+import runhistory
+import executor
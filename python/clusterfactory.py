@@ -21,7 +21,28 @@
 
 from abc import ABCMeta
 from abc import abstractmethod
+import re
 
+# The HTCondor job flavours at CERN and their maximum duration (seconds)
+JOBFLAVOURS = [ ('espresso',20*60), ('microcentury',3600), ('longlunch',2*3600),
+        ('workday',8*3600), ('tomorrow',24*3600), ('testmatch',3*24*3600),
+        ('nextweek',7*24*3600) ]
+# Safety factor applied to the expected walltime of the jobs when the
+# queue is chosen (see selectqueue)
+QUEUEMARGIN = 1.3
+# Maximum number of job IDs given to a single kill command (see killarray)
+KILLCHUNK = 500
+# Maximum time (seconds) of a call to the batch system commands
+SCHEDULERTIMEOUT = 120
+# The queries to the batch system are suspended for BREAKERCOOLDOWN
+# seconds after BREAKERFAILURES failed calls within BREAKERWINDOW
+# seconds (see circuitbreaker)
+BREAKERFAILURES = 3
+BREAKERWINDOW = 600
+BREAKERCOOLDOWN = 300
+# The state of a job which could not be obtained from the cluster: the
+# last known state is kept (see clusterspec.getnextstate)
+STALE = 'stale'
 
 def get_compact_list(tasklist):
     """ Return a string-like list of all the components of the list
@@ -68,6 +89,71 @@ def get_compact_list(tasklist):
     return message
 
 
+# HTCondor job identifier: ClusterId.ProcId
+CONDORJOBID = re.compile('^[0-9]+\.[0-9]+$')
+# Empty answer from condor_q (note: not matching '10 jobs')
+NOJOBS = re.compile('(^|[^0-9])0 jobs')
+# HTCondor JobStatus classad values, translated to the condor_q ST column
+CONDORJOBSTATUS = { '1': 'I', '2': 'R', '3': 'X', '4': 'C', '5': 'H', '6': '>', '7': 'S' }
+
+class circuitbreaker(object):
+    """..class:: circuitbreaker
+    Guard of the queries to the batch system: after `maxfailures`
+    failed calls within `window` seconds the breaker opens and no
+    query is allowed during `cooldown` seconds. Afterwards a single
+    query is allowed (half-open), closing the breaker if it succeeds
+    or opening it again otherwise
+    """
+    def __init__(self,maxfailures=BREAKERFAILURES,window=BREAKERWINDOW,
+            cooldown=BREAKERCOOLDOWN):
+        """..class:: circuitbreaker([maxfailures,window,cooldown])
+        """
+        self.maxfailures = maxfailures
+        self.window      = window
+        self.cooldown    = cooldown
+        # The time of the recent failures
+        self.failures    = []
+        # The time until the breaker is open (None: closed)
+        self.openuntil   = None
+
+    def isopen(self):
+        """..method:: isopen() -> bool
+        whether the queries are suspended
+        """
+        import time
+        return self.openuntil is not None and time.time() < self.openuntil
+
+    def allow(self):
+        """..method:: allow() -> bool
+        whether a query can be sent to the batch system
+        """
+        return not self.isopen()
+
+    def failure(self):
+        """..method:: failure()
+        record a failed call, opening the breaker if needed
+        """
+        import time
+
+        now = time.time()
+        # A failure of the query allowed after the cooldown (half-open)
+        # opens the breaker again
+        halfopen = self.openuntil is not None
+        self.failures = filter(lambda t: now-t < self.window,self.failures)+[ now ]
+        if halfopen or len(self.failures) >= self.maxfailures:
+            self.openuntil = now+self.cooldown
+            self.failures  = []
+            print "\033[1;33mWARNING\033[1;m Too many failed calls to the cluster,"\
+                    " no query will be sent during the next {0} s".format(self.cooldown)
+
+    def success(self):
+        """..method:: success()
+        record a successful call, closing the breaker (the previous
+        failures are kept until they are out of the window, as the
+        answer could still be not understood)
+        """
+        self.openuntil = None
+
 class clusterspec(object):
     """Abstract class to deal with the cluster interaction. The
     commands to send and monotoring jobs to a batch systems are
@@ -107,8 +193,19 @@ class clusterspec(object):
             option in the cluster batch system sender command)
         statecom: str (NOT IMPLEMENTED, VA)
             the name of the command to monitor the jobs
+        submitrate: float
+            maximum number of jobs submitted per second (None: no limit)
+        submitburst: int
+            number of jobs which can be submitted at once before the
+            `submitrate` limit applies
         killcom: str (NOT IMPLEMENTED, VA)
             the name of the command to kill jobs
+        timeout: float
+            maximum time (seconds) of a call to the batch system commands
+            (keyword `scheduler_timeout`)
+        breaker: circuitbreaker
+            suspends the queries to the batch system after repeated
+            failures
         ID: int  [TO BE DEPRECATED, ACTUALLY NOT NEEDED]
             the identification number of the job in the batch system
         
@@ -134,6 +231,17 @@ class clusterspec(object):
         self.statecom    = None
         # Actual command to kill a job
         self.killcom     = None
+        # Maximum number of submissions per second (and burst) 
+        self.submitrate  = None
+        if kw.has_key('submit_rate') and kw['submit_rate']:
+            self.submitrate = float(kw['submit_rate'])
+        self.submitburst = 1
+        # Maximum time of the calls to the cluster and the guard of
+        # the queries
+        self.timeout     = SCHEDULERTIMEOUT
+        if kw.has_key('scheduler_timeout') and kw['scheduler_timeout']:
+            self.timeout = float(kw['scheduler_timeout'])
+        self.breaker     = circuitbreaker()
         # List of jobdescription instances
         #self.joblist     = joblist
         # The suffix for the cluster job
@@ -146,47 +254,106 @@ class clusterspec(object):
         ----------
         jobdsc: jobSender.jobsender.jobdescription
         """
-        from subprocess import Popen,PIPE
-        import os
-        cwd = os.getcwd()
-        # Going to directory of sending
-        os.chdir(jobdsc.path)
+        from executor import runcommand
         # Building the command to send to the shell:
         command = [ self.sendcom ]
         for i in self.extraopt:
             command.append(i)
         command.append(jobdsc.script+'.'+self.script_suffix)
         # Extra function for the creation of cluster scripts
-        self.create_script_if_needed(jobdsc.script)
+        self.create_script_if_needed(jobdsc.script,jobdsc.path)
 
-        # Send the command
+        # Send the command from the directory of the job (without
+        # changing the working directory, jobs can be sent concurrently)
         if self.simulate:
             p = self.simulatedresponse('submit')
         else:
-            p = Popen(command,stdout=PIPE,stderr=PIPE).communicate()
+            out,err,returncode = runcommand(command,cwd=jobdsc.path,timeout=self.gettimeout())
+            if returncode is None:
+                self.setsubmissionunknown([jobdsc],err)
+                return
+            p = out,err
 
         if p[1] != "":
             message = "ERROR from {0}:\n".format(self.sendcom)
             message += p[1]+"\n"
-            os.chdir(cwd)
             print "\033[1;31mERROR SENDING JOB TO CLUSTER\033[1;m {0}".format(message)
             self.ID = None
-            jobdsc.ID = self.ID
+            jobdsc.ID = None
             jobdsc.status = 'fail'
-            os.chdir(cwd)
             return
         ## The job-id is released in the message:
-        self.ID = self.getjobidfromcommand(p[0])
-        jobdsc.ID = self.ID
+        jobid = self.getjobidfromcommand(p[0])
+        self.ID = jobid
+        jobdsc.ID = jobid
         print "INFO:"+str(jobdsc.script)+'_'+str(jobdsc.index)+\
-                " submitted with cluster ID:"+str(self.ID)
+                " submitted with cluster ID:"+str(jobid)
         # Updating the state and status of the job
         jobdsc.state  = 'submitted'
         jobdsc.status = 'ok'
-        # Coming back to the original folder
-        os.chdir(cwd)
     
-    def getnextstate(self,jobdsc,checkfinishedjob):
+    def submitarray(self,jobdsclist):
+        """Send a list of jobs to the cluster. The generic implementation
+        sends the jobs one by one (see `submit`), the concrete classes can
+        override it in order to send all of them in a single transaction
+        with the batch system (array jobs)
+         
+        Parameters
+        ----------
+        jobdsclist: list(jobSender.jobsender.jobdescription)
+        """
+        for jobdsc in jobdsclist:
+            self.submit(jobdsc)
+
+    def setsubmissionunknown(self,jobdsclist,message):
+        """The submission command did not answer (timeout): the jobs
+        could have been queued anyway. They are kept as submitted, 
+        without cluster ID and STALE since now, so they are not 
+        resubmitted (which could duplicate them) until they are found
+        in the cluster or known to be missing (see `reconcile`)
+
+        Parameters
+        ----------
+        jobdsclist: list(jobSender.jobsender.jobdescription)
+        message: str
+            the error message of the submission
+        """
+        import time
+
+        print "\033[1;33mWARNING\033[1;m Unknown result of the submission ({0}), the"\
+                " jobs will be looked for in the cluster".format(message)
+        now = time.time()
+        for jobdsc in jobdsclist:
+            jobdsc.ID     = None
+            jobdsc.state  = 'submitted'
+            jobdsc.status = 'ok'
+            jobdsc.tstale = now
+
+    def reconcile(self,jobdsclist):
+        """Look for the jobs with an unknown submission result (see 
+        `setsubmissionunknown`) in the cluster. The jobs found take 
+        their cluster ID, and those known to be missing go back to 
+        the configured state with 'fail' status (they can be 
+        resubmitted). The generic implementation cannot look for 
+        them: the jobs are kept STALE (they can be killed and 
+        resubmitted by hand)
+
+        Parameters
+        ----------
+        jobdsclist: list(jobSender.jobsender.jobdescription)
+            the submitted jobs without cluster ID
+
+        Returns
+        -------
+        list(jobSender.jobsender.jobdescription): the jobs whose ID or
+            state were updated
+        """
+        print "\033[1;33mWARNING\033[1;m The jobs [{0}] could have been submitted,"\
+                " check them in the cluster".format(get_compact_list(map(lambda x: x.index,
+                    jobdsclist)))
+        return []
+    
+    def getnextstate(self,jobdsc,checkfinishedjob,knownstate=None):
         """Check the state and status of the job. The life of a job 
         follows the state workflow
             None -> configured -> submitted -> running -> finished
@@ -198,12 +365,34 @@ class clusterspec(object):
         jobdsc: jobsender.jobdescriptor
         checkfinishedjob: workenvfactory.workenv.checkfinishedjob 
             the function to check if the job has
+        knownstate: (str,str), optional
+            the (state,status) of the job already obtained from the
+            cluster (see `checkstates`), if not provided the cluster
+            is queried for this job alone
+
+        Notes
+        -----
+        If the state could not be obtained (STALE), the job keeps its
+        last known state and `jobdsc.tstale` records since when
         """
+        import time
+
         if not jobdsc.state:
             print "Job not configured yet, you should call the"\
                     " jobspec.preparejobs method"            
         elif jobdsc.state == 'submitted' or jobdsc.state == 'running':
-            jobdsc.state,jobdsc.status=self.checkstate(jobdsc)
+            if knownstate:
+                newstate = knownstate
+            else:
+                newstate = self.checkstate(jobdsc)
+            # The cluster could not be queried: keeping the last known
+            # state, and when it was known for the last time
+            if newstate[0] == STALE:
+                if getattr(jobdsc,'tstale',None) is None:
+                    jobdsc.tstale = time.time()
+                return
+            jobdsc.tstale = None
+            jobdsc.state,jobdsc.status=newstate
             if jobdsc.state == 'finished':
                 if self.simulate:
                     self.status = self.simulatedresponse('finishing')
@@ -240,18 +429,125 @@ class clusterspec(object):
         function to check the status of a job (running/finalized/
         aborted-failed,...). 
         """
-        from subprocess import Popen,PIPE
+        from executor import runcommand
         import os
-        if jobdsc.state == 'submitted' or jobdsc.state == 'running':
-            command = [ self.statecom, "{0}".format(jobdsc.ID) ]
+        if (jobdsc.state == 'submitted' or jobdsc.state == 'running') and \
+                jobdsc.ID is None:
+            # Submission with unknown result (see reconcile)
+            return STALE,jobdsc.status
+        elif jobdsc.state == 'submitted' or jobdsc.state == 'running':
+            # The command can include its options (condor_q -nobatch)
+            command = self.statecom.split()+[ "{0}".format(jobdsc.ID) ]
             if self.simulate:
                 p = self.simulatedresponse('checking')
             else:
-                p = Popen(command,stdout=PIPE,stderr=PIPE).communicate()
-            return self.getstatefromcommandline(p)
+                # The error messages are parsed as well
+                p = self.querycluster(command,failonerror=False)
+                if p is None:
+                    return STALE,jobdsc.status
+            state = self.getstatefromcommandline(p)
+            # Not understood, the cluster is probably not responding
+            if state[0] == STALE and not self.simulate:
+                self.getbreaker().failure()
+            return state
         else:
             return jobdsc.state,jobdsc.status
 
+    def checkstates(self,jobdsclist):
+        """..method:: checkstates(jobdsclist) -> { index: (state,status), ..}
+        
+        function to check the state of a list of jobs. The generic 
+        implementation queries the cluster once per job (see `checkstate`),
+        the concrete classes can override it in order to obtain all the 
+        states with a single query to the batch system.
+
+        Parameters
+        ----------
+        jobdsclist: list(jobsender.jobdescription)
+
+        Returns
+        -------
+        states: dict(int: (str,str))
+            the (state,status) per job index. Jobs not present in the
+            dictionary could not be resolved and must be checked 
+            individually
+        """
+        return dict(map(lambda x: (x.index,self.checkstate(x)),jobdsclist))
+
+    def getwalltimes(self,jobdsclist):
+        """..method:: getwalltimes(jobdsclist) -> { index: seconds, ..}
+
+        function to obtain the time the finished jobs were running, as
+        accounted by the batch system. The generic implementation does
+        not know how to obtain it, the concrete classes should override
+        it.
+
+        Parameters
+        ----------
+        jobdsclist: list(jobsender.jobdescription)
+
+        Returns
+        -------
+        walltimes: dict(int: float)
+            the walltime (seconds) per job index. Jobs not present in
+            the dictionary have an unknown walltime
+        """
+        return {}
+
+    def gettimeout(self):
+        """..method:: gettimeout() -> timeout
+        the maximum time (seconds) of a call to the batch system commands
+        (instances stored before the timeouts were introduced use the
+        default one)
+        """
+        return getattr(self,'timeout',SCHEDULERTIMEOUT)
+
+    def getbreaker(self):
+        """..method:: getbreaker() -> circuitbreaker
+        the guard of the queries to the batch system (created if the
+        instance was stored before the circuit breaker was introduced)
+        """
+        if getattr(self,'breaker',None) is None:
+            self.breaker = circuitbreaker()
+        return self.breaker
+
+    def querycluster(self,command,failonerror=True):
+        """..method:: querycluster(command[,failonerror]) -> (stdout,stderr)
+        send a query to the batch system, within the timeout and unless
+        the circuit breaker is open. The calls which could not be run
+        or exceeded the timeout count as failures for the breaker
+
+        Parameters
+        ----------
+        command: list(str)
+            the query command
+        failonerror: bool, optional
+            whether an error message of the command counts as a failure
+            as well (some commands report in the error output the jobs
+            not present anymore in the cluster)
+
+        Returns
+        -------
+        p: (str,str)
+            the output and error messages, None if the query was not
+            sent or failed
+        """
+        from executor import runcommand
+
+        breaker = self.getbreaker()
+        if not breaker.allow():
+            return None
+        out,err,returncode = runcommand(command,timeout=self.gettimeout())
+        if returncode is None:
+            print "\033[1;33mWARNING\033[1;m Query to the cluster failed:\n{0}".format(err)
+            breaker.failure()
+            return None
+        if failonerror and err != "":
+            breaker.failure()
+        else:
+            breaker.success()
+        return out,err
+
     @abstractmethod
     def getstatefromcommandline(self,p):
         """..method:: getstatefromcommandline() -> status
@@ -263,29 +559,103 @@ class clusterspec(object):
     
     def kill(self,jobdsc):
         """..method:: kill()
-        method to kill running-state jobs.
+        method to kill running-state jobs, see `killarray`
         """
-        from subprocess import Popen,PIPE
-        import os
-        if jobdsc.state == 'running' or jobdsc.state == 'submitted':
-            command = [ self.killcom, str(jobdsc.ID) ]
-            if self.simulate:
-                p = self.simulatedresponse('killing')
-            else:
-                p = Popen(command,stdout=PIPE,stderr=PIPE).communicate()
-            jobdsc.state  = 'configured'
-            jobdsc.status = 'ok'
-        else:
-            print "WARNING::JOB [%s] not in running or submitted state,"\
-                    " kill has no sense" % jobdsc.index
+        self.killarray([jobdsc])
+
+    def killarray(self,jobdsclist):
+        """..method:: killarray(jobdsclist)
+        kill a list of jobs with a single call to the kill command (per
+        KILLCHUNK jobs, keeping the command line short), as the batch
+        systems accept several job IDs at once. Only the jobs in running
+        or submitted state are killed, and they go back to the configured
+        state only if the kill command succeeded (otherwise they keep
+        their state, to be updated in the next check). The jobs with an
+        unknown submission result are looked for first (see `reconcile`),
+        the ones still unknown are not killed
+
+        Parameters
+        ----------
+        jobdsclist: list(jobSender.jobsender.jobdescription)
+        """
+        unknown = filter(lambda x: (x.state == 'running' or x.state == 'submitted') \
+                and x.ID is None,jobdsclist)
+        if len(unknown) != 0:
+            self.reconcile(unknown)
+        tokill = filter(lambda x: x.state == 'running' or x.state == 'submitted',
+                jobdsclist)
+        if len(tokill) != len(jobdsclist):
+            print "WARNING::JOBS [%s] not in running or submitted state,"\
+                    " kill has no sense" % get_compact_list(map(lambda x: x.index,
+                        filter(lambda x: x not in tokill,jobdsclist)))
+        stillunknown = filter(lambda x: x.ID is None,tokill)
+        if len(stillunknown) != 0:
+            print "\033[1;33mWARNING\033[1;m JOBS [{0}] could have been submitted but"\
+                    " were not found in the cluster, not killed".format(
+                            get_compact_list(map(lambda x: x.index,stillunknown)))
+        tokill = filter(lambda x: x.ID is not None,tokill)
+        for i in xrange(0,len(tokill),KILLCHUNK):
+            chunk = tokill[i:i+KILLCHUNK]
+            if not self.removejobs(map(lambda x: str(x.ID),chunk)):
+                print "\033[1;33mWARNING\033[1;m JOBS [{0}] could not be killed, their"\
+                        " state will be updated in the next check".format(
+                                get_compact_list(map(lambda x: x.index,chunk)))
+                continue
+            for jobdsc in chunk:
+                jobdsc.state  = 'configured'
+                jobdsc.status = 'ok'
+
+    def removejobs(self,ids):
+        """..method:: removejobs(ids)
+        remove jobs from the cluster with a single call to the kill
+        command
+
+        Parameters
+        ----------
+        ids: list(str)
+            the cluster IDs of the jobs
+
+        Returns
+        -------
+        bool: whether the kill command succeeded (it fails as well if
+            any of the jobs was already finished)
+        """
+        from executor import runcommand
+
+        if self.simulate:
+            p = self.simulatedresponse('killing')
+            return True
+        out,err,returncode = runcommand([ self.killcom ]+ids,timeout=self.gettimeout())
+        if err != "":
+            print "\033[1;33mWARNING\033[1;m Message from {0}:\n{1}".format(
+                    self.killcom,err)
+        return returncode == 0
+
+    def selectqueue(self,walltime):
+        """..method:: selectqueue(walltime) -> queue
+        choose the queue where the jobs are sent from their expected
+        walltime. By default the queue is not changed, the clusters
+        with queues defined by their maximum duration should override it
+
+        Parameters
+        ----------
+        walltime: float
+            the expected walltime (seconds) of the longest job
+
+        Returns
+        -------
+        str: the queue (None if the cluster does not handle it)
+        """
+        return None
 
     @abstractmethod
-    def create_script_if_needed(self,filename):
+    def create_script_if_needed(self,filename,path='.'):
         """..method:: create_script_if_neeed() 
-        Create cluster specific files (for HTcondor actually)
+        Create cluster specific files (for HTcondor actually) inside
+        the job folder `path`
         """
         raise NotImplementedError("Class %s doesn't implement "\
-                "create_scrip_if_needed(filename)" % (self.__class__.__name__))
+                "create_scrip_if_needed(filename,path)" % (self.__class__.__name__))
 
     @abstractmethod
     def failed(self):
@@ -314,28 +684,47 @@ class cerncluster(clusterspec):
 
     Notes
     -----
-    There is an API of the HTCondor  (import htcondor) which could
-    be worth it to introduce..
+    The cluster can be driven through the HTCondor python bindings
+    (import htcondor) instead of the command line tools, see getschedd
     """
     def __init__(self,**kw):#joblist=None,**kw):
         """..class:: cerncluster 
         Concrete implementation of the clusterspec class dealing with
         the cluster at cern (usign lxplus as UI)
+
+        Parameters
+        ----------
+        queue: str, optional
+            the job flavour, one of JOBFLAVOURS [Default: longlunch]
+        condor_bindings: bool, optional
+            whether to use the HTCondor python bindings to submit,
+            query and remove the jobs (the command line tools are used
+            if the bindings are not available) [Default: False]
         """
+        import threading
+
         super(cerncluster,self).__init__(**kw)#joblist,**kw)
         self.sendcom   = 'condor_submit'
         self.statecom  = 'condor_q -nobatch'
-        self.killcom   = 'bkill'
+        self.killcom   = 'condor_rm'
         self.script_suffix = 'sub'
+        # The queue is the job flavour, included in the submit files
+        available_q = map(lambda (flavour,duration): flavour,JOBFLAVOURS)
         if kw.has_key('queue') and kw['queue']:
-            queue = kw['queue']
-            # FIXME: Check that is a condor queue
-            # max. duration: 20 min., 1h, 2h, 8h, 1d, 3d, 1w
-            available_q = [ 'espresso', 'microcentury', 'longlunch', 'workday',
-                    'tomorrow', 'testmatch', 'nextweek' ]
+            if kw['queue'] not in available_q:
+                raise AttributeError('Job flavour not recognized: "{0}", the valid'\
+                        ' ones are: {1}'.format(kw['queue'],', '.join(available_q)))
+            self.queue = kw['queue']
         else:
-            queue = 'longlunch'
-        self.extraopt  += [ '--queue', queue ]
+            self.queue = 'longlunch'
+        # The HTCondor python bindings: the Schedd handle is created once
+        # per process (see getschedd), and the calls are serialized as
+        # the jobs can be submitted from several threads
+        self.usebindings = False
+        if kw.has_key('condor_bindings') and kw['condor_bindings']:
+            self.usebindings = True
+        self.schedd = None
+        self.scheddlock = threading.Lock()
         ## Need to include the cluster file: need the jobdescription
         
     
@@ -377,6 +766,18 @@ class cerncluster(clusterspec):
             raise RuntimeError('Undefined action "%s"' % action)
 
 
+    def submit(self,jobdsc):
+        """Send a job to the cluster, through the python bindings (see
+        submitarray) if they are used
+
+        Parameters
+        ----------
+        jobdsc: jobSender.jobsender.jobdescription
+        """
+        if self.getschedd() is None:
+            return super(cerncluster,self).submit(jobdsc)
+        self.submitarray([jobdsc])
+
     def getjobidfromcommand(self,p):
         """..method:: getjobidfromcommand()
         function to obtain the job-ID (clusterID, in HT-Condor notation) 
@@ -409,44 +810,382 @@ class cerncluster(clusterspec):
         """
         # condor_q output
         # ID, OWNER, SUBMITTED, RUN_TIME, ST, PRI, SIZE, CMD
+        if NOJOBS.search(p[0]):
+            return 'finished','ok'
+        # Multiple job task: one line per process of the cluster after
+        # the header, the state of the cluster is the combination of all
+        statuslist = []
+        for jobinfoline in p[0].split('\n')[3:]:
+            tokens = jobinfoline.split()
+            if len(tokens) < 6 or not CONDORJOBID.match(tokens[0]):
+                continue
+            # Sixth element
+            statuslist.append(tokens[5])
+        if len(statuslist) == 0:
+            message='No interpretation yet of the message (%s,%s).' % (p[0],p[1])
+            message+=' Cluster message parser needs to be updated'
+            message+='(cerncluster.getstatefromcommandline method).'
+            message+='\nWARNING: keeping the last known state'
+            print message
+            return STALE,'ok'
+        return self.mergestates(map(self.getstatefromcode,statuslist))
+
+    def getstatefromcode(self,status):
+        """..method:: getstatefromcode(status) -> state,status
+        function to translate the HTCondor job status code into the 
+        (state,status) of a job
+
+        Parameters
+        ----------
+        status: str
+            the status code as shown by the ST column of `condor_q -nobatch`
+            (I,R,C,X,...) or the numerical JobStatus classad (1,2,...)
 
-        isfinished=False
-        if p[0].find('0 jobs') != -1: 
+        Returns
+        -------
+        id: (str,str)
+            the state and status
+        """
+        # JobStatus classad -> ST column letter
+        status = CONDORJOBSTATUS.get(status,status)
+        if status == 'I' or status == '<':
+            return 'submitted','ok'
+        # '>' stands for transferring output
+        elif status == 'R' or status == '>':
+            return 'running','ok'
+        elif status == 'C':
             return 'finished','ok'
+        # ??? Removed is aborted?
+        elif status == 'X':
+            return 'aborted','ok'
+        # Held, waiting for someone to release it (condor_release): 
+        # the job is still alive in the queue, not to be resubmitted
+        elif status == 'H':
+            return 'submitted','ok'
+        # Suspended, the execution is temporarily stopped
+        elif status == 'S':
+            return 'running','ok'
         else:
-            # XXX-- Multiple job task : [3:-1]
-            jobinfoline = p[0].split('\n')[3]
-            # Third element
-            status = jobinfoline.split()[5]
-            if status == 'I':
-                return 'submitted','ok'
-            elif status == 'R':
-                return 'running','ok'
-            elif status == 'C':
-                return 'finished','ok'
-            # ??? Removed is aborted?
-            elif status == 'X':
-                return 'aborted','ok'
-            ## elif status == 'H':
-            #  HOLD status, waiting for someone to re-schedule the job
-            ## elif status == 'X':
-            #  rEMOVED status, 
-            ## elif status == 'S':
-            #  suspended  status, execution temp. suspended
+            message='I have no idea of the state parsed in the cluster'
+            message+=' as "%s". Parser should be updated\n' % status
+            message+='WARNING: forcing "None" state'
+            print message
+            return None,'fail'
+
+    def mergestates(self,statelist):
+        """..method:: mergestates(statelist) -> state,status
+        function to combine the states of all the processes of a 
+        multiple job task. The task is considered still alive while
+        any of its processes is, and finished only when all of them 
+        are finished
+
+        Parameters
+        ----------
+        statelist: list((str,str))
+            the (state,status) of each process
+
+        Returns
+        -------
+        id: (str,str)
+            the state and status
+        """
+        for state in [ None, 'running', 'submitted', 'aborted' ]:
+            found = filter(lambda (ste,stus): ste == state,statelist)
+            if len(found) != 0:
+                return found[0]
+        return 'finished','ok'
+
+    def checkstates(self,jobdsclist):
+        """..method:: checkstates(jobdsclist) -> { index: (state,status), ..}
+        
+        function to check the state of a list of jobs with a single
+        `condor_q` query over all the cluster IDs involved. The jobs
+        which are not anymore in the queue are considered finished
+        (equivalent to the '0 jobs' answer of `checkstate`)
+
+        Parameters
+        ----------
+        jobdsclist: list(jobsender.jobdescription)
+
+        Returns
+        -------
+        states: dict(int: (str,str))
+            the (state,status) per job index, STALE for all of them
+            if the cluster could not be queried
+        """
+        activejobs = filter(lambda x: (x.state == 'submitted' or \
+                x.state == 'running') and x.ID is not None,jobdsclist)
+        if len(activejobs) == 0 or self.simulate:
+            return super(cerncluster,self).checkstates(activejobs)
+        clusterids = sorted(set(map(lambda x: str(x.ID).split('.')[0],activejobs)))
+        statemap = self.querystates(clusterids)
+        if statemap == STALE:
+            return dict(map(lambda x: (x.index,(STALE,x.status)),activejobs))
+        elif statemap is None:
+            return {}
+        # A cluster ID alone stands for all its processes
+        clusterstates = {}
+        for jobid,st in statemap.iteritems():
+            clusterstates.setdefault(jobid.split('.')[0],[]).append(st)
+
+        states = {}
+        for jobdsc in activejobs:
+            jobid = str(jobdsc.ID)
+            if jobid.find('.') == -1:
+                procstates = clusterstates.get(jobid,[])
             else:
-                message='I have no idea of the state parsed in the cluster'
-                message+=' as "%s". Parser should be updated\n' % status
-                message+='WARNING: forcing "None" state'
-                print message
-                return None,'fail'
-        #else:
-        #    message='No interpretation yet of the message (%s,%s).' % (p[0],p[1])
-        #    message+='Cluster message parser needs to be updated'
-        #    message+='(cerncluster.getstatefromcommandline method).'
-        #    message+='\nWARNING: forcing "aborted" state'
-        #    print message
-        #    return 'aborted','fail'
-    
+                procstates = filter(None,[ statemap.get(jobid) ])
+            if len(procstates) == 0:
+                # Not in the queue anymore
+                states[jobdsc.index] = ('finished','ok')
+            else:
+                states[jobdsc.index] = self.mergestates(procstates)
+        return states
+
+    def querystates(self,clusterids):
+        """..method:: querystates(clusterids) -> { jobid: (state,status), ..}
+        function to obtain the state of all the jobs of the given clusters
+        with a single query, either `condor_q -af ClusterId ProcId JobStatus`
+        or a query of the Schedd (projected to those attributes) if the
+        python bindings are used
+
+        Parameters
+        ----------
+        clusterids: list(str)
+            the cluster IDs
+
+        Returns
+        -------
+        states: dict(str: (str,str))
+            the state and status per job id (ClusterId.ProcId), None
+            if the query failed (the jobs can be checked one by one) or
+            STALE if the cluster could not be queried (timeout or circuit
+            breaker open)
+        """
+        breaker = self.getbreaker()
+        if not breaker.allow():
+            return STALE
+        schedd = self.getschedd()
+        if schedd is not None:
+            constraint = ' || '.join(map(lambda x: 'ClusterId == {0}'.format(x),clusterids))
+            try:
+                with self.scheddlock:
+                    ads = list(schedd.xquery(constraint,[ 'ClusterId', 'ProcId', 'JobStatus' ]))
+            except (RuntimeError,IOError,ValueError) as e:
+                print "\033[1;33mWARNING\033[1;m Bulk query to the Schedd failed,"\
+                        " checking the jobs one by one:\n{0}".format(e)
+                breaker.failure()
+                return None
+            breaker.success()
+            return dict(map(lambda ad: ('{0}.{1}'.format(ad['ClusterId'],ad['ProcId']),
+                self.getstatefromcode(str(ad['JobStatus']))),ads))
+        command = [ 'condor_q', '-af', 'ClusterId', 'ProcId', 'JobStatus' ]+clusterids
+        p = self.querycluster(command)
+        if p is None:
+            return STALE
+        if p[1] != "":
+            print "\033[1;33mWARNING\033[1;m Bulk query to the cluster failed,"\
+                    " checking the jobs one by one:\n{0}".format(p[1])
+            return None
+        return self.getstatesfromcommandline(p)
+
+    def getstatesfromcommandline(self,p):
+        """..method:: getstatesfromcommandline() -> { jobid: (state,status), ..}
+        function to parse the state of several jobs obtained with
+        the `condor_q -af ClusterId ProcId JobStatus` command
+        
+        Parameters
+        ----------
+        p: (str,str)
+            tuple corresponding to the return value of the 
+            subprocess.Popen.communicate, i.e. (stdoutdata, stderrdat)
+
+        Returns
+        -------
+        states: dict(str: (str,str))
+            the state and status per job id (ClusterId.ProcId)
+
+        Note
+        ----
+        An output example provided by the condor_q -af command is:
+            
+            3205766 0 2
+            3205766 1 1
+            3205767 0 1
+        """
+        statemap = {}
+        for jobinfoline in p[0].split('\n'):
+            tokens = jobinfoline.split()
+            if len(tokens) != 3:
+                continue
+            statemap['{0}.{1}'.format(tokens[0],tokens[1])] = self.getstatefromcode(tokens[2])
+        return statemap
+
+    def queryads(self,constraint,attributes,history=False):
+        """..method:: queryads(constraint,attributes[,history]) -> rows
+        function to obtain some attributes of the jobs matching a
+        constraint, either from the queue (`condor_q`) or from the
+        history (`condor_history`) of the Schedd, through the python
+        bindings if they are used
+
+        Parameters
+        ----------
+        constraint: str
+            the ClassAd expression selecting the jobs
+        attributes: list(str)
+            the attributes to be obtained (the last one can contain
+            spaces)
+        history: bool, optional
+            whether to look into the history instead of the queue
+
+        Returns
+        -------
+        rows: list(list(str))
+            the values of the attributes per job ('undefined' if the
+            job has not the attribute), None if the query failed
+        """
+        breaker = self.getbreaker()
+        schedd = self.getschedd()
+        if schedd is not None:
+            if not breaker.allow():
+                return None
+            try:
+                with self.scheddlock:
+                    if history:
+                        ads = list(schedd.history(constraint,attributes,-1))
+                    else:
+                        ads = list(schedd.xquery(constraint,attributes))
+            except (RuntimeError,IOError,ValueError) as e:
+                print "\033[1;33mWARNING\033[1;m Query to the Schedd failed:\n{0}".format(e)
+                breaker.failure()
+                return None
+            breaker.success()
+            return map(lambda ad: map(lambda attr: str(ad.get(attr,'undefined')),attributes),
+                    ads)
+        if history:
+            command = [ 'condor_history' ]
+        else:
+            command = [ 'condor_q' ]
+        p = self.querycluster(command+[ '-af' ]+attributes+[ '-constraint', constraint ])
+        if p is None or p[1] != "":
+            return None
+        rows = map(lambda line: line.split(None,len(attributes)-1),p[0].split('\n'))
+        return filter(lambda tokens: len(tokens) == len(attributes),rows)
+
+    def reconcile(self,jobdsclist):
+        """Look for the jobs with an unknown submission result in the
+        queue and in the history of the Schedd: the jobs queued from the
+        job folder (Iwd) since the submission. The jobs found take their
+        ClusterId.ProcId, the ones not found anywhere go back to the 
+        configured state with 'fail' status
+
+        Parameters
+        ----------
+        jobdsclist: list(jobSender.jobsender.jobdescription)
+            the submitted jobs without cluster ID
+
+        Returns
+        -------
+        list(jobSender.jobsender.jobdescription): the jobs whose ID or
+            state were updated
+        """
+        import os
+
+        if self.simulate or len(jobdsclist) == 0:
+            return []
+        bypath = dict(map(lambda x: (os.path.abspath(x.path),x),jobdsclist))
+        constraint = ' || '.join(map(lambda path: 'Iwd == "{0}"'.format(path),
+            sorted(bypath.keys())))
+        # Queued at most a timeout before the submission was registered
+        submitted = filter(None,map(lambda x: getattr(x,'tsubmitted',None),jobdsclist))
+        if submitted:
+            constraint = '({0}) && QDate >= {1}'.format(constraint,
+                    int(min(submitted)-self.gettimeout()-60))
+        attributes = [ 'ClusterId', 'ProcId', 'Iwd' ]
+        found = {}
+        for history in [ False, True ]:
+            rows = self.queryads(constraint,attributes,history)
+            if rows is None:
+                # Unknown: to be tried again in the next check
+                return []
+            # The most recent job of the folder
+            for clusterid,procid,path in sorted(rows,key=lambda x: int(x[0])):
+                if bypath.has_key(path.strip()):
+                    found[path.strip()] = '{0}.{1}'.format(clusterid,procid)
+        for path,jobdsc in bypath.iteritems():
+            if found.has_key(path):
+                jobdsc.ID = found[path]
+            else:
+                print "\033[1;33mWARNING\033[1;m Job [{0}] not found in the cluster,"\
+                        " it was not submitted".format(jobdsc.index)
+                jobdsc.state  = 'configured'
+                jobdsc.status = 'fail'
+            jobdsc.tstale = None
+        return bypath.values()
+
+    def getwalltimes(self,jobdsclist):
+        """..method:: getwalltimes(jobdsclist) -> { index: seconds, ..}
+        function to obtain the walltime of the finished jobs from the
+        history of the Schedd, with a single `condor_history` query (or
+        a query of the Schedd history if the python bindings are used).
+        The walltime is the duration of the last execution of the job
+        (CompletionDate-JobCurrentStartDate), or the accumulated
+        RemoteWallClockTime if the dates are not available. A job with
+        several processes took the walltime of the longest one
+
+        Parameters
+        ----------
+        jobdsclist: list(jobsender.jobdescription)
+
+        Returns
+        -------
+        walltimes: dict(int: float)
+            the walltime (seconds) per job index, the jobs not found in
+            the history (or if it could not be queried) are not present
+        """
+        finished = filter(lambda x: x.ID is not None,jobdsclist)
+        if len(finished) == 0 or self.simulate:
+            return {}
+        clusterids = sorted(set(map(lambda x: str(x.ID).split('.')[0],finished)))
+        constraint = ' || '.join(map(lambda x: 'ClusterId == {0}'.format(x),clusterids))
+        attributes = [ 'ClusterId', 'ProcId', 'CompletionDate', 'JobCurrentStartDate',
+                'RemoteWallClockTime' ]
+        rows = self.queryads(constraint,attributes,history=True)
+        if rows is None:
+            return {}
+
+        def _float(value):
+            try:
+                return float(value)
+            except ValueError:
+                # 'undefined' attributes
+                return 0.0
+        walltimemap = {}
+        for tokens in filter(lambda x: len(x) == len(attributes),rows):
+            completion,start,remote = map(_float,tokens[2:])
+            if completion > 0 and start > 0 and completion > start:
+                walltime = completion-start
+            elif remote > 0:
+                walltime = remote
+            else:
+                continue
+            walltimemap['{0}.{1}'.format(tokens[0],tokens[1])] = walltime
+        # A cluster ID alone stands for all its processes
+        clusterwalltimes = {}
+        for jobid,walltime in walltimemap.iteritems():
+            clusterid = jobid.split('.')[0]
+            clusterwalltimes[clusterid] = max(walltime,clusterwalltimes.get(clusterid,0))
+        walltimes = {}
+        for jobdsc in finished:
+            jobid = str(jobdsc.ID)
+            if jobid.find('.') == -1:
+                walltime = clusterwalltimes.get(jobid)
+            else:
+                walltime = walltimemap.get(jobid)
+            if walltime:
+                walltimes[jobdsc.index] = walltime
+        return walltimes
+
     # DEPRECATED
     #def setjobstate(self,jobds,command):
     #    """..method:: setjobstate(jobds,action) 
@@ -481,8 +1220,281 @@ class cerncluster(clusterspec):
         raise NotImplementedError("Class %s doesn't implement "\
                  "done()" % (self.__class__.__name__))
 
-    def create_script_if_needed(self,filename):
-        """Create the file to be sent to the cluster
+    def submitarray(self,jobdsclist):
+        """Send a list of jobs to the cluster with a single `condor_submit`
+        call. A submit description file is created in the current folder,
+        queueing one process per job folder. Each job is identified by its
+        ClusterId.ProcId, being the ProcId the position of the job in the
+        list
+         
+        Parameters
+        ----------
+        jobdsclist: list(jobSender.jobsender.jobdescription)
+        """
+        from executor import runcommand
+
+        if len(jobdsclist) == 0:
+            return
+        # All the jobs share the same script
+        filename = jobdsclist[0].script
+        if self.getschedd() is not None:
+            p = self.submitwithbindings(filename,map(lambda x: x.path,jobdsclist))
+        else:
+            subfile = self.create_arrayscript(filename,map(lambda x: x.path,jobdsclist))
+            # Building the command to send to the shell:
+            command = [ self.sendcom ]
+            for i in self.extraopt:
+                command.append(i)
+            command.append(subfile)
+
+            # Send the command
+            if self.simulate:
+                p = self.simulatedresponse('submit')
+            else:
+                out,err,returncode = runcommand(command,timeout=self.gettimeout())
+                if returncode is None:
+                    self.setsubmissionunknown(jobdsclist,err)
+                    return
+                p = out,err
+
+        if p[1] != "":
+            message = "ERROR from {0}:\n".format(self.sendcom)
+            message += p[1]+"\n"
+            print "\033[1;31mERROR SENDING JOBS TO CLUSTER\033[1;m {0}".format(message)
+            self.ID = None
+            for jobdsc in jobdsclist:
+                jobdsc.ID = self.ID
+                jobdsc.status = 'fail'
+            return
+        ## The cluster-id is released in the message, the process-id
+        ## follows the queue order
+        self.ID = self.getjobidfromcommand(p[0])
+        for (procid,jobdsc) in enumerate(jobdsclist):
+            jobdsc.ID = "{0}.{1}".format(self.ID,procid)
+            # Updating the state and status of the job
+            jobdsc.state  = 'submitted'
+            jobdsc.status = 'ok'
+        print "INFO:"+str(filename)+'_['+get_compact_list(map(lambda x: x.index,jobdsclist))+\
+                "] submitted with cluster ID:"+str(self.ID)
+
+    def __getstate__(self):
+        """The Schedd handle and its lock are not stored
+        """
+        state = self.__dict__.copy()
+        state.pop('schedd',None)
+        state.pop('scheddlock',None)
+        return state
+
+    def __setstate__(self,state):
+        """Instances stored before the migration to HTCondor used the
+        LSF kill command
+        """
+        import threading
+
+        self.__dict__.update(state)
+        if self.killcom == 'bkill':
+            self.killcom = 'condor_rm'
+        self.schedd = None
+        self.scheddlock = threading.Lock()
+
+    def getschedd(self):
+        """The handle of the HTCondor scheduler, created the first time
+        it is needed and re-used afterwards.
+
+        Returns
+        -------
+        htcondor.Schedd: the scheduler, or None if the python bindings
+            are not used (not requested, simulation mode, the htcondor
+            module cannot be imported or the scheduler cannot be located)
+        """
+        if not getattr(self,'usebindings',False) or self.simulate:
+            return None
+        with self.scheddlock:
+            if self.schedd is None:
+                try:
+                    import htcondor
+                except ImportError:
+                    print "\033[1;33mWARNING\033[1;m The HTCondor python bindings are"\
+                            " not available, using the command line tools"
+                    self.schedd = False
+                    return None
+                # HTCondorLocateError (recent bindings) or RuntimeError
+                errors = (RuntimeError,IOError,ValueError,
+                        getattr(htcondor,'HTCondorException',RuntimeError))
+                try:
+                    self.schedd = htcondor.Schedd()
+                except errors as e:
+                    print "\033[1;33mWARNING\033[1;m The HTCondor scheduler could not be"\
+                            " located ({0}), using the command line tools".format(e)
+                    self.schedd = False
+        if self.schedd is False:
+            return None
+        return self.schedd
+
+    def removejobs(self,ids):
+        """Remove jobs from the cluster with a single call, either to
+        `condor_rm` or to the Schedd if the python bindings are used
+
+        Parameters
+        ----------
+        ids: list(str)
+            the cluster IDs of the jobs (ClusterId.ProcId or ClusterId)
+
+        Returns
+        -------
+        bool: whether the jobs were removed
+        """
+        schedd = self.getschedd()
+        if schedd is None:
+            return super(cerncluster,self).removejobs(ids)
+        import htcondor
+
+        def _constraint(jobid):
+            if jobid.find('.') == -1:
+                return '(ClusterId == {0})'.format(jobid)
+            return '(ClusterId == {0} && ProcId == {1})'.format(*jobid.split('.'))
+        try:
+            with self.scheddlock:
+                schedd.act(htcondor.JobAction.Remove,' || '.join(map(_constraint,ids)))
+        except (RuntimeError,IOError,ValueError) as e:
+            print "\033[1;33mWARNING\033[1;m Message from the Schedd:\n{0}".format(e)
+            return False
+        return True
+
+    def selectqueue(self,walltime):
+        """Choose the shortest job flavour whose maximum duration is
+        longer than the expected walltime of the jobs (with a QUEUEMARGIN
+        safety factor), as the shorter flavours start faster
+
+        Parameters
+        ----------
+        walltime: float
+            the expected walltime (seconds) of the longest job
+
+        Returns
+        -------
+        str: the job flavour
+        """
+        fitting = filter(lambda (flavour,duration): walltime*QUEUEMARGIN <= duration,
+                JOBFLAVOURS)
+        if len(fitting) == 0:
+            print "\033[1;33mWARNING\033[1;m The expected walltime of the jobs ({0:.0f} s)"\
+                    " exceeds the longest job flavour, more jobs are needed".format(walltime)
+            self.queue = JOBFLAVOURS[-1][0]
+        else:
+            self.queue = fitting[0][0]
+        print "\033[1;34mINFO\033[1;m Using the job flavour '{0}' (expected walltime"\
+                " {1:.0f} s)".format(self.queue,walltime)
+        return self.queue
+
+    def getflavourline(self):
+        """The job flavour statement of the submit files (empty for the
+        instances created before the flavour was included in them)
+        """
+        if not getattr(self,'queue',None):
+            return []
+        return ['+JobFlavour             = "{0}"\n'.format(self.queue)]
+
+    def submitwithbindings(self,filename,pathlist):
+        """Submit the jobs in a single transaction of the Schedd, with
+        the submit description of create_arrayscript (one process per
+        job folder, following the order of the list)
+
+        Parameters
+        ----------
+        filename: str
+            the name of the script (without suffix) of the jobs
+        pathlist: list(str)
+            the folders of the jobs
+
+        Returns
+        -------
+        (str,str): the equivalent to the output and error messages of
+            the `condor_submit` command
+        """
+        import htcondor
+        import os
+
+        submit = htcondor.Submit(dict(self.getsubmitdescription(filename)))
+        itemdata = map(lambda path: { 'jobpath': os.path.abspath(path) },pathlist)
+        for path in pathlist:
+            self.createlogfolders(path)
+        try:
+            with self.scheddlock:
+                with self.schedd.transaction() as txn:
+                    result = submit.queue_with_itemdata(txn,1,iter(itemdata))
+        except (RuntimeError,IOError,ValueError) as e:
+            return "",str(e) or e.__class__.__name__
+        return "{0} job(s) submitted to cluster {1}.".format(len(pathlist),result.cluster()),""
+
+    def getsubmitdescription(self,filename):
+        """The submit description of the jobs sent in a single
+        transaction, being `jobpath` the folder of each job
+
+        Parameters
+        ----------
+        filename: str
+            the name of the script (without suffix) of the jobs
+
+        Returns
+        -------
+        list((str,str)): the commands of the submit description
+        """
+        description = [ ('executable','$(jobpath)/{0}.sh'.format(filename)),
+                ('arguments','$(ClusterId)$(ProcId)'),
+                ('initialdir','$(jobpath)'),
+                ('output','output/$(ClusterId).$(ProcId).out'),
+                ('error','output/$(ClusterId).$(ProcId).err'),
+                ('log','output/$(ClusterId).log') ]
+        if getattr(self,'queue',None):
+            description.append( ('+JobFlavour','"{0}"'.format(self.queue)) )
+        return description
+
+    def createlogfolders(self,path):
+        """Create the output and log folders of a job (if there are not)
+        """
+        import os
+
+        for folder in [ 'output', 'log' ]:
+            try:
+                os.mkdir(os.path.join(path,folder))
+            except OSError:
+                pass
+
+    def create_arrayscript(self,filename,pathlist):
+        """Create the file to be sent to the cluster in order to 
+        submit all the jobs in a single transaction. The job folders
+        are used as initial directory of each process
+
+        Parameters
+        ----------
+        filename: str
+            the name of the script (without suffix) of the jobs
+        pathlist: list(str)
+            the folders of the jobs
+
+        Returns
+        -------
+        str: the name of the created file
+        """
+        import os 
+
+        lines = map(lambda (command,value): "{0:<24}= {1}\n".format(command,value),
+                self.getsubmitdescription(filename))
+        lines+= ["queue jobpath from (\n"]
+        for path in pathlist:
+            lines+= ["    {0}\n".format(os.path.abspath(path))]
+            # And create the output and log folders (if there are not)
+            self.createlogfolders(path)
+        lines+= [")\n"]
+        subfile = '{0}_array.{1}'.format(filename,self.script_suffix)
+        with open(subfile, 'w') as f:
+            f.writelines(lines)
+        return subfile
+
+    def create_script_if_needed(self,filename,path='.'):
+        """Create the file to be sent to the cluster inside the job 
+        folder `path`
         """
         import os 
 
@@ -491,19 +1503,13 @@ class cerncluster(clusterspec):
         lines+= ["output                  = output/$(ClusterId).$(ProcId).out\n"]
         lines+= ["error                   = output/$(ClusterId).$(ProcId).err\n"]
         lines+= ["log                     = output/$(ClusterId).log\n"]
+        lines+= self.getflavourline()
         lines+= ["queue\n"]
         #lines+= ["queue filename matching (exec/job_*sh)"]
-        with open('{0}.{1}'.format(filename,self.script_suffix), 'w') as f:#
+        with open(os.path.join(path,'{0}.{1}'.format(filename,self.script_suffix)), 'w') as f:#
             f.writelines(lines)
         # And create the output and log folders (if there are not)
-        try: 
-            os.mkdir('output')
-        except OSError:
-            pass
-        try: 
-            os.mkdir('log')
-        except OSError:
-            pass
+        self.createlogfolders(path)
     
 clusterspec.register(cerncluster)
 
@@ -519,6 +1525,8 @@ class taucluster(clusterspec):
         queue: str, { 'N', 'P', 'S', 'atlas', 'HEP' }
             the name of the queue, see details and requirements of each
             queue in `qstat -Q -f`
+        submit_rate: float, optional
+            maximum number of jobs sent per second [Default: 0.5]
 
         """
         super(taucluster,self).__init__(**kw)#joblist,**kw)
@@ -526,6 +1534,10 @@ class taucluster(clusterspec):
         self.statecom  = 'qstat'
         self.killcom   = 'qdel'
         self.script_suffix = 'sh'
+        # The PBS server does not cope with fast submissions: 1 job
+        # every 2 seconds, if not set by the user
+        if not self.submitrate:
+            self.submitrate = 0.5
         if kw.has_key('queue') and kw['queue']:
             queue = kw['queue']
         else:
@@ -617,8 +1629,9 @@ class taucluster(clusterspec):
         """
         # new attribute
         if not hasattr(self,"server_name"):
-            self.server_name = '.'.join(p.split('.')[1:])
-        return int(p.split('.')[0])
+            self.server_name = '.'.join(p.strip().split('.')[1:])
+        # Array jobs are given as INT[].tau-cream.hep.tau.ac.il
+        return int(p.split('.')[0].split('[')[0])
     
     def getstatefromcommandline(self,p):
         """parse the state of a job
@@ -644,8 +1657,6 @@ class taucluster(clusterspec):
         """
         # qstat output
         # Job id  Name User Time Use Status Queue
-
-        isfinished=False
         if p[0].find('qstat: Unknown Job Id') != -1 or \
                 p[1].find('qstat: Unknown Job Id') != -1: 
             return 'finished','ok'
@@ -654,29 +1665,169 @@ class taucluster(clusterspec):
             jobinfoline = p[0].split('\n')[2]
             # fourth element
             status = jobinfoline.split()[4]
-            if status == 'Q':
-                return 'submitted','ok'
-            elif status == 'R':
-                return 'running','ok'
-            elif status == 'C':
-                return 'finished','ok'
-            elif status == 'E':
-                return 'aborted','ok'
-            else:
-                kw
-                message='I have no idea of the state parsed in the cluster'
-                message+=' as "%s". Parser should be updated\n' % status
-                message+='WARNING: forcing "None" state'
-                print message
-                return None,'fail'
+            return self.getstatefromcode(status)
         else:
             message='No interpretation yet of the message (%s,%s).' % (p[0],p[1])
             message+=' Cluster message parser needs to be updated'
             message+='(taucluster.getstatefromcommandline method).'
-            message+='\nWARNING: forcing "aborted" state'
+            message+='\nWARNING: keeping the last known state'
             print message
-            return 'aborted','fail'
-    
+            return STALE,'ok'
+
+    def getstatefromcode(self,status):
+        """translate the PBS job state code into the (state,status) 
+        of a job
+
+        Parameters
+        ----------
+        status: str
+            the job state code (Q,R,C,E,...) as shown by `qstat`
+
+        Returns
+        -------
+        id: (str,str)
+            the state and status
+        """
+        # Held (H), waiting for its start time (W) or being moved (T):
+        # still alive in the queue
+        if status == 'Q' or status == 'H' or status == 'W' or status == 'T':
+            return 'submitted','ok'
+        # Suspended (S), the execution is temporarily stopped
+        elif status == 'R' or status == 'S':
+            return 'running','ok'
+        elif status == 'C':
+            return 'finished','ok'
+        elif status == 'E':
+            return 'aborted','ok'
+        else:
+            message='I have no idea of the state parsed in the cluster'
+            message+=' as "%s". Parser should be updated\n' % status
+            message+='WARNING: forcing "None" state'
+            print message
+            return None,'fail'
+
+    def checkstates(self,jobdsclist):
+        """check the state of a list of jobs using a single snapshot
+        of the PBS server (`qstat -x`). The jobs not present in the 
+        snapshot are considered finished (equivalent to the 'Unknown
+        Job Id' answer of `checkstate`)
+
+        Parameters
+        ----------
+        jobdsclist: list(jobsender.jobdescription)
+
+        Returns
+        -------
+        states: dict(int: (str,str))
+            the (state,status) per job index, STALE for all of them
+            if the cluster could not be queried
+        """
+        from xml.parsers.expat import ExpatError
+
+        activejobs = filter(lambda x: (x.state == 'submitted' or \
+                x.state == 'running') and x.ID is not None,jobdsclist)
+        if len(activejobs) == 0 or self.simulate:
+            return super(taucluster,self).checkstates(activejobs)
+        # -t: expand the array jobs into its elements
+        command = [ self.statecom, '-x', '-t' ]
+        p = self.querycluster(command)
+        if p is None:
+            return dict(map(lambda x: (x.index,(STALE,x.status)),activejobs))
+        if p[1] != "":
+            print "\033[1;33mWARNING\033[1;m Bulk query to the cluster failed,"\
+                    " checking the jobs one by one:\n{0}".format(p[1])
+            return {}
+        try:
+            statemap = self.getstatesfromcommandline(p)
+        except (ExpatError,KeyError,TypeError) as e:
+            # Truncated or corrupted answer, or not the expected
+            # structure (<Data/>, a Job without job_state, ...)
+            print "\033[1;33mWARNING\033[1;m No interpretation of the answer of the"\
+                    " cluster ({0}), keeping the last known state".format(e)
+            self.getbreaker().failure()
+            return dict(map(lambda x: (x.index,(STALE,x.status)),activejobs))
+
+        states = {}
+        for jobdsc in activejobs:
+            states[jobdsc.index] = statemap.get(str(jobdsc.ID).split('.')[0],
+                    ('finished','ok'))
+        return states
+
+    def getstatesfromcommandline(self,p):
+        """parse the state of all the jobs present in the PBS server
+        
+        Parameters
+        ----------
+        p: (str,str)
+            tuple corresponding to the return value of the 
+            subprocess.Popen.communicate of the `qstat -x` command
+
+        Returns
+        -------
+        states: dict(str: (str,str))
+            the state and status per job id (without the server name)
+
+        Notes
+        -----
+        The `qstat -x` command returns an XML document following 
+        the structure
+            <Data><Job><Job_Id>JOBID_INT.server</Job_Id>...
+                <job_state>S</job_state>...</Job>...</Data>
+        """
+        from xmltodict_jb import xmltodict
+
+        if p[0].strip() == "":
+            return {}
+        jobs = xmltodict.parse(p[0],force_list=('Job',))['Data']['Job']
+        return dict(map(lambda x: (x['Job_Id'].split('.')[0],
+            self.getstatefromcode(x['job_state'])),jobs))
+
+    def getwalltimes(self,jobdsclist):
+        """obtain the walltime of the finished jobs accounted by the
+        PBS server (`resources_used.walltime`), from a snapshot of the
+        server (`qstat -x`). Only the completed jobs still kept by the
+        server (see its `keep_completed` attribute) are found
+
+        Parameters
+        ----------
+        jobdsclist: list(jobsender.jobdescription)
+
+        Returns
+        -------
+        walltimes: dict(int: float)
+            the walltime (seconds) per job index, the jobs not found
+            (or if the server could not be queried) are not present
+        """
+        from xml.parsers.expat import ExpatError
+        from xmltodict_jb import xmltodict
+
+        finished = filter(lambda x: x.ID is not None,jobdsclist)
+        if len(finished) == 0 or self.simulate:
+            return {}
+        p = self.querycluster([ self.statecom, '-x', '-t' ])
+        if p is None or p[1] != "" or p[0].strip() == "":
+            return {}
+        try:
+            jobs = xmltodict.parse(p[0],force_list=('Job',))['Data']['Job']
+        except (ExpatError,KeyError,TypeError) as e:
+            print "\033[1;33mWARNING\033[1;m No interpretation of the answer of the"\
+                    " cluster ({0}), the walltime of the jobs is unknown".format(e)
+            return {}
+        walltimemap = {}
+        for jobinfo in jobs:
+            try:
+                hms = jobinfo['resources_used']['walltime'].split(':')
+                walltime = reduce(lambda total,x: 60*total+int(x),hms,0)
+            except (KeyError,TypeError,ValueError):
+                continue
+            walltimemap[jobinfo['Job_Id'].split('.')[0]] = walltime
+        walltimes = {}
+        for jobdsc in finished:
+            walltime = walltimemap.get(str(jobdsc.ID).split('.')[0])
+            if walltime:
+                walltimes[jobdsc.index] = float(walltime)
+        return walltimes
+
     def failed(self):
         """..method:: failed()
          
@@ -694,7 +1845,97 @@ class taucluster(clusterspec):
         raise NotImplementedError("Class %s doesn't implement "\
                  "done()" % (self.__class__.__name__))
 
-    def create_script_if_needed(self,filename):
+    def submitarray(self,jobdsclist):
+        """Send a list of jobs to the cluster as a single PBS job array 
+        (`qsub -t 0-N`). A wrapper script is created in the current folder
+        which dispatches each array element into its job folder. Each 
+        job is identified by the array element ID, JOBID_INT[i].server,
+        being `i` the position of the job in the list
+         
+        Parameters
+        ----------
+        jobdsclist: list(jobSender.jobsender.jobdescription)
+        """
+        from executor import runcommand
+
+        if len(jobdsclist) == 0:
+            return
+        # All the jobs share the same script
+        filename = jobdsclist[0].script
+        wrapper = self.create_arrayscript(filename,map(lambda x: x.path,jobdsclist))
+        # Building the command to send to the shell:
+        command = [ self.sendcom ]
+        for i in self.extraopt:
+            command.append(i)
+        command += [ '-t', '0-{0}'.format(len(jobdsclist)-1), wrapper ]
+        
+        # Send the command
+        if self.simulate:
+            p = self.simulatedresponse('submit')
+        else:
+            out,err,returncode = runcommand(command,timeout=self.gettimeout())
+            if returncode is None:
+                self.setsubmissionunknown(jobdsclist,err)
+                return
+            p = out,err
+
+        if p[1] != "":
+            message = "ERROR from {0}:\n".format(self.sendcom)
+            message += p[1]+"\n"
+            print "\033[1;31mERROR SENDING JOBS TO CLUSTER\033[1;m {0}".format(message)
+            self.ID = None
+            for jobdsc in jobdsclist:
+                jobdsc.ID = self.ID
+                jobdsc.status = 'fail'
+            return
+        ## The job-id is released in the message: JOBID_INT[].server
+        self.ID = self.getjobidfromcommand(p[0])
+        server = '.'.join(p[0].strip().split('.')[1:])
+        for (arrayid,jobdsc) in enumerate(jobdsclist):
+            jobdsc.ID = "{0}[{1}].{2}".format(self.ID,arrayid,server)
+            # Updating the state and status of the job
+            jobdsc.state  = 'submitted'
+            jobdsc.status = 'ok'
+        print "INFO:"+str(filename)+'_['+get_compact_list(map(lambda x: x.index,jobdsclist))+\
+                "] submitted with cluster ID:"+str(self.ID)+"[]"
+
+    def create_arrayscript(self,filename,pathlist):
+        """Create the wrapper script to be sent to the cluster as a
+        job array. The array index (PBS_ARRAYID) selects the job folder
+        where the job script is run, the standard output and error are 
+        kept inside the job folder
+
+        Parameters
+        ----------
+        filename: str
+            the name of the script (without suffix) of the jobs
+        pathlist: list(str)
+            the folders of the jobs, in array index order
+
+        Returns
+        -------
+        str: the name of the created script
+        """
+        import os
+        import datetime,time
+
+        ts = time.time()
+        timestamp = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        bashfile = '#!/bin/bash\n\n'
+        bashfile += '# File created by the %s class [%s]\n\n' % (self.__class__.__name__,timestamp)
+        bashfile += 'JOBPATHS=(\n'
+        for path in pathlist:
+            bashfile += '    {0}\n'.format(os.path.abspath(path))
+        bashfile += ')\n'
+        bashfile += 'cd ${JOBPATHS[$PBS_ARRAYID]}\n'
+        bashfile += './{0}.{1} > {2} 2> STDERR\n'.format(filename,self.script_suffix,self.logout_file)
+        wrapper = '{0}_array.{1}'.format(filename,self.script_suffix)
+        with open(wrapper,'w') as f:
+            f.write(bashfile)
+        os.chmod(wrapper,0755)
+        return wrapper
+
+    def create_script_if_needed(self,filename,path='.'):
         """Do not need to do anything
         """
         return
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+""":mod:`evtcache` -- Cache of the number of events per file
+============================================================
+
+.. module:: evtcache
+   :platform: Unix
+   :synopsis: Module which contains the evtcache class, a SQLite
+              file keeping the number of events of the input files
+              already counted. The entries are keyed by the real path
+              of the file and the kind of count (the tree name for
+              ROOT files, the format for the others), and are only
+              valid while the size, modification time and inode of
+              the file do not change. The cache can be shared between
+              productions and users by placing it in a common path
+              (see CACHEENV).
+.. moduleauthor:: Jordi Duarte-Campderros <jorge.duarte.campderros@cern.ch>
+"""
+
+# The environment variable defining the cache file
+CACHEENV = 'JOBSENDER_EVTCACHE'
+# The default cache file
+CACHEFILE = '~/.jobsender/events_per_file.sqlite'
+
+def getcachefile():
+    """..function:: getcachefile() -> filename
+
+    the cache file to be used: the one defined by the CACHEENV
+    environment variable if present, otherwise CACHEFILE
+
+    :return: the absolute path of the cache file
+    :rtype: str
+    """
+    import os
+
+    return os.path.abspath(os.path.expanduser(os.getenv(CACHEENV,CACHEFILE)))
+
+def getfileid(filename):
+    """..function:: getfileid(filename) -> (realpath,size,mtime,inode)
+
+    the identity of a file, used to validate the cached entries
+
+    :param filename: the file
+    :type  filename: str
+
+    :return: the real path, size, modification time and inode of
+             the file, or None if the file is not local or does
+             not exist
+    :rtype: tuple(str,int,float,int)
+    """
+    import os
+
+    # Remote files (root://, ...) are not cached
+    if filename.find('://') != -1:
+        return None
+    realpath = os.path.realpath(filename)
+    try:
+        st = os.stat(realpath)
+    except OSError:
+        return None
+    return (realpath,st.st_size,st.st_mtime,st.st_ino)
+
+class evtcache(object):
+    """..class:: evtcache
+
+    Number of events of already counted files, stored in a SQLite
+    file with a single table:
+     * events: (path,kind) -> (size,mtime,inode,nevents)
+    """
+    def __init__(self,filename=None):
+        """..class:: evtcache([filename])
+
+        :param filename: the SQLite file, created if does not exist
+                         [Default: getcachefile()]
+        :type  filename: str
+        """
+        import sqlite3
+        import os
+
+        if not filename:
+            filename = getcachefile()
+        self.filename = filename
+        if not os.path.isdir(os.path.dirname(self.filename)):
+            os.makedirs(os.path.dirname(self.filename))
+        # Shared between processes, wait for the lock of the others
+        self.conn = sqlite3.connect(self.filename,timeout=60)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS events "\
+                    "(path TEXT, kind TEXT, size INTEGER, mtime REAL, inode INTEGER,"\
+                    " nevents INTEGER, PRIMARY KEY (path,kind))")
+
+    def lookup(self,filelist,kind):
+        """..method:: lookup(filelist,kind) -> md
+
+        retrieve the number of events of the files with a valid
+        entry in the cache
+
+        :param filelist: the files
+        :type  filelist: list(str)
+        :param kind: the kind of count
+        :type  kind: str
+
+        :return: the number of events of the files found
+        :rtype: dict(str: int)
+        """
+        md = {}
+        for f in filelist:
+            fileid = getfileid(f)
+            if fileid is None:
+                continue
+            row = self.conn.execute("SELECT size,mtime,inode,nevents FROM events"\
+                    " WHERE path=? AND kind=?",(fileid[0],kind)).fetchone()
+            if row is not None and tuple(row[:3]) == fileid[1:]:
+                md[f] = row[3]
+        return md
+
+    def store(self,md,kind):
+        """..method:: store(md,kind)
+
+        store the number of events of the files (the non-local
+        files are ignored)
+
+        :param md: the number of events per file
+        :type  md: dict(str: int)
+        :param kind: the kind of count
+        :type  kind: str
+        """
+        rows = []
+        for f,nevents in md.iteritems():
+            fileid = getfileid(f)
+            if fileid is None:
+                continue
+            rows.append( (fileid[0],kind)+fileid[1:]+(nevents,) )
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO events VALUES "\
+                    "(?,?,?,?,?,?)",rows)
+
+    def close(self):
+        """..method:: close()
+        """
+        self.conn.close()
@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+""":mod:`evtreaders` -- Event counting without the experiment software
+====================================================================
+
+.. module:: evtreaders
+   :platform: Unix
+   :synopsis: Module gathering minimal readers of the input file
+              formats, which are able to extract the number of events
+              of a file without loading the framework of the
+              experiment (ROOT, LCIO,...). The files are accessed
+              through mmap, and only the few records needed are
+              parsed. The readers return None whenever the file is
+              not understood, so the caller can fall back to the
+              framework tools.
+.. moduleauthor:: Jordi Duarte-Campderros <jorge.duarte.campderros@cern.ch>
+"""
+import struct
+
+# -- ROOT files
+# Version of the file (and of the keys and directories) from which
+# the pointers are 64-bits
+ROOTBIGFILE = 1000000
+ROOTBIGKEY  = 1000
+# The mask of the byte count preceding the streamed objects
+ROOTBYTECOUNT = 0x40000000
+# The TTree versions with a Long64_t fEntries after the 4 base classes
+# (TNamed, TAttLine, TAttFill, TAttMarker)
+ROOTTREEMINVERSION = 16
+# Size of the header of each compressed block
+ROOTZIPHEADER = 9
+
+def openmmap(filename):
+    """..function:: openmmap(filename) -> mmap
+
+    map a local file in memory (read only)
+
+    :param filename: the file
+    :type  filename: str
+
+    :return: the mapped file, or None if the file is not local, does
+             not exist or is empty
+    :rtype: mmap.mmap
+    """
+    import mmap
+    import os
+
+    # Remote files (root://, ...) are not handled
+    if filename.find('://') != -1 or not os.path.isfile(filename) \
+            or os.path.getsize(filename) == 0:
+        return None
+    with open(filename,'rb') as f:
+        return mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+
+def rootunzip(buf,objlen):
+    """..function:: rootunzip(buf,objlen) -> data
+
+    decompress a ROOT record, made of blocks (each one with its 9 bytes
+    header: algorithm, method, compressed and uncompressed sizes). The
+    zlib algorithm is always available; lzma, lz4 and zstd are used if
+    their python modules can be imported
+
+    :param buf: the compressed record
+    :type  buf: str
+    :param objlen: the size of the uncompressed record
+    :type  objlen: int
+
+    :return: the uncompressed record, or None if an algorithm is not
+             supported
+    :rtype: str
+    """
+    import zlib
+
+    blocks = []
+    pos    = 0
+    unziplen = 0
+    while unziplen < objlen:
+        header = buf[pos:pos+ROOTZIPHEADER]
+        if len(header) != ROOTZIPHEADER:
+            return None
+        algo = header[:2]
+        ziplen = struct.unpack('<I',header[3:6]+'\x00')[0]
+        blocklen = struct.unpack('<I',header[6:9]+'\x00')[0]
+        block = buf[pos+ROOTZIPHEADER:pos+ROOTZIPHEADER+ziplen]
+        try:
+            if algo == 'ZL':
+                data = zlib.decompress(block)
+            elif algo == 'XZ':
+                try:
+                    import lzma
+                except ImportError:
+                    from backports import lzma
+                data = lzma.decompress(block)
+            elif algo == 'L4':
+                import lz4.block
+                # The lz4 block is preceded by its 8 bytes checksum
+                data = lz4.block.decompress(block[8:],uncompressed_size=blocklen)
+            elif algo == 'ZS':
+                import zstandard
+                data = zstandard.ZstdDecompressor().decompress(block,
+                        max_output_size=blocklen)
+            else:
+                return None
+        except ImportError:
+            return None
+        except Exception:
+            return None
+        if len(data) != blocklen:
+            return None
+        blocks.append(data)
+        unziplen += blocklen
+        pos += ROOTZIPHEADER+ziplen
+    return ''.join(blocks)
+
+def rootstring(buf,pos):
+    """..function:: rootstring(buf,pos) -> (str,newpos)
+
+    read a TString: 1 byte length (or 255 followed by a 4 bytes
+    length) and the characters
+    """
+    length = struct.unpack_from('>B',buf,pos)[0]
+    pos += 1
+    if length == 255:
+        length = struct.unpack_from('>i',buf,pos)[0]
+        pos += 4
+    return buf[pos:pos+length],pos+length
+
+def rootkey(buf,pos):
+    """..function:: rootkey(buf,pos) -> (key,newpos)
+
+    read the header of a TKey
+
+    :return: the key fields (nbytes, version, objlen, keylen, cycle,
+             seekkey, classname, name, title) and the position after
+             the header
+    :rtype: (dict,int)
+    """
+    key = {}
+    key['nbytes'],key['version'],key['objlen'],datime,key['keylen'],key['cycle'] = \
+            struct.unpack_from('>ihiIhh',buf,pos)
+    pos += 18
+    if key['version'] > ROOTBIGKEY:
+        key['seekkey'],seekpdir = struct.unpack_from('>qq',buf,pos)
+        pos += 16
+    else:
+        key['seekkey'],seekpdir = struct.unpack_from('>ii',buf,pos)
+        pos += 8
+    key['classname'],pos = rootstring(buf,pos)
+    key['name'],pos = rootstring(buf,pos)
+    key['title'],pos = rootstring(buf,pos)
+    return key,pos
+
+def rootkeys(buf):
+    """..function:: rootkeys(buf) -> keys
+
+    read the list of keys of the top directory of a ROOT file
+
+    :param buf: the mapped file
+    :type  buf: mmap.mmap
+
+    :return: the keys, or None if it is not a ROOT file or it is
+             truncated
+    :rtype: list(dict)
+    """
+    if buf[:4] != 'root':
+        return None
+    version,begin = struct.unpack_from('>ii',buf,4)
+    # The end of the file and the size of the TNamed of the top directory
+    if version >= ROOTBIGFILE:
+        end = struct.unpack_from('>q',buf,4+4+4)[0]
+        nbytesname = struct.unpack_from('>i',buf,4+4+4+8+8+4+4)[0]
+    else:
+        end = struct.unpack_from('>i',buf,4+4+4)[0]
+        nbytesname = struct.unpack_from('>i',buf,4+4+4+4+4+4+4)[0]
+    # Truncated (or still being written)
+    if end > len(buf):
+        return None
+    # The TDirectory record: version, creation and modification time,
+    # sizes of the keys and the name, and the seeks of the directory,
+    # its parent and the keys list
+    pos = begin+nbytesname
+    dirversion = struct.unpack_from('>h',buf,pos)[0]
+    pos += 2+4+4+4+4
+    if dirversion > ROOTBIGKEY:
+        seekkeys = struct.unpack_from('>q',buf,pos+8+8)[0]
+    else:
+        seekkeys = struct.unpack_from('>i',buf,pos+4+4)[0]
+    if seekkeys <= 0 or seekkeys >= len(buf):
+        return None
+    # The keys list: its own key, the number of keys and the keys
+    listkey,pos = rootkey(buf,seekkeys)
+    nkeys = struct.unpack_from('>i',buf,pos)[0]
+    pos += 4
+    keys = []
+    for i in xrange(nkeys):
+        key,pos = rootkey(buf,pos)
+        keys.append(key)
+    return keys
+
+def rootobject(buf,key):
+    """..function:: rootobject(buf,key) -> data
+
+    the (uncompressed) record of the object pointed by a key
+
+    :return: the record, or None if it cannot be decompressed
+    :rtype: str
+    """
+    start = key['seekkey']+key['keylen']
+    ziplen = key['nbytes']-key['keylen']
+    if key['objlen'] == ziplen:
+        return buf[start:start+ziplen]
+    return rootunzip(buf[start:start+ziplen],key['objlen'])
+
+def rootskipbytecount(data,pos):
+    """..function:: rootskipbytecount(data,pos) -> newpos
+
+    skip a streamed object (or base class) preceded by its byte count
+
+    :return: the position after the object, or None if there is not
+             a byte count
+    :rtype: int
+    """
+    bytecount = struct.unpack_from('>I',data,pos)[0]
+    if not bytecount & ROOTBYTECOUNT:
+        return None
+    return pos+4+(bytecount & ~ROOTBYTECOUNT)
+
+def rootentries(filename,treename='CollectionTree'):
+    """..function:: rootentries(filename[,treename]) -> entries
+
+    the number of entries of a TTree placed in the top directory of a
+    ROOT file, obtained without ROOT: the header, the keys list and the
+    beginning of the TTree record (up to fEntries) are parsed
+
+    :param filename: the ROOT file
+    :type  filename: str
+    :param treename: the name of the tree
+    :type  treename: str
+
+    :return: the number of entries, or None if the file (or the tree)
+             was not understood or found
+    :rtype: int
+    """
+    buf = openmmap(filename)
+    if buf is None:
+        return None
+    try:
+        keys = rootkeys(buf)
+        if keys is None:
+            return None
+        # The last cycle of the tree
+        keys = filter(lambda k: k['name'] == treename,keys)
+        if len(keys) == 0:
+            return None
+        key = max(keys,key=lambda k: k['cycle'])
+        if key['classname'] != 'TTree':
+            return None
+        data = rootobject(buf,key)
+        if data is None:
+            return None
+        # The TTree: byte count and version, the base classes
+        # (TNamed, TAttLine, TAttFill, TAttMarker) and fEntries
+        pos = rootskipbytecount(data,0)
+        version = struct.unpack_from('>h',data,4)[0]
+        if pos is None or version < ROOTTREEMINVERSION:
+            return None
+        pos = 6
+        for base in xrange(4):
+            pos = rootskipbytecount(data,pos)
+            if pos is None:
+                return None
+        return int(struct.unpack_from('>q',data,pos)[0])
+    except (struct.error,IndexError,ValueError):
+        return None
+    finally:
+        buf.close()
+
+# -- LCIO (SIO) files
+# The marker of each SIO record header
+SIOMARKER = 0xabadcafe
+# Size of the fixed part of the SIO record header: header length,
+# marker, options, data length, uncompressed data length and name 
+# length
+SIOHEADER = 24
+# The name of the record containing an event
+LCIOEVENTRECORD = 'LCEvent'
+
+def lcioevents(filename):
+    """..function:: lcioevents(filename) -> events
+
+    the number of events of a LCIO file, obtained without LCIO: the 
+    headers of the SIO records are walked (the data is never read nor
+    decompressed) and the 'LCEvent' records are counted
+
+    :param filename: the LCIO file
+    :type  filename: str
+
+    :return: the number of events, or None if the file was not 
+             understood
+    :rtype: int
+    """
+    buf = openmmap(filename)
+    if buf is None:
+        return None
+    try:
+        size   = len(buf)
+        pos    = 0
+        events = 0
+        while pos < size:
+            headerlen,marker,options,datalen,ucmplen,namelen = \
+                    struct.unpack_from('>iIiiii',buf,pos)
+            if marker != SIOMARKER or headerlen < SIOHEADER+namelen:
+                return None
+            if buf[pos+SIOHEADER:pos+SIOHEADER+namelen] == LCIOEVENTRECORD:
+                events += 1
+            # The data is padded to 4 bytes
+            pos += headerlen+((datalen+3) & ~3)
+        # A truncated last record
+        if pos != size:
+            return None
+        return events
+    except struct.error:
+        return None
+    finally:
+        buf.close()
+
+# -- ALIBAVA raw data files
+# The marker of the block headers (higher 16 bits of the header word)
+ALIBAVAMARKER = 0xcafe
+# The code of the blocks containing an event (lower 12 bits of the 
+# header word)
+ALIBAVADATABLOCK = 2
+# Number of channels of the pedestals and noise stored after the
+# header of the file (doubles)
+ALIBAVANCHANNELS = 256
+# Size of an event in the files without version (the EventData struct
+# with and without alignment padding)
+ALIBAVAEVENTSIZES = [ 592, 590 ]
+
+def alibavaheader(buf):
+    """..function:: alibavaheader(buf) -> (version,datastart)
+
+    parse the header of an ALIBAVA file: the time of the run (time_t,
+    either 4 or 8 bytes depending on the machine which wrote it), 
+    the run type (int), the length of the header string (unsigned int)
+    and the header string, which starts with 'V<version>|' for the
+    versioned files
+
+    :return: the version of the file and the position after the header,
+             or None if it is not understood
+    :rtype: (int,int)
+    """
+    for timesize in [ 8, 4 ]:
+        if len(buf) < timesize+8:
+            continue
+        runtype,lheader = struct.unpack_from('<iI',buf,timesize)
+        start = timesize+8
+        if runtype < 0 or runtype > 100 or lheader == 0 \
+                or start+lheader > len(buf):
+            continue
+        header = buf[start:start+lheader]
+        if header[0] in 'Vv' and header[1].isdigit():
+            return int(header[1]),start+lheader
+        # Files without version: the header should be text
+        if all(map(lambda c: c == '\x00' or 32 <= ord(c) < 127,header)):
+            return 0,start+lheader
+    return None
+
+def alibavaevents(filename):
+    """..function:: alibavaevents(filename) -> events
+
+    the number of events of an ALIBAVA raw data file, obtained without
+    the ALIBAVA software: the versioned files are made of blocks (a 
+    header word with the 0xcafe marker and the block code, the size
+    of the block and the data) which are walked by seeking over their
+    data and the data blocks are counted, while the files without
+    version are made of fixed size events
+
+    :param filename: the ALIBAVA file
+    :type  filename: str
+
+    :return: the number of events, or None if the file was not 
+             understood
+    :rtype: int
+    """
+    buf = openmmap(filename)
+    if buf is None:
+        return None
+    try:
+        header = alibavaheader(buf)
+        if header is None:
+            return None
+        version,pos = header
+        size = len(buf)
+        if version == 0:
+            for eventsize in ALIBAVAEVENTSIZES:
+                if (size-pos) % eventsize == 0:
+                    return (size-pos)/eventsize
+            return None
+        # The pedestals and noise follow the header
+        if (struct.unpack_from('<I',buf,pos)[0] >> 16) != ALIBAVAMARKER:
+            pos += 2*ALIBAVANCHANNELS*8
+        events = 0
+        while pos < size:
+            word,blocksize = struct.unpack_from('<II',buf,pos)
+            if (word >> 16) != ALIBAVAMARKER:
+                return None
+            if (word & 0x0fff) == ALIBAVADATABLOCK:
+                events += 1
+            pos += 8+blocksize
+        if pos != size:
+            return None
+        return events
+    except (struct.error,IndexError):
+        return None
+    finally:
+        buf.close()
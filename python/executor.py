@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+""":mod:`executor` -- Execution of the external commands
+========================================================
+
+.. module:: executor
+   :platform: Unix
+   :synopsis: Module which contains the executors of the external
+              commands (the batch system tools, the event counters,...)
+              used by the clusterspec classes and the jobssender
+              utilities. Two executors are available:
+               * popen: a new process per command (subprocess.Popen)
+               * shell: the commands are written to long-lived shell
+                 coprocesses, which run them and frame their output
+                 with unique delimiters, so the python process is
+                 not forked per command
+              Both support a timeout per command and record the
+              latency of the commands. The executor used is selected
+              once per process with setexecutor, and the commands are
+              run through runcommand.
+.. moduleauthor:: Jordi Duarte-Campderros <jorge.duarte.campderros@cern.ch>
+"""
+
+# The available executors
+EXECUTORS = [ 'popen', 'shell' ]
+# The shell used by the shell executor
+SHELL = '/bin/sh'
+# The executor used by runcommand (see setexecutor)
+EXECUTOR = None
+# The command running a program in a new session (see insession)
+SETSID = 'setsid'
+# The path of the setsid command, resolved the first time it is needed
+# (False: not available, see getsetsid)
+SETSIDPATH = None
+
+def getsetsid():
+    """..function:: getsetsid() -> path
+
+    the path of the setsid command, looked for in the PATH only once
+
+    :return: the path, None if setsid is not available
+    :rtype: str
+    """
+    from distutils.spawn import find_executable
+    global SETSIDPATH
+
+    if SETSIDPATH is None:
+        SETSIDPATH = find_executable(SETSID) or False
+    return SETSIDPATH or None
+
+def insession(command):
+    """..function:: insession(command) -> command
+
+    the command run in its own session and process group through the
+    setsid command, so the processes it starts (wrapper scripts) can
+    be killed together (see killgroup). The session is not created in
+    the forked child (preexec_fn), which can deadlock when other 
+    threads are running. If setsid is not available, the command is
+    run as it is
+
+    :param command: the command, either the list of arguments or a
+                    shell command line
+    :type  command: list(str) or str
+
+    :return: the list of arguments of the command
+    :rtype: list(str)
+    """
+    if isinstance(command,basestring):
+        command = [ SHELL, '-c', command ]
+    setsid = getsetsid()
+    if setsid is None:
+        return command
+    return [ setsid ]+command
+
+def notexecuted(command,err,returncode):
+    """..function:: notexecuted(command,err,returncode) -> bool
+
+    whether a command given as a list of arguments could not be 
+    executed (not found or not executable), which is reported by the
+    program executing it (setsid or the shell) as a failure of the
+    command
+
+    :param command: the command
+    :type  command: list(str) or str
+    :param err: the error message
+    :type  err: str
+    :param returncode: the exit code
+    :type  returncode: int
+    """
+    if isinstance(command,basestring) or returncode not in [ 1, 126, 127 ]:
+        return False
+    # setsid: failed to execute cmd: ..., or sh: exec: cmd: not found
+    return err.startswith('{0}: failed to execute {1}:'.format(SETSID,command[0])) or \
+            (returncode != 1 and err.find('exec: {0}:'.format(command[0])) != -1)
+
+def killgroup(p):
+    """..function:: killgroup(p)
+
+    kill a process started with insession and the processes it started
+    (only the process if it is not leading its process group, i.e. the
+    session was not created yet or setsid is not available)
+
+    :param p: the process
+    :type  p: subprocess.Popen
+    """
+    import os
+    import signal
+
+    try:
+        os.killpg(p.pid,signal.SIGKILL)
+    except OSError:
+        try:
+            p.kill()
+        except OSError:
+            pass
+
+class executor(object):
+    """..class:: executor
+
+    Base class of the executors: runs commands and records the number
+    of calls, the total and the maximum latency per command name. The
+    concrete classes implement the execute method
+    """
+    def __init__(self,timeout=None):
+        """..class:: executor([timeout])
+
+        :param timeout: the default maximum time (seconds) of a
+                        command, None for no limit
+        :type  timeout: float
+        """
+        import threading
+
+        self.timeout = timeout
+        self.stats = {}
+        self.statslock = threading.Lock()
+
+    def run(self,command,cwd=None,timeout=None):
+        """..method:: run(command[,cwd,timeout]) -> (stdout,stderr,returncode)
+
+        run a command and wait for it
+
+        :param command: the command, either the list of arguments or a
+                        shell command line
+        :type  command: list(str) or str
+        :param cwd: the folder where the command is run
+        :type  cwd: str
+        :param timeout: the maximum time (seconds) of the command
+                        [Default: the executor one]
+        :type  timeout: float
+
+        :return: the output and error messages and the exit code of the
+                 command. If the command could not be run (the command
+                 given as a list of arguments; the shell command lines
+                 report it as the shell does, exit code 127) or 
+                 exceeded the timeout the exit code is None and the 
+                 error message explains it
+        :rtype: (str,str,int)
+        """
+        import time
+
+        if timeout is None:
+            timeout = self.timeout
+        start = time.time()
+        result = self.execute(command,cwd,timeout)
+        latency = time.time()-start
+        if isinstance(command,basestring):
+            name = command.split()[0]
+        else:
+            name = command[0]
+        with self.statslock:
+            stats = self.stats.setdefault(name,[0,0.0,0.0])
+            stats[0] += 1
+            stats[1] += latency
+            stats[2] = max(stats[2],latency)
+        return result
+
+    def execute(self,command,cwd,timeout):
+        """..method:: execute(command,cwd,timeout) -> (stdout,stderr,returncode)
+
+        run a command, see run
+        """
+        raise NotImplementedError("Class %s doesn't implement "\
+                "execute()" % (self.__class__.__name__))
+
+    def getstats(self):
+        """..method:: getstats() -> stats
+
+        :return: the number of calls, the total and the maximum latency
+                 (seconds) per command name
+        :rtype: dict(str: (int,float,float))
+        """
+        with self.statslock:
+            return dict(map(lambda (name,st): (name,tuple(st)),self.stats.iteritems()))
+
+    def close(self):
+        """..method:: close()
+        """
+        pass
+
+class popenexecutor(executor):
+    """..class:: popenexecutor
+
+    Executor creating a new process per command
+    """
+    def execute(self,command,cwd,timeout):
+        """..method:: execute(command,cwd,timeout) -> (stdout,stderr,returncode)
+        """
+        from subprocess import Popen,PIPE
+        import threading
+
+        try:
+            # In its own process group, so the processes started by the
+            # command (wrapper scripts) are killed as well on timeout
+            p = Popen(insession(command),stdout=PIPE,stderr=PIPE,cwd=cwd,close_fds=True)
+        except OSError as e:
+            return "","'{0}' could not be executed ({1})".format(command,e),None
+        timer = None
+        expired = []
+        if timeout:
+            def _kill():
+                expired.append(True)
+                killgroup(p)
+            timer = threading.Timer(timeout,_kill)
+            timer.start()
+        try:
+            out,err = p.communicate()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if expired:
+            return out,"'{0}' timed out after {1} s".format(command,timeout),None
+        if notexecuted(command,err,p.returncode):
+            return out,"'{0}' could not be executed ({1})".format(command,err.strip()),None
+        return out,err,p.returncode
+
+class shellprocess(object):
+    """..class:: shellprocess
+
+    A shell coprocess running the commands written to its standard
+    input. Each command is run in a subshell (with the standard input
+    closed), followed by a delimiter (unique per command) written to
+    the standard output, including the exit code, and another one to
+    the standard error. The output of the command is everything
+    before the delimiters
+    """
+    def __init__(self,shell=SHELL):
+        """..class:: shellprocess([shell])
+        """
+        from subprocess import Popen,PIPE
+
+        # In its own process group, so the shell and the command it
+        # runs can be killed together
+        self.p = Popen(insession([shell]),stdin=PIPE,stdout=PIPE,stderr=PIPE,
+                close_fds=True)
+
+    def isalive(self):
+        """..method:: isalive() -> bool
+        """
+        return self.p.poll() is None
+
+    def run(self,command,cwd,timeout):
+        """..method:: run(command,cwd,timeout) -> (stdout,stderr,returncode)
+
+        run a command, see executor.run. The shell is killed if the
+        command exceeds the timeout
+        """
+        import os
+        import pipes
+        import select
+        import time
+        import uuid
+
+        marker = '__JOBSENDER_{0}__'.format(uuid.uuid4().hex)
+        if isinstance(command,basestring):
+            commandline = command
+        else:
+            commandline = 'exec '+' '.join(map(pipes.quote,command))
+        if cwd:
+            commandline = 'cd {0} && {1}'.format(pipes.quote(cwd),commandline)
+        try:
+            self.p.stdin.write("( {0} ) </dev/null\nprintf '\\n{1} %d\\n' $?\n"\
+                    "printf '\\n{1}\\n' >&2\n".format(commandline,marker))
+            self.p.stdin.flush()
+        except IOError as e:
+            self.kill()
+            return "","The shell coprocess died ({0})".format(e),None
+
+        outend = '\n'+marker+' '
+        errend = '\n'+marker+'\n'
+        buffers = { self.p.stdout.fileno(): '', self.p.stderr.fileno(): '' }
+        pending = set(buffers.keys())
+        if timeout:
+            deadline = time.time()+timeout
+        while pending:
+            if timeout:
+                wait = deadline-time.time()
+                if wait <= 0:
+                    self.kill()
+                    return buffers[self.p.stdout.fileno()],\
+                            "'{0}' timed out after {1} s".format(command,timeout),None
+            else:
+                wait = None
+            ready = select.select(list(pending),[],[],wait)[0]
+            for fd in ready:
+                data = os.read(fd,65536)
+                if not data:
+                    self.kill()
+                    return buffers[self.p.stdout.fileno()],\
+                            "The shell coprocess died running '{0}'".format(command),None
+                buffers[fd] += data
+                if fd == self.p.stdout.fileno():
+                    found = buffers[fd].find(outend)
+                    if found != -1 and buffers[fd].endswith('\n'):
+                        pending.discard(fd)
+                elif buffers[fd].endswith(errend):
+                    pending.discard(fd)
+        out = buffers[self.p.stdout.fileno()]
+        found = out.rfind(outend)
+        returncode = int(out[found+len(outend):].split()[0])
+        err = buffers[self.p.stderr.fileno()][:-len(errend)]
+        if notexecuted(command,err,returncode):
+            return out[:found],"'{0}' could not be executed ({1})".format(command,
+                    err.strip()),None
+        return out[:found],err,returncode
+
+    def kill(self):
+        """..method:: kill()
+
+        kill the shell and the command it is running
+        """
+        killgroup(self.p)
+        self.p.wait()
+
+    def close(self):
+        """..method:: close()
+        """
+        try:
+            self.p.stdin.close()
+        except IOError:
+            pass
+        self.p.wait()
+
+class shellexecutor(executor):
+    """..class:: shellexecutor
+
+    Executor running the commands in long-lived shell coprocesses. The
+    shells are created on demand, one per concurrent command, and
+    re-used afterwards
+    """
+    def __init__(self,timeout=None,shell=SHELL):
+        """..class:: shellexecutor([timeout,shell])
+
+        :param timeout: the default maximum time (seconds) of a
+                        command, None for no limit
+        :type  timeout: float
+        :param shell: the shell to be used
+        :type  shell: str
+        """
+        import threading
+
+        super(shellexecutor,self).__init__(timeout)
+        self.shell = shell
+        self.idle  = []
+        self.lock  = threading.Lock()
+
+    def execute(self,command,cwd,timeout):
+        """..method:: execute(command,cwd,timeout) -> (stdout,stderr,returncode)
+        """
+        with self.lock:
+            shell = self.idle.pop() if self.idle else None
+        if shell is None or not shell.isalive():
+            try:
+                shell = shellprocess(self.shell)
+            except OSError as e:
+                return "","The shell '{0}' could not be executed ({1})".format(self.shell,e),None
+        result = shell.run(command,cwd,timeout)
+        if shell.isalive():
+            with self.lock:
+                self.idle.append(shell)
+        return result
+
+    def close(self):
+        """..method:: close()
+        """
+        with self.lock:
+            for shell in self.idle:
+                shell.close()
+            self.idle = []
+
+def setexecutor(kind='popen',timeout=None):
+    """..function:: setexecutor([kind,timeout]) -> executor
+
+    define the executor used by runcommand (the previous one is closed)
+
+    :param kind: the executor, one of EXECUTORS
+    :type  kind: str
+    :param timeout: the default maximum time (seconds) of a command
+    :type  timeout: float
+
+    :return: the executor
+    :rtype: executor
+    """
+    global EXECUTOR
+
+    if kind not in EXECUTORS:
+        raise AttributeError('Executor not recognized: "{0}", the valid'\
+                ' ones are: {1}'.format(kind,', '.join(EXECUTORS)))
+    if EXECUTOR is not None:
+        EXECUTOR.close()
+    if kind == 'shell':
+        EXECUTOR = shellexecutor(timeout)
+    else:
+        EXECUTOR = popenexecutor(timeout)
+    return EXECUTOR
+
+def getexecutor():
+    """..function:: getexecutor() -> executor
+
+    the executor used by runcommand, a popen executor if none was
+    defined (see setexecutor)
+    """
+    if EXECUTOR is None:
+        setexecutor()
+    return EXECUTOR
+
+def runcommand(command,cwd=None,timeout=None):
+    """..function:: runcommand(command[,cwd,timeout]) -> (stdout,stderr,returncode)
+
+    run a command with the current executor, see executor.run
+    """
+    return getexecutor().run(command,cwd,timeout)
+
+def printstats():
+    """..function:: printstats()
+
+    print the number of calls and the latency of the commands run
+    """
+    if EXECUTOR is None:
+        return
+    for name,(ncalls,total,maximum) in sorted(EXECUTOR.getstats().iteritems()):
+        print "\033[1;34mINFO\033[1;m {0}: {1} calls, {2:.3f} s per call (max. {3:.3f} s)".format(
+                name,ncalls,total/ncalls,maximum)
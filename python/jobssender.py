@@ -12,6 +12,15 @@
 """
 DEBUG=True
 JOBEVT=500
+# Number of concurrent submissions 
+NSUBMITTERS=4
+# Minimum and maximum time (in seconds) between checks in watch mode
+WATCHMIN=30
+WATCHMAX=900
+# Number of concurrent event counters (None: number of cores)
+NCOUNTERS=None
+# Number of counted files stored at once in the cache of events
+CACHEBATCH=200
 
 def getrealpaths(inputfiles):
     """..function:: getrealpaths(inputfiles) -> realpaths
@@ -61,7 +70,7 @@ def getremotepaths(remoteinputfiles):
     if not remoteinputfiles:
         return None
 
-    from subprocess import Popen,PIPE
+    from executor import runcommand
     import os
     import glob
     # Substitute root://remoteserver//path_blabla -> /path_blablaa
@@ -82,7 +91,7 @@ def getremotepaths(remoteinputfiles):
     # FIXME:: NOTE THAT IS DEPENDENT OF THE EOS CLIENT VERSION!!
     eos = '/afs/cern.ch/project/eos/installation/0.3.84-aquamarine/bin/eos.select'
     command = eos+' ls '+parentfolder
-    p = Popen(command,stdout=PIPE,stderr=PIPE,shell=True).communicate()
+    p = runcommand(command)[:2]
 
     if len(p[1]) != 0:
         raise RuntimeError('Problem with the EOS path, didn\'t find any file in'\
@@ -94,54 +103,210 @@ def getremotepaths(remoteinputfiles):
 
     return remotefiles,nevents
 
-def get_evts_metadata(prefix):
-    """Obtain or create a shelve file containing the metadata
-    describing the events per file found in a folder which contains
-    a list of files
+def getevtsperfile(filelist,kind,counter,force=False):
+    """Obtain the number of events per file of a list of files, using
+    the shared cache of events per file (see evtcache). Only the files
+    not found in the cache (or modified since they were counted) are
+    counted, and stored in the cache afterwards (in batches of 
+    CACHEBATCH files, so an interrupted count is not lost)
 
     Parameters
     ----------
-    prefix: str, the path to be pre-fixed to the '.events_per_file' 
+    filelist: list(str)
+        the files to look into
+    kind: str
+        the kind of count (format, tree name, ...) used as part 
+        of the key in the cache
+    counter: function(list(str)) -> iterator((str,int,str))
+        the function counting the events of the files not found
+        in the cache, yielding (file,events,error) as each file
+        is counted (error is None if the file was counted)
+    force: bool
+        whether re-evaluate the number of events of all the files,
+        ignoring the cache
 
     Return
     ------
-    md: dict( { 'evt_file_dict': { '
-        
+    md: dict(str: int), the number of events per file
+
+    Raises
+    ------
+    RuntimeError
+        if any file could not be counted (the counted ones are 
+        stored anyway)
     """
-    import shelve
-    import os
+    from evtcache import evtcache
 
-    # Open the file if exist, otherwise creates an empty dictionary
-    kk = shelve.open(os.path.join(prefix,".events_per_file"))
-    if kk.has_key('evt_file_dict'):
-        md = kk['evt_file_dict'].copy()
-    else:
+    cache = evtcache()
+    if force:
         md = {}
-    kk.close()
+    else:
+        md = cache.lookup(filelist,kind)
+    missing = filter(lambda f: not md.has_key(f),filelist)
+    print "\033[1;34mINFO\033[1;m Events per file: {0} files found in the"\
+            " cache '{1}', {2} files to be counted".format(len(filelist)-len(missing),
+                    cache.filename,len(missing))
+    failed = []
+    counted = {}
+    try:
+        if len(missing) > 0:
+            for f,nevts,error in counter(missing):
+                if error is not None:
+                    print "\033[1;33mWARNING\033[1;m Not counted the events of"\
+                            " '{0}': {1}".format(f,error)
+                    failed.append(f)
+                    continue
+                md[f] = nevts
+                counted[f] = nevts
+                if len(counted) >= CACHEBATCH:
+                    cache.store(counted,kind)
+                    counted = {}
+    finally:
+        # The files already counted are kept even if interrupted
+        if len(counted) != 0:
+            cache.store(counted,kind)
+        cache.close()
+    if len(failed) != 0:
+        raise RuntimeError("Failed counting the events of {0} (out of {1}) "\
+                "files: {2}".format(len(failed),len(filelist),','.join(failed)))
     return md
 
-def store_evts_metadata(md,prefix):
-    """Store a shelve file containing the metadata describing the 
-    events per file found in a folder which contains a list of files
-    Note that the file is hardcoded to be '.events_per_file'
-    
+def runcounter(command,filelist,nworkers=None):
+    """Count the events of a list of files using an external command,
+    which is called once per file (`command file`) and must print the
+    number of events as the last word of its output. The commands are
+    run concurrently
+
     Parameters
+    ----------
+    command: str
+        the event counter executable
+    filelist: list(str)
+        the files to look into
+    nworkers: int
+        the maximum number of commands running at the same time
+        [Default: NCOUNTERS, or the number of cores if not defined]
+
+    Return
     ------
-    md: { 'file0': events, ...}
-    prefix: str, the path to be prefixed to the '.events_per_file'
+    iterator((str,int,str)): (file,events,error) as each file is counted,
+        where error is None if the command succeed, otherwise the
+        events are None
     """
-    import shelve
-    import os
-    
-    kk = shelve.open(os.path.join(prefix,'.events_per_file'))
-    kk['evt_file_dict'] = md
-    kk.close()
+    from executor import runcommand
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
+
+    def _count(f):
+        out,err,returncode = runcommand([command,f])
+        if returncode is None:
+            return f,None,err
+        try:
+            return f,int(out.split()[-1]),None
+        except (IndexError,ValueError):
+            return f,None,"'{0}' failed with exit code {1}: {2}".format(command,
+                    returncode,(err or out).strip())
+
+    if not nworkers:
+        nworkers = NCOUNTERS or cpu_count()
+    # The counting is done by the external processes, the threads
+    # only wait for them
+    pool = ThreadPool(max(1,min(int(nworkers),len(filelist))))
+    try:
+        for result in pool.imap_unordered(_count,filelist):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+def initrootcounter():
+    """Initialization of the ROOT event counter processes (see 
+    runrootcounter), ROOT is loaded once per process
+    """
+    try:
+        import cppyy
+    except ImportError:
+        pass
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+
+def countrootentries(args):
+    """Count the entries of a tree in a ROOT file, to be used by the
+    ROOT event counter processes (see runrootcounter)
+
+    Parameters
+    ----------
+    args: (str,str)
+        the file and the name of the tree
+
+    Return
+    ------
+    (str,int,str): the file, its number of entries and the error (None
+        if the file was counted, otherwise the entries are None). As 
+        in a TChain, a file without the tree contributes with 0 entries
+    """
+    import ROOT
+
+    f,treename = args
+    rootfile = ROOT.TFile.Open(f)
+    if not rootfile or rootfile.IsZombie():
+        return f,None,"could not open the file"
+    tree = rootfile.Get(treename)
+    if not tree:
+        nentries = 0
+    else:
+        nentries = int(tree.GetEntries())
+    rootfile.Close()
+    return f,nentries,None
+
+def runrootcounter(treename,filelist,nworkers=None):
+    """Count the entries of a tree in a list of ROOT files, each file
+    is opened independently by a pool of processes 
+
+    Parameters
+    ----------
+    treename: str
+        the name of the tree
+    filelist: list(str)
+        the files to look into
+    nworkers: int
+        the number of processes
+        [Default: NCOUNTERS, or the number of cores if not defined]
+
+    Return
+    ------
+    iterator((str,int,str)): (file,entries,error) as each file is counted,
+        where error is None if the file was counted, otherwise the
+        entries are None
+
+    Raises
+    ------
+    ImportError
+        if ROOT is not available
+    """
+    from multiprocessing import Pool,cpu_count
 
-# FIXME: A function to check if the metadata exits, common
-# to all the getevt family of functions
+    # Checked before creating the pool: the workers failing to load
+    # ROOT would be restarted forever
+    try:
+        import ROOT
+    except ImportError as e:
+        raise ImportError("ROOT is needed to count the entries of {0} file(s) not"\
+                " readable without it ({1}...): {2}".format(len(filelist),filelist[0],e))
+    if not nworkers:
+        nworkers = NCOUNTERS or cpu_count()
+    pool = Pool(max(1,min(int(nworkers),len(filelist))),initializer=initrootcounter)
+    try:
+        for result in pool.imap_unordered(countrootentries,
+                map(lambda f: (f,treename),filelist)):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 def getevt(filelist,**kw):
-    """ ..function:: getevt(filelist[,treename]) -> totalevts
+    """ ..function:: getevt(filelist[,treename,force,nworkers,perfile]) -> totalevts
     
     Getting the number of events contained in a list
     of files
@@ -151,60 +316,56 @@ def getevt(filelist,**kw):
     :param treename: the name of the tree where to check 
                      [CollectionTree default]
     :type treename: str
+    :param force: whether re-evaluate the number of events even if
+                  the files are in the cache of events [False default]
+    :type force: bool
+    :param nworkers: number of files counted at the same time (see 
+                     runrootcounter)
+    :type nworkers: int
+    :param perfile: whether to return the number of events per file
+                    instead of the total [False default]
+    :type perfile: bool
 
     ;return: number of events contained in the treename Tree 
-    :rtype: int
+             (or per file, if perfile)
+    :rtype: int (or dict(str: int))
     """
-    try:
-        import cppyy
-    except ImportError:
-        pass
-    import ROOT
-    import os
-
-    # First check if there is exist the file in the folder
-    # in order to avoid the loading. Let's assume that file contain 
-    # the full path
-    prefixpath = os.path.dirname(filelist[0])
-    md = get_evts_metadata(prefixpath)
-    if len(md) > 0:
-        nevts = 0
-        print "\033[1;34mINFO\033[1;m Extracting events per file using"\
-                " the '.events_per_file'. Note you can remove the file to force a"\
-                " recalculation"
-        # XXX: Also we can do sum(md.values()), but the files are not checked
-        #      then... 
-        for f in filelist:
-            try: 
-                nevts += md[f]
-            except KeyError:
-                print "\033[1;33mWARNING\033[1;m Metafile '.events_per_file'"\
-                        " seems to be malformed, did not find '{0}'. "\
-                        "Probably '.events_per_file' should be recreated'".format(f)
-        if nevts == 0:
-            raise RuntimeError("No event was extracted from '.events_per_file'")
-        return nevts
-    # NOT FOUND THE METADATA, let's evaluate it, and stores a metadata file
-    
     if kw.has_key("treename"):
         treename=kw["treename"]
     else:
         treename="CollectionTree"
-
-    if DEBUG:
-        print "Loading the root files to obtain the N_{evts} "\
-                "[Tree:%s]: " % treename
-    t = ROOT.TChain(treename)
-    for f in filelist:
-        EntriesBefore=int(t.GetEntries())
-        t.AddFile(f)
-        md[f] = int(t.GetEntries()-EntriesBefore)
-    # store metadata
-    store_evts_metadata(md,prefixpath)
-
-    return t.GetEntries()   
-
-def getevt_alibava(filelist,force=False):
+    
+    if kw.has_key("nworkers"):
+        nworkers=kw["nworkers"]
+    else:
+        nworkers=None
+    
+    def _counter(files):
+        from evtreaders import rootentries
+        # Fast path: reading the entries without ROOT, the files not
+        # understood are counted with ROOT
+        notread = []
+        for f in files:
+            nentries = rootentries(f,treename)
+            if nentries is None:
+                notread.append(f)
+                continue
+            yield f,nentries,None
+        if len(notread) == 0:
+            return
+        if DEBUG:
+            print "Loading the root files to obtain the N_{evts} "\
+                    "[Tree:%s]: " % treename
+        for result in runrootcounter(treename,notread,nworkers):
+            yield result
+
+    md = getevtsperfile(filelist,'root:'+treename,_counter,
+            kw.has_key('force') and kw['force'])
+    if kw.has_key('perfile') and kw['perfile']:
+        return md
+    return sum(md.values())
+
+def getevt_alibava(filelist,force=False,nworkers=None,perfile=False):
     """Getting the number of events contained in a list
     of alibava raw data files
     
@@ -214,59 +375,42 @@ def getevt_alibava(filelist,force=False):
         the files to look into
     force: bool
         whether re-evaluate the number of events even if
-        the .events_per_file is present
+        the files are in the cache of events
+    nworkers: int
+        number of files counted at the same time (see runcounter)
+    perfile: bool
+        whether to return the number of events per file instead
+        of the total
 
     Return
     ------
     int, number of events contained in the ALIBAVA raw file
+        (dict(str: int) with the events per file, if perfile)
     """
-    from subprocess import Popen,PIPE
-    import os
-
-    # First check if there is exist the file in the folder
-    # in order to avoid the loading. Let's assume that file contain 
-    # the full path
-    prefixpath = os.path.dirname(filelist[0])
-    md = get_evts_metadata(prefixpath)
-    if force:
-        md = 0
-    if len(md) > 0:
-        nevts = 0
-        print "\033[1;34mINFO\033[1;m Extracting events per file using"\
-                " the '.events_per_file'. Note you can remove the file to force a"\
-                " recalculation"
-        # XXX: Also we can do sum(md.values()), but the files are not checked
-        #      then... 
-        for f in filelist:
-            try: 
-                nevts += md[f]
-            except KeyError:
-                # FIXME: Change this, if there are several files in the same folder
-                #        the behaviour is fine, just calculate the number
-                print "\033[1;33mWARNING\033[1;m Metafile '.events_per_file'"\
-                        " seems to be malformed, did not find '{0}'. "\
-                        "Probably '.events_per_file' should be recreated'".format(f)
-        #if nevts == 0:
-        #    raise RuntimeError("No event was extracted from '.events_per_file'")
-        # return nevts
-        if nevts != 0:
-            return nevts
-    # NOT FOUND THE METADATA, let's evaluate it, and stores a metadata file
-    if DEBUG:
-        print "Loading the alibava files to obtain the N_{evts}"
-    events = 0
-    for f in filelist:
-        command = 'genfa {0}'.format(f)
-        p = Popen(command,stdout=PIPE,stderr=PIPE,shell=True).communicate()
-        # Not error control FIXME
-        md[f] = int(p[0].split()[-1])
-        events += md[f]
-    # store metadata
-    store_evts_metadata(md,prefixpath)
-    
-    return events
-
-def getevt_lcio(filelist,force=False):
+    def _counter(files):
+        from evtreaders import alibavaevents
+        # Fast path: reading the file layout without genfa, the files 
+        # not understood are counted with genfa
+        notread = []
+        for f in files:
+            nevents = alibavaevents(f)
+            if nevents is None:
+                notread.append(f)
+                continue
+            yield f,nevents,None
+        if len(notread) == 0:
+            return
+        if DEBUG:
+            print "Loading the alibava files to obtain the N_{evts}"
+        for result in runcounter('genfa',notread,nworkers):
+            yield result
+
+    md = getevtsperfile(filelist,'alibava',_counter,force)
+    if perfile:
+        return md
+    return sum(md.values())
+
+def getevt_lcio(filelist,force=False,nworkers=None,perfile=False):
     """Getting the number of events contained in a list
     of LCIO files. Assumes the LCIO package installed 
     and setting up
@@ -277,81 +421,227 @@ def getevt_lcio(filelist,force=False):
         the files to look into
     force: bool
         whether re-evaluate the number of events even if
-        the .events_per_file is present
+        the files are in the cache of events
+    nworkers: int
+        number of files counted at the same time (see runcounter)
+    perfile: bool
+        whether to return the number of events per file instead
+        of the total
 
     Return
     ------
     int, number of events contained in the LCIO files
+        (dict(str: int) with the events per file, if perfile)
     """
-    from subprocess import Popen,PIPE
-    import os
+    def _counter(files):
+        from evtreaders import lcioevents
+        # Fast path: scanning the records without LCIO, the files not
+        # understood are counted with lcio_event_counter
+        notread = []
+        for f in files:
+            nevents = lcioevents(f)
+            if nevents is None:
+                notread.append(f)
+                continue
+            yield f,nevents,None
+        if len(notread) == 0:
+            return
+        if DEBUG:
+            print "Loading the LCIO files to obtain the N_{evts}"
+        for result in runcounter('lcio_event_counter',notread,nworkers):
+            yield result
+
+    md = getevtsperfile(filelist,'lcio',_counter,force)
+    if perfile:
+        return md
+    return sum(md.values())
+
+
+def bookeepingjobs(jobinstance,filename=None):
+    """.. function::bookeepingjobs(jobinstance[,filename]) 
+    stores the job instance (the production configuration and its 
+    tasks) in a jobstore file, which can be accessed using the 
+    accessingjobsinfo function. The first time the configuration and all
+    the tasks are stored, afterwards only the tasks which changed since 
+    the last call (and the configuration, if it changed) are re-written.
+    The function is useful to snapshot the status of the jobs
+    amongst other information
 
-    # First check if there is exist the file in the folder
-    # in order to avoid the loading. Let's assume that file contain 
-    # the full path
-    prefixpath = os.path.dirname(filelist[0])
-    md = get_evts_metadata(prefixpath)
-    if force:
-        md = 0
-    if len(md) > 0:
-        nevts = 0
-        print "\033[1;34mINFO\033[1;m Extracting events per file using"\
-                " the '.events_per_file'. Note you can remove the file to force a"\
-                " recalculation"
-        # XXX: Also we can do sum(md.values()), but the files are not checked
-        #      then... 
-        for f in filelist:
-            try: 
-                nevts += md[f]
-            except KeyError:
-                print "\033[1;33mWARNING\033[1;m Metafile '.events_per_file'"\
-                        " seems to be malformed, did not find '{0}'. "\
-                        "Probably '.events_per_file' should be recreated'".format(f)
-        if nevts == 0:
-            raise RuntimeError("No event was extracted from '.events_per_file'")
-        return nevts
-    # NOT FOUND THE METADATA, let's evaluate it, and stores a metadata file
-    if DEBUG:
-        print "Loading the LCIO files to obtain the N_{evts}"
-    events = 0
-    for f in filelist:
-        command = 'lcio_event_counter {0}'.format(f)
-        p = Popen(command,stdout=PIPE,stderr=PIPE,shell=True).communicate()
-        # Not error control FIXME
-        md[f] = int(p[0].split()[-1])
-        events += md[f]
-    # store metadata
-    store_evts_metadata(md,prefixpath)
+    :param jobinstance: the job to be stored
+    :type  jobinstance: job
+    :param filename: the jobstore file, only used the first time the 
+                     job is stored [Default: jobstore.STOREFILE in the 
+                     current folder]
+    :type  filename: str
+    """
+    from jobstore import jobstore,STOREFILE
+
+    store = getattr(jobinstance,'store',None)
+    if store is None:
+        if not filename:
+            filename = STOREFILE
+        store = jobstore(filename)
+        tasks = jobinstance.getlistoftasks()
+        jobinstance.store = store
+    else:
+        tasks = jobinstance.gettasks(getattr(jobinstance,'dirty',[]))
+    store.storeconfig(jobinstance.cluster,jobinstance.weinst)
+    # The stored tasks include the journaled ones
+    store.compact(tasks)
+    jobinstance.dirty = set()
+    storehistory(jobinstance)
+
+def storehistory(jobinstance):
+    """.. function::storehistory(jobinstance)
+    add the walltime and the events processed by the tasks finished
+    successfully since the last call to the runtime history (see the
+    runhistory module). The walltime is the one accounted by the batch
+    system (see clusterspec.getwalltimes), the events are the ones
+    assigned to the task (see workenv.getprocessedevents). The tasks
+    whose walltime or events are unknown are ignored
+
+    :param jobinstance: the job
+    :type  jobinstance: job
+    """
+    import time
+    from runhistory import runhistory
+
+    completed = getattr(jobinstance,'completed',None)
+    if not completed:
+        return
+    tasks = jobinstance.gettasks(completed)
+    walltimes = jobinstance.cluster.getwalltimes(tasks)
+    runs = []
+    for jdsc in tasks:
+        events = jobinstance.weinst.getprocessedevents(jdsc.index)
+        if not events or not walltimes.has_key(jdsc.index):
+            continue
+        runs.append( (events,walltimes[jdsc.index],jdsc.tfinished or time.time()) )
+    if runs:
+        history = runhistory()
+        history.record(jobinstance.weinst.gethistorykey(),runs)
+        history.close()
+    jobinstance.completed = set()
+
+def findjobsinfo(workingpath):
+    """.. function::findjobsinfo(workingpath) -> filename
+    search the file containing the jobs information in the working
+    path, either a jobstore file or an old-style '.presentjobs' shelve
+
+    :param workingpath: the working path 
+    :type  workingpath: str
+
+    :return: the name of the file
+    :rtype: str
+    """
+    import glob
+    import os
+    from jobstore import STOREFILE
+
+    if os.path.isfile(os.path.join(workingpath,STOREFILE)):
+        return os.path.join(workingpath,STOREFILE)
+    # The shelve could be stored in several files, depending on the
+    # dbm backend ('.presentjobs', '.presentjobs.db', '.presentjobs.dir',...)
+    if len(glob.glob(os.path.join(workingpath,'.presentjobs')))+\
+            len(glob.glob(os.path.join(workingpath,'.presentjobs.d[bi]*'))) > 0:
+        return os.path.join(workingpath,'.presentjobs')
+    raise RuntimeError('Not found jobs in the folder "%s"(, '\
+            ' i.e. not found "%s" file) ' % (workingpath,STOREFILE))
+
+def accessingjobsinfo(filename):
+    """.. function::accessingjobsinfo(filename) 
+    retrieve the job instance stored in a jobstore file (see
+    bookeepingjobs), including the transitions of its journal not 
+    stored yet. Old-style '.presentjobs' shelve files are also 
+    accepted, and converted to a jobstore file placed in the same 
+    folder
+    """
+    import os
+    from jobstore import jobstore,STOREFILE
+
+    if os.path.basename(filename) != STOREFILE:
+        import shelve
+        d = shelve.open(filename)
+        #joblist = d['joblist'] 
+        jobinstance = d['jobinstance']
+        d.close()
+        jobinstance.store = None
+        jobinstance.buildindex()
+        storefile = os.path.join(os.path.dirname(filename),STOREFILE)
+        print "\033[1;34mINFO\033[1;m Converting old-style jobs file '{0}'"\
+                " to '{1}'".format(filename,storefile)
+        bookeepingjobs(jobinstance,storefile)
+        return jobinstance
+        
+    store = jobstore(filename)
+    cluster,weinst = store.loadconfig()
+    jobinstance = job(cluster,weinst)
+    jobinstance.tasklist = store.loadtasks()
+    for jdsc in jobinstance.tasklist:
+        jdsc.workenv = weinst
+    jobinstance.buildindex()
+    # Recovering the transitions not stored, they are kept as 
+    # changed tasks until the next bookeepingjobs call
+    entries = store.replay()
+    for entry in entries:
+        jdsc = jobinstance.taskmap[entry['index']]
+        jdsc.state,jdsc.status = entry['new']
+        for key in [ 'ID', 'tsubmitted', 'tstarted', 'tfinished', 'tstale' ]:
+            # Journals written before the stale state was introduced
+            setattr(jdsc,key,entry.get(key))
+        # The timestamps are the journaled ones, not the replay time
+        jobinstance.settaskstate(jdsc,stamp=False)
+        jobinstance.dirty.add(jdsc.index)
+    if len(entries) != 0:
+        print "\033[1;34mINFO\033[1;m Recovered %i not stored transitions"\
+                " from '%s'" % (len(entries),store.journalfile)
+    jobinstance.store = store
     
-    return events
+    return jobinstance
 
+class tokenbucket(object):
+    """..class:: tokenbucket
 
-def bookeepingjobs(jobinstance):
-    """.. function::bookeepingjobs(listjobs) 
-    stores  the list of the jobdescription instances found in 'listjobs' and 
-    which can be accessed using the accesingjobsinfo functions. 
-    The function is useful to snapshot the status of the jobs
-    amongst other information
+    Rate limiter (token bucket algorithm) shareable between threads. 
+    The bucket is filled with `rate` tokens per second up to `burst` 
+    tokens, every action has to acquire a token before proceeding
     """
-    import shelve
-    d = shelve.open(".presentjobs",writeback=True)
-    #d['joblist'] = listjobs
-    d['jobinstance'] = jobinstance
+    def __init__(self,rate=None,burst=1):
+        """..class:: tokenbucket([rate,burst])
 
-    d.close()
+        :param rate: number of tokens per second, None for no limit
+        :type  rate: float
+        :param burst: maximum number of tokens available at once
+        :type  burst: int
+        """
+        import threading
+        import time
 
-def accessingjobsinfo(filename='.presentjobs'):
-    """.. function::accessingjobsinfo(filename) 
-    retrieve a shelve object containing jobdescription objects
-    """
-    import shelve
-    d = shelve.open(filename)
-    #joblist = d['joblist'] 
-    jobinstance = d['jobinstance']
+        self.rate   = rate
+        self.burst  = max(1,burst)
+        self.tokens = float(self.burst)
+        self.last   = time.time()
+        self.lock   = threading.Lock()
 
-    d.close()
-    
-    return jobinstance
+    def acquire(self):
+        """..method ::acquire()
+
+        wait until a token is available and consume it
+        """
+        import time
+
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst,self.tokens+(now-self.last)*self.rate)
+                self.last = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0-self.tokens)/self.rate
+            time.sleep(wait)
 
 class jobdescription(object):
     """..class:: jobdescription
@@ -390,6 +680,14 @@ class jobdescription(object):
         self.status = None
         self.state  = None
         self.index  = None
+        # Time of the transitions to submitted, running and finished 
+        # (or aborted) states
+        self.tsubmitted = None
+        self.tstarted   = None
+        self.tfinished  = None
+        # Time since the state could not be obtained from the cluster
+        # (None: the state is up to date)
+        self.tstale     = None
         for _var,_value in kw.iteritems():
             setattr(self,_var,_value)
 
@@ -397,7 +695,7 @@ class jobdescription(object):
         """..method ::__str__(self)
         representation of a jobdescription
         """
-        repr = "<jobdescription instance>: Index:%i, ID:%i, state:%s (%s)" % \
+        repr = "<jobdescription instance>: Index:%i, ID:%s, state:%s (%s)" % \
                 (self.index,self.ID,self.state,self.status)
         return repr
 
@@ -433,6 +731,22 @@ class job(object):
         # status, therefore no possibility to any task to be with 
         # two different states
         self.taskstates  = {}
+        # Index of the tasks per state and per (state,status): 
+        # { state: set(ind1,...), (state,status): set(ind1,...), ...}
+        # and tasks per index, updated on every transition (see 
+        # settaskstate)
+        self.stateindex  = {}
+        self.taskmap     = {}
+        # Number of tasks polled and skipped in the last update
+        self.npolled     = 0
+        self.nskipped    = 0
+        # The jobstore where the job is kept (see bookeepingjobs) and
+        # the indices of the tasks changed since the last storage
+        self.store       = None
+        self.dirty       = set()
+        # The indices of the tasks successfully finished since the 
+        # last storage, to be added to the runtime history
+        self.completed   = set()
         
         # Any extra?
         for _var,_value in kw.iteritems():
@@ -445,42 +759,186 @@ class job(object):
         are initialized
         """
         self.tasklist = self.weinst.preparejobs(asetup_extra)
+        self.buildindex()
 
-    def submit(self):
-        """..method ::submit
+    def buildindex(self):
+        """..method ::buildindex()
+
+        (re-)build the task state index from the list of tasks. 
+        Needed as well by instances created before the index was 
+        introduced
+        """
+        self.taskstates = {}
+        self.stateindex = {}
+        self.taskmap    = {}
+        if not self.tasklist:
+            return
+        for jdsc in self.tasklist:
+            self.settaskstate(jdsc)
+
+    def settaskstate(self,jdsc,stamp=True):
+        """..method ::settaskstate(jdsc[,stamp])
+
+        register the current state and status of the task, keeping
+        the state index up to date. Must be called after any action
+        which could change the state of a task
+
+        :param jdsc: the task
+        :type  jdsc: jobdescription
+        :param stamp: whether to register the time of the transition
+                      (see settimestamp), not wanted when the transition
+                      is recovered with its own timestamps
+        :type  stamp: bool
+        """
+        if not hasattr(self,'stateindex'):
+            self.buildindex()
+        self.taskmap[jdsc.index] = jdsc
+        newstate = (jdsc.state,jdsc.status)
+        try:
+            oldstate = self.taskstates[jdsc.index]
+        except KeyError:
+            oldstate = None
+        if oldstate == newstate:
+            return
+        if oldstate is not None:
+            self.stateindex[oldstate[0]].discard(jdsc.index)
+            self.stateindex[oldstate].discard(jdsc.index)
+            if not hasattr(self,'dirty'):
+                self.dirty = set()
+            self.dirty.add(jdsc.index)
+            if oldstate[0] != newstate[0]:
+                if stamp:
+                    self.settimestamp(jdsc)
+                if newstate == ('finished','ok'):
+                    if not hasattr(self,'completed'):
+                        self.completed = set()
+                    self.completed.add(jdsc.index)
+        self.stateindex.setdefault(newstate[0],set()).add(jdsc.index)
+        self.stateindex.setdefault(newstate,set()).add(jdsc.index)
+        self.taskstates[jdsc.index] = newstate
+        # Journaling the transition, and storing the changed tasks 
+        # when the journal is too long (only the snapshot of the tasks,
+        # the configuration and the runtime history are left to 
+        # bookeepingjobs)
+        store = getattr(self,'store',None)
+        if oldstate is not None and store is not None:
+            store.journal(jdsc,oldstate)
+            if store.needscompact():
+                store.compact(self.gettasks(self.dirty))
+                self.dirty = set()
+
+    def submit(self,arraymode=False,nworkers=NSUBMITTERS):
+        """..method ::submit([arraymode,nworkers]) 
 
         wrapper to the clusterspec method
+
+        :param arraymode: whether to send all the tasks in a single 
+                          cluster transaction (array job)
+        :type  arraymode: bool
+        :param nworkers: number of concurrent submissions
+        :type  nworkers: int
+        """
+        if arraymode:
+            self.submitarray(self.tasklist)
+            return
+        self.submittasks(self.tasklist,nworkers)
+
+    def submitarray(self,tasklist):
+        """..method ::submitarray(tasklist)
+
+        send the tasks in a single cluster transaction (array job), the
+        cluster IDs of the array elements are assigned to the tasks (see
+        clusterspec.submitarray)
+
+        :param tasklist: the tasks to be submitted
+        :type  tasklist: list(jobdescription)
         """
         import time
-        from job_sender.clusterfactory import taucluster
 
-        for jb in self.tasklist:
+        if len(tasklist) == 0:
+            return
+        start = time.time()
+        self.cluster.submitarray(tasklist)
+        for jb in tasklist:
+            self.settaskstate(jb)
+        elapsed = time.time()-start
+        nsubmitted = len(filter(lambda x: x.state == 'submitted' and \
+                x.status == 'ok' and x.ID is not None,tasklist))
+        print "\033[1;34mINFO\033[1;m Submitted %i/%i jobs in %.1f s [%.2f jobs/s]" % \
+                (nsubmitted,len(tasklist),elapsed,nsubmitted/max(elapsed,1e-6))
+
+    def submittasks(self,tasklist,nworkers=NSUBMITTERS):
+        """..method ::submittasks(tasklist[,nworkers]) 
+
+        submission engine: the tasks are sent concurrently using a
+        pool of `nworkers` threads, limited by the submission rate
+        allowed by the cluster (see clusterspec.submitrate)
+
+        :param tasklist: the tasks to be submitted
+        :type  tasklist: list(jobdescription)
+        :param nworkers: number of concurrent submissions
+        :type  nworkers: int
+        """
+        import time
+        import threading
+        from multiprocessing.pool import ThreadPool
+
+        if len(tasklist) == 0:
+            return
+        bucket = tokenbucket(getattr(self.cluster,'submitrate',None),
+                getattr(self.cluster,'submitburst',1))
+        lock = threading.Lock()
+        def _submit(jb):
+            bucket.acquire()
             self.cluster.submit(jb)
-            # wait 2 seconds, before submit the next one
-            # JUST do that for the taucluster
-            if isinstance(self.cluster,taucluster):
-                time.sleep(2)
+            # The transition is registered (and journaled) as soon as
+            # the task is sent
+            with lock:
+                self.settaskstate(jb)
+
+        start = time.time()
+        pool = ThreadPool(max(1,min(int(nworkers),len(tasklist))))
+        try:
+            pool.map(_submit,tasklist)
+        finally:
+            pool.close()
+            pool.join()
+            for jb in tasklist:
+                self.settaskstate(jb)
+        elapsed = time.time()-start
+        nsubmitted = len(filter(lambda x: x.state == 'submitted' and \
+                x.status == 'ok' and x.ID is not None,tasklist))
+        print "\033[1;34mINFO\033[1;m Submitted %i/%i jobs in %.1f s [%.2f jobs/s]" % \
+                (nsubmitted,len(tasklist),elapsed,nsubmitted/max(elapsed,1e-6))
     
-    def resubmit(self,joblist):
-        """..method ::resubmit(joblist) 
+    def resubmit(self,joblist,nworkers=NSUBMITTERS,arraymode=True):
+        """..method ::resubmit(joblist[,nworkers,arraymode])
 
         wrapper to the clusterspec resubmit method.
         Note that only 'finished' with 'fail' status,
-        'aborted' and 'configured' states are sensitives 
-        to be resubmitted
+        'aborted' and 'configured' states are sensitives
+        to be resubmitted. By default, all the tasks are sent
+        in a single cluster transaction (see submitarray)
+
+        :param joblist: the tasks to be resubmitted
+        :type  joblist: list(jobdescription)
+        :param nworkers: number of concurrent submissions (without
+                         arraymode)
+        :type  nworkers: int
+        :param arraymode: whether to send all the tasks in a single
+                          cluster transaction (array job)
+        :type  arraymode: bool
         """
         # Get the list of jobs-to-be-resubmitted (jtbr) from the 
         # ('finished','fail') or 'aborted' ones
-        jobindexlist = map(lambda x: x.index,joblist)
-        abortedindexlist  = map(lambda x: x,self.getdictof('aborted').keys())
-        configuredindexlist  = map(lambda x: x,self.getdictof('configured').keys())
-        finishedindexlist  = map(lambda x: x[0],\
-                filter(lambda (ind,(state,status)): status == 'fail', self.getdictof('finished').iteritems()))
-        totalindexlist = abortedindexlist+finishedindexlist+configuredindexlist
-        toresubmitindices = list(set(jobindexlist).intersection(totalindexlist))
+        jobindexlist = set(map(lambda x: x.index,joblist))
+        totalindexlist = self.getindicesof('aborted') | \
+                self.getindicesof('finished','fail') | \
+                self.getindicesof('configured')
+        toresubmitindices = jobindexlist.intersection(totalindexlist)
         # Eliminated from the jtbr list the finished (fail) and aborted ones 
         # (picked them up above)
-        renmant = set(jobindexlist).difference(toresubmitindices)
+        renmant = jobindexlist.difference(toresubmitindices)
         if len(renmant) != 0:
             premessage = "\033[1;33mWARNING\033[1;m JOBS ["
             for i in sorted(renmant):
@@ -490,10 +948,12 @@ class job(object):
             message += " state, resubmit has no sense in them, so they're ignored..."
             print message
 
-        toresubmit = filter(lambda x: x.index in toresubmitindices,joblist)
+        toresubmit = self.gettasks(toresubmitindices)
         print "Resubmitting jobs..."
-        for ik in toresubmit:
-            self.cluster.submit(ik)
+        if arraymode:
+            self.submitarray(toresubmit)
+        else:
+            self.submittasks(toresubmit,nworkers)
 
     def reconfigure(self,joblist):
         """..method ::reconfigure(joblist) 
@@ -502,11 +962,10 @@ class job(object):
         to 'configure' state
         """
         # Get the list of jobs-to-be-reconfigured (jtbrc) from the submitted ones
-        jobindexlist = map(lambda x: x.index,joblist)
-        indexlist  = map(lambda x: x,self.getdictof(None).keys())
-        toreconfigureindices = list(set(jobindexlist).intersection(indexlist))
+        jobindexlist = set(map(lambda x: x.index,joblist))
+        toreconfigureindices = jobindexlist.intersection(self.getindicesof(None))
         # Eliminated from the jtbrc list the above ones
-        renmant = set(jobindexlist).difference(toreconfigureindices)
+        renmant = jobindexlist.difference(toreconfigureindices)
         # Get the list of jtbrc from the running ones
         if len(renmant) != 0:
             premessage = "\033[1;33mWARNING\033[1;m JOBS ["
@@ -517,13 +976,14 @@ class job(object):
             message += " no sense in them, so they're ignored..."
             print message
 
-        toreconfigure = filter(lambda x: x.index in toreconfigureindices,joblist)
+        toreconfigure = self.gettasks(toreconfigureindices)
         print "Reconfiguring ..."
         for ik in toreconfigure:
             # FIXME: Sure? or must it be called from the self.workenv.reconfigure ??
             #        in this way is more coherent
             ik.state = 'configured'
             ik.status= 'ok'        
+            self.settaskstate(ik)
 
     def kill(self,joblist):
         """..method ::kill(joblist) 
@@ -533,16 +993,14 @@ class job(object):
         states are sensitives to killing
         """
         # Get the list of jobs-to-be-killed (jtbk) from the submitted ones
-        jobindexlist = map(lambda x: x.index,joblist)
-        sbindexlist  = map(lambda x: x,self.getdictof('submitted').keys())
-        tokillsb = list(set(jobindexlist).intersection(sbindexlist))
+        jobindexlist = set(map(lambda x: x.index,joblist))
+        tokillsb = jobindexlist.intersection(self.getindicesof('submitted'))
         # Eliminated from the jtbk list the submitted ones (picked them up above)
-        remaining = set(jobindexlist).difference(tokillsb)
+        remaining = jobindexlist.difference(tokillsb)
         # Get the list of jtbk from the running ones
-        runindexlist = map(lambda x: x,self.getdictof('running').keys())
-        tokillrn = list(remaining.intersection(runindexlist))
+        tokillrn = remaining.intersection(self.getindicesof('running'))
         # Eliminated from the jtbk list the running ones (picked them up above)
-        renmant = list(remaining.difference(tokillrn))
+        renmant = remaining.difference(tokillrn)
         if len(renmant) != 0:
             premessage = "\033[1;33mWARNING\033[1;m JOBS ["
             for i in sorted(renmant):
@@ -552,13 +1010,35 @@ class job(object):
             message += " no sense in them, so they're ignored..."
             print message
 
-        tokillindices = tokillsb+tokillrn
-        tokill = filter(lambda x: x.index in tokillindices,joblist)
+        tokill = self.gettasks(tokillsb | tokillrn)
         print "Killing them..."
+        # All of them at once
+        self.cluster.killarray(tokill)
         for ik in tokill:
-            self.cluster.kill(ik)
+            self.settaskstate(ik)
 
 
+    def settimestamp(self,jdsc):
+        """..method ::settimestamp(jdsc)
+
+        register the time of the transition of the task to its
+        current state
+
+        :param jdsc: the task
+        :type  jdsc: jobdescription
+        """
+        import time
+
+        now = time.time()
+        if jdsc.state == 'submitted':
+            jdsc.tsubmitted = now
+            jdsc.tstarted   = None
+            jdsc.tfinished  = None
+        elif jdsc.state == 'running':
+            jdsc.tstarted   = now
+        elif jdsc.state == 'finished' or jdsc.state == 'aborted':
+            jdsc.tfinished  = now
+
     def getlistoftasks(self):
         """..method ::getlistoftasks() -> jobdescriptionlist
 
@@ -566,18 +1046,46 @@ class job(object):
         """
         return self.tasklist
 
+    def gettasks(self,indices):
+        """..method ::gettasks(indices) -> jobdescriptionlist
+
+        return the jobdescription instances of the given task
+        indices (sorted by index), the indices not corresponding 
+        to any task are ignored
+        """
+        if not hasattr(self,'taskmap'):
+            self.buildindex()
+        return map(lambda i: self.taskmap[i],
+                filter(lambda i: i in self.taskmap,sorted(indices)))
+
     def update(self):
-        """..method ::update() 
+        """..method ::update() -> nchanged
         update the state and status of the job by looking at
         the state of its tasks
+
+        :return: the number of tasks which changed its state or status
+        :rtype: int
         """
         import sys
 
         i=0
-        point = float(len(self.tasklist))/100.0
-        # Just checking in those with possible changing of state
-        checkabletasks = filter(lambda x: x.state != 'finished' or
-                x.state != 'aborted',self.tasklist)
+        nchanged=0
+        # Just checking in those with possible changing of state (the 
+        # active ones), the rest are frozen until resubmitted
+        checkabletasks = self.gettasks(self.getactiveindices())
+        self.npolled  = len(checkabletasks)
+        self.nskipped = len(self.tasklist)-self.npolled
+        point = max(float(len(checkabletasks)),1.0)/100.0
+        # The tasks whose submission result is unknown are looked for
+        # in the cluster first
+        unknown = filter(lambda x: x.ID is None,checkabletasks)
+        if len(unknown) != 0:
+            if not hasattr(self,'dirty'):
+                self.dirty = set()
+            self.dirty.update(map(lambda x: x.index,self.cluster.reconcile(unknown)))
+        # Obtain the states of all the tasks at once (when the cluster
+        # allows it), and distribute them afterwards
+        knownstates = self.cluster.checkstates(checkabletasks)
         for jdsc in checkabletasks:
             i+=1
             # Progress bar 
@@ -585,14 +1093,72 @@ class job(object):
                     "[ "+"\b"+str(int(float(i)/point)).rjust(3)+"%]")
             sys.stdout.flush()
             # end progress bar
-            self.cluster.getnextstate(jdsc,self.weinst.checkfinishedjob)
-            self.taskstates[jdsc.index] = (jdsc.state,jdsc.status)
+            before = (jdsc.state,jdsc.status)
+            tstale = getattr(jdsc,'tstale',None)
+            self.cluster.getnextstate(jdsc,self.weinst.checkfinishedjob,
+                    knownstates.get(jdsc.index))
+            if before != (jdsc.state,jdsc.status):
+                nchanged+=1
+            elif tstale != getattr(jdsc,'tstale',None):
+                # Not a transition, but the task must be stored
+                if not hasattr(self,'dirty'):
+                    self.dirty = set()
+                self.dirty.add(jdsc.index)
+            self.settaskstate(jdsc)
         print
+        print "\033[1;34mINFO\033[1;m Polled %i active tasks, skipped %i"\
+                " inactive tasks" % (self.npolled,self.nskipped)
+        return nchanged
+
+    def getactiveindices(self):
+        """..method ::getactiveindices() -> set(ind1,...)
+        return the indices of the active tasks, i.e. the ones which
+        can change its state in the cluster (submitted or running)
+        """
+        return self.getindicesof('submitted') | self.getindicesof('running')
+
+    def watch(self,persist=None,mininterval=WATCHMIN,maxinterval=WATCHMAX):
+        """..method ::watch([persist,mininterval,maxinterval])
+        keep updating the tasks until none of them is submitted or 
+        running. The time between checks adapts to the observed rate 
+        of state changes: it shrinks while tasks are changing, and it 
+        backs off (up to `maxinterval`) while nothing happens
+
+        :param persist: function called with this instance after each
+                        check which has changed any task
+        :type  persist: callable
+        :param mininterval: minimum time between checks (seconds)
+        :type  mininterval: float
+        :param maxinterval: maximum time between checks (seconds)
+        :type  maxinterval: float
+        """
+        import time
+
+        interval = mininterval
+        nactive  = len(self.getactiveindices())
+        while nactive != 0:
+            nchanged = self.update()
+            if nchanged != 0:
+                self.showstates()
+                if persist:
+                    persist(self)
+                # the larger the fraction of tasks changing, the faster
+                interval = max(mininterval,interval/(1.0+10.0*nchanged/float(nactive)))
+            else:
+                interval = min(maxinterval,interval*1.5)
+            nactive = len(self.getactiveindices())
+            if nactive != 0:
+                print "\033[1;34mINFO\033[1;m %i active tasks, next check in %i seconds" % \
+                        (nactive,interval)
+                time.sleep(interval)
+        print "\033[1;34mINFO\033[1;m No tasks left in the cluster"
 
     def showstates(self):
         """..method ::showstates()
         print a summary of the states and status of the tasks
         """
+        import time
+
         #self.__cacheupdate__()
         message = "\033[1;34mINFO\033[1;m List of tasks with state:\n"
         for state in STATESORDER:
@@ -600,14 +1166,31 @@ class job(object):
             if listof:
                 preformat = " + %"+str(NLETTERS)+"s: %s\n"
                 message += preformat % (str(state).upper(),listof)
+        # The active tasks whose state could not be obtained
+        stale = filter(lambda x: getattr(x,'tstale',None) is not None,
+                self.gettasks(self.getactiveindices()))
+        if stale:
+            message += "\033[1;33mWARNING\033[1;m The cluster could not be queried for"\
+                    " %i tasks, showing their last known state (since %i seconds)\n" % \
+                    (len(stale),time.time()-min(map(lambda x: x.tstale,stale)))
         print message
         
+    def getindicesof(self,state,status=None):
+        """ ..getindicesof(state[,status]) -> set(ind1,...)
+        return the indices of the tasks with state==state (and
+        status==status, if given)
+        """
+        if not hasattr(self,'stateindex'):
+            self.buildindex()
+        if status is None:
+            return set(self.stateindex.get(state,()))
+        return set(self.stateindex.get((state,status),()))
+
     def getdictof(self,state):
         """ ..getdictof(state) -> '{ ind1: (ste1,stus1), ...}'
         return a kind sub-dict of taskstates with state==state 
         """
-        l = filter(lambda (id,(ste,stus)): ste == state,self.taskstates.iteritems())
-        return dict(l)
+        return dict(map(lambda i: (i,self.taskstates[i]),self.getindicesof(state)))
    
     def getlistofindices(self,state):
         """ ..getlistofindices(state) -> '[ind1, ind2, ...]'
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+""":mod:`jobstore` -- Persistent state of the jobs
+===================================================
+
+.. module:: jobstore
+   :platform: Unix
+   :synopsis: Module which contains the jobstore class, the storage
+              of the state of a production (a 'job' instance) in a
+              SQLite file in the working path. The production
+              configuration (the clusterspec and workenv instances)
+              is only re-written when it changes, while each task (jobdescription) is a
+              row which is only re-written when the task changes, so
+              the storage cost of a command is proportional to the
+              number of tasks it touches.
+.. moduleauthor:: Jordi Duarte-Campderros <jorge.duarte.campderros@cern.ch>
+"""
+
+# The name of the store file in the working path
+STOREFILE = '.presentjobs.sqlite'
+# The columns of the tasks table (and the jobdescription datamembers)
+TASKCOLUMNS = [ 'path', 'script', 'ID', 'state', 'status',
+        'tsubmitted', 'tstarted', 'tfinished', 'tstale' ]
+# The extension of the journal of transitions (placed besides the store)
+JOURNALEXT = '.journal'
+# Number of journal entries which triggers a compaction into the store
+COMPACTEVERY = 1000
+
+class jobstore(object):
+    """..class:: jobstore
+
+    Storage of a production in a SQLite file, with two tables:
+     * config: the (pickled) configuration of the production, i.e.
+       the clusterspec and the workenv instances
+     * tasks: one row per task (jobdescription) with its index,
+       path, script, cluster ID, state, status and timestamps (the
+       transitions and since when the state is unknown, see tstale)
+    
+    Besides the SQLite file, an append-only journal keeps the task
+    transitions not yet stored in the tasks table (one JSON line per
+    transition), so they can be recovered if the process is 
+    interrupted before the tasks are stored. The journal is emptied
+    once the tasks are stored (see compact)
+    """
+    def __init__(self,filename=STOREFILE):
+        """..class:: jobstore([filename])
+
+        :param filename: the SQLite file, created if does not exist
+        :type  filename: str
+        """
+        import sqlite3
+        import os
+
+        self.filename = os.path.abspath(filename)
+        self.journalfile = os.path.splitext(self.filename)[0]+JOURNALEXT
+        self.journalfd = None
+        self.njournal = 0
+        # The pickled configuration as it is in the file, to re-write
+        # it only when it changes
+        self.configblobs = {}
+        # The tasks could be submitted from several threads (serialized
+        # by the caller)
+        self.conn = sqlite3.connect(self.filename,check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS config "\
+                    "(key TEXT PRIMARY KEY, value BLOB)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tasks "\
+                    "(idx INTEGER PRIMARY KEY, path TEXT, script TEXT, ID TEXT,"\
+                    " state TEXT, status TEXT, tsubmitted REAL, tstarted REAL,"\
+                    " tfinished REAL, tupdated REAL, tstale REAL)")
+            # Stores created before the stale state was introduced
+            columns = map(lambda x: x[1],self.conn.execute("PRAGMA table_info(tasks)"))
+            if 'tstale' not in columns:
+                self.conn.execute("ALTER TABLE tasks ADD COLUMN tstale REAL")
+
+    def hasconfig(self):
+        """..method:: hasconfig() -> bool
+
+        whether the production configuration is already stored
+        """
+        return self.conn.execute("SELECT COUNT(*) FROM config").fetchone()[0] != 0
+
+    def storeconfig(self,cluster,weinst):
+        """..method:: storeconfig(cluster,weinst)
+
+        store the configuration of the production. Only the instances
+        whose pickle changed since they were stored (or loaded) are
+        re-written, as the cluster keeps some state (the last cluster
+        ID, the circuit breaker, the options given in later commands)
+
+        :param cluster: the cluster where the job is sent
+        :type  cluster: clusterspec concrete class instance
+        :param  weinst: the type of work the user want to perform
+        :type   weinst: workenv concrete class instance
+        """
+        import cPickle
+        import sqlite3
+
+        changed = []
+        for key,value in [ ('cluster',cluster), ('workenv',weinst) ]:
+            blob = cPickle.dumps(value,cPickle.HIGHEST_PROTOCOL)
+            if self.configblobs.get(key) != blob:
+                changed.append( (key,blob) )
+        if len(changed) == 0:
+            return
+        with self.conn:
+            for key,blob in changed:
+                self.conn.execute("INSERT OR REPLACE INTO config VALUES (?,?)",
+                        (key,sqlite3.Binary(blob)))
+        self.configblobs.update(changed)
+
+    def loadconfig(self):
+        """..method:: loadconfig() -> (cluster,weinst)
+
+        retrieve the configuration of the production
+        """
+        import cPickle
+
+        self.configblobs = dict(map(lambda (key,value): (str(key),str(value)),
+            self.conn.execute("SELECT key,value FROM config")))
+        config = dict(map(lambda (key,blob): (key,cPickle.loads(blob)),
+            self.configblobs.iteritems()))
+        if not config.has_key('cluster') or not config.has_key('workenv'):
+            raise RuntimeError('Malformed jobs file "{0}", the production'\
+                    ' configuration is missing'.format(self.filename))
+        return config['cluster'],config['workenv']
+
+    def storetasks(self,jdsclist):
+        """..method:: storetasks(jdsclist)
+
+        store (insert or update) the rows of the given tasks in a
+        single transaction
+
+        :param jdsclist: the tasks to be stored
+        :type  jdsclist: list(jobssender.jobdescription)
+        """
+        import time
+
+        now = time.time()
+        rows = []
+        for jdsc in jdsclist:
+            values = map(lambda c: getattr(jdsc,c,None),TASKCOLUMNS)
+            # The cluster ID could be an int or a str
+            if values[2] is not None:
+                values[2] = str(values[2])
+            rows.append( [jdsc.index]+values+[now] )
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO tasks (idx,{0},tupdated)"\
+                    " VALUES ({1})".format(','.join(TASKCOLUMNS),
+                        ','.join(['?']*(len(TASKCOLUMNS)+2))),rows)
+
+    def loadtasks(self):
+        """..method:: loadtasks() -> jdsclist
+
+        retrieve all the tasks, sorted by index
+
+        :return: the tasks
+        :rtype: list(jobssender.jobdescription)
+        """
+        from jobssender import jobdescription
+
+        jdsclist = []
+        for row in self.conn.execute("SELECT idx,{0} FROM tasks ORDER BY idx".format(
+                ','.join(TASKCOLUMNS))):
+            kw = dict(zip(TASKCOLUMNS,row[1:]))
+            # sqlite returns unicode
+            for key in [ 'path', 'script', 'ID', 'state', 'status' ]:
+                if kw[key] is not None:
+                    kw[key] = str(kw[key])
+            if kw['ID'] is not None and kw['ID'].isdigit():
+                kw['ID'] = int(kw['ID'])
+            jdsclist.append( jobdescription(index=row[0],**kw) )
+        return jdsclist
+
+    def journal(self,jdsc,oldstate):
+        """..method:: journal(jdsc,oldstate)
+
+        append the transition of a task to the journal
+
+        :param jdsc: the task, already in its new state
+        :type  jdsc: jobssender.jobdescription
+        :param oldstate: the previous (state,status) of the task
+        :type  oldstate: tuple(str,str)
+        """
+        import json
+        import time
+
+        if self.journalfd is None:
+            self.journalfd = open(self.journalfile,'a')
+        entry = { 'index': jdsc.index, 'old': oldstate, 
+                'new': (jdsc.state,jdsc.status), 't': time.time() }
+        for key in [ 'ID', 'tsubmitted', 'tstarted', 'tfinished', 'tstale' ]:
+            entry[key] = getattr(jdsc,key,None)
+        self.journalfd.write(json.dumps(entry)+'\n')
+        self.journalfd.flush()
+        self.njournal += 1
+
+    def replay(self):
+        """..method:: replay() -> entries
+
+        retrieve the transitions of the journal, in the order they 
+        were produced. A truncated last line (the process died while 
+        writing it) is ignored
+
+        :return: the transitions, dicts with the keys 'index', 'old',
+                 'new', 't', 'ID', 'tsubmitted', 'tstarted', 'tfinished'
+                 and 'tstale' (missing in journals written before the stale
+                 state was introduced)
+        :rtype: list(dict)
+        """
+        import json
+        import os
+
+        if not os.path.isfile(self.journalfile):
+            return []
+        entries = []
+        with open(self.journalfile) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                # json returns unicode
+                if isinstance(entry['ID'],unicode):
+                    entry['ID'] = str(entry['ID'])
+                entry['new'] = tuple(map(lambda x: x if x is None else str(x),
+                    entry['new']))
+                entries.append(entry)
+        self.njournal = len(entries)
+        return entries
+
+    def compact(self,jdsclist):
+        """..method:: compact(jdsclist)
+
+        store the given tasks (which must include all the tasks 
+        present in the journal) and empty the journal
+
+        :param jdsclist: the tasks to be stored
+        :type  jdsclist: list(jobssender.jobdescription)
+        """
+        if jdsclist:
+            self.storetasks(jdsclist)
+        if self.journalfd is not None:
+            self.journalfd.close()
+        # Truncating it
+        open(self.journalfile,'w').close()
+        self.journalfd = None
+        self.njournal = 0
+
+    def needscompact(self):
+        """..method:: needscompact() -> bool
+
+        whether the journal is long enough to be compacted
+        """
+        return self.njournal >= COMPACTEVERY
+
+    def close(self):
+        """..method:: close()
+        """
+        if self.journalfd is not None:
+            self.journalfd.close()
+            self.journalfd = None
+        self.conn.close()
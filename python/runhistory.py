@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+""":mod:`runhistory` -- Runtime history of the productions
+==========================================================
+
+.. module:: runhistory
+   :platform: Unix
+   :synopsis: Module which contains the runhistory class, a SQLite
+              file keeping the walltime and the number of events
+              processed by the successfully finished tasks. The
+              entries are keyed by the kind of job and its
+              configuration file (see workenv.gethistorykey), so the
+              throughput measured in previous productions can be used
+              to define the number of jobs and the queue of a new one.
+              Like the events cache, the file can be shared between
+              users by placing it in a common path (see HISTORYENV).
+.. moduleauthor:: Jordi Duarte-Campderros <jorge.duarte.campderros@cern.ch>
+"""
+
+# The environment variable defining the history file
+HISTORYENV = 'JOBSENDER_HISTORY'
+# The default history file
+HISTORYFILE = '~/.jobsender/runtime_history.sqlite'
+# Number of the most recent tasks used to estimate the time per event
+NHISTORY = 500
+# The quantile of the time per event of the tasks used as estimation
+# (an upper quantile, as the jobs exceeding the walltime are killed)
+HISTORYQUANTILE = 0.9
+
+def gethistoryfile():
+    """..function:: gethistoryfile() -> filename
+
+    the history file to be used: the one defined by the HISTORYENV
+    environment variable if present, otherwise HISTORYFILE
+
+    :return: the absolute path of the history file
+    :rtype: str
+    """
+    import os
+
+    return os.path.abspath(os.path.expanduser(os.getenv(HISTORYENV,HISTORYFILE)))
+
+class runhistory(object):
+    """..class:: runhistory
+
+    Walltime and events of the finished tasks, stored in a SQLite
+    file with a single table:
+     * runs: (key,events,walltime,tfinished), one row per task
+    """
+    def __init__(self,filename=None):
+        """..class:: runhistory([filename])
+
+        :param filename: the SQLite file, created if does not exist
+                         [Default: gethistoryfile()]
+        :type  filename: str
+        """
+        import sqlite3
+        import os
+
+        if not filename:
+            filename = gethistoryfile()
+        self.filename = filename
+        if not os.path.isdir(os.path.dirname(self.filename)):
+            os.makedirs(os.path.dirname(self.filename))
+        # Shared between processes, wait for the lock of the others
+        self.conn = sqlite3.connect(self.filename,timeout=60)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS runs "\
+                    "(key TEXT, events INTEGER, walltime REAL, tfinished REAL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS runs_key ON runs (key,tfinished)")
+
+    def record(self,key,runs):
+        """..method:: record(key,runs)
+
+        store the walltime and events of finished tasks (the tasks
+        without events or walltime are ignored)
+
+        :param key: the kind of job
+        :type  key: str
+        :param runs: the events, walltime and finishing time of the tasks
+        :type  runs: list((int,float,float))
+        """
+        rows = map(lambda (events,walltime,tfinished): (key,events,walltime,tfinished),
+                filter(lambda (events,walltime,tfinished): events > 0 and walltime > 0,runs))
+        with self.conn:
+            self.conn.executemany("INSERT INTO runs VALUES (?,?,?,?)",rows)
+
+    def timeperevent(self,key,quantile=HISTORYQUANTILE):
+        """..method:: timeperevent(key[,quantile]) -> seconds
+
+        the estimated time to process an event, from the time per
+        event of the most recent tasks of a kind of job
+
+        :param key: the kind of job
+        :type  key: str
+        :param quantile: the quantile of the time per event of the
+                         tasks used as estimation
+        :type  quantile: float
+
+        :return: the time per event (seconds), or None if there is no
+                 history for the kind of job
+        :rtype: float
+        """
+        values = sorted(map(lambda (events,walltime): walltime/float(events),
+            self.conn.execute("SELECT events,walltime FROM runs WHERE key=?"\
+                    " ORDER BY tfinished DESC LIMIT ?",(key,NHISTORY))))
+        if len(values) == 0:
+            return None
+        return values[min(int(quantile*len(values)),len(values)-1)]
+
+    def close(self):
+        """..method:: close()
+        """
+        self.conn.close()
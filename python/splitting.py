@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+""":mod:`splitting` -- Splitting of the input events in jobs
+============================================================
+
+.. module:: splitting
+   :platform: Unix
+   :synopsis: Module gathering the strategies to split the events of
+              a production in jobs. Every strategy returns a list of
+              (skipevts,nevents) tuples, one per job, defined over the
+              events of all the input files (in order): the events of
+              the jobs cover all the events exactly once, without
+              overlaps. The boundaries are obtained by bisecting
+              cumulative sums, so the cost does not depend on the
+              number of events. The exception is the 'lpt' strategy,
+              which assigns whole input files to the jobs: its events
+              are defined over the input files of each job.
+.. moduleauthor:: Jordi Duarte-Campderros <jorge.duarte.campderros@cern.ch>
+"""
+
+# The available strategies
+STRATEGIES = [ 'events', 'files', 'bytes', 'walltime', 'lpt' ]
+# The available cost estimations of the input files (see getcostperfile)
+COSTS = [ 'events', 'size', 'time' ]
+
+def cumulative(values):
+    """..function:: cumulative(values) -> cumsum
+
+    :return: the cumulative sum of the values, starting with 0 (so
+             the element i is the sum of the values before i)
+    :rtype: list
+    """
+    cumsum = [0]
+    for value in values:
+        cumsum.append(cumsum[-1]+value)
+    return cumsum
+
+def fromboundaries(boundaries):
+    """..function:: fromboundaries(boundaries) -> skipandperform
+
+    the jobs defined by the first event of each job (and the total
+    number of events at the end), empty jobs are removed
+
+    :param boundaries: non-decreasing list of events, starting with 0
+    :type  boundaries: list(int)
+
+    :return: the events to be skipped and processed per job
+    :rtype: list((int,int))
+    """
+    return filter(lambda (skip,n): n > 0,
+            map(lambda i: (boundaries[i],boundaries[i+1]-boundaries[i]),
+                xrange(len(boundaries)-1)))
+
+def trimtoevents(evtmax,evtsperfile,bytesperfile=None):
+    """..function:: trimtoevents(evtmax,evtsperfile[,bytesperfile]) -> (evtsperfile,bytesperfile)
+
+    keep only the first evtmax events of the input files: the files
+    after them are removed and the last one is cut (its size is
+    scaled, assuming the events have the same size inside each file)
+
+    :param evtmax: the total number of events
+    :type  evtmax: int
+    :param evtsperfile: the number of events per input file
+    :type  evtsperfile: list(int)
+    :param bytesperfile: the size of each input file
+    :type  bytesperfile: list(int)
+
+    :return: the events (and the size, None if not given) per input
+             file needed
+    :rtype: (list(int),list(int))
+    """
+    import bisect
+
+    firstevt = cumulative(evtsperfile)
+    if evtmax >= firstevt[-1]:
+        return evtsperfile,bytesperfile
+    # The file containing the last event
+    nfiles = bisect.bisect_left(firstevt,evtmax)
+    evtsperfile = evtsperfile[:nfiles]
+    if nfiles != 0:
+        lastevts = evtmax-firstevt[nfiles-1]
+        if bytesperfile:
+            bytesperfile = bytesperfile[:nfiles-1]+\
+                    [ bytesperfile[nfiles-1]*lastevts/max(evtsperfile[-1],1) ]
+        evtsperfile = evtsperfile[:-1]+[ lastevts ]
+    elif bytesperfile:
+        bytesperfile = []
+    return evtsperfile,bytesperfile
+
+def splitbyevents(evtmax,njobs):
+    """..function:: splitbyevents(evtmax,njobs) -> skipandperform
+
+    the same number of events per job (the remaining events are
+    distributed one per job from the first one)
+
+    :param evtmax: the total number of events
+    :type  evtmax: int
+    :param njobs: the number of jobs
+    :type  njobs: int
+    """
+    njobs = max(1,min(njobs,evtmax))
+    evtsperjob,remainevts = divmod(evtmax,njobs)
+    return fromboundaries(map(lambda i: i*evtsperjob+min(i,remainevts),
+        xrange(njobs+1)))
+
+def splitbyfiles(evtsperfile,njobs):
+    """..function:: splitbyfiles(evtsperfile,njobs) -> skipandperform
+
+    the same number of (whole) input files per job
+
+    :param evtsperfile: the number of events per input file
+    :type  evtsperfile: list(int)
+    :param njobs: the number of jobs
+    :type  njobs: int
+    """
+    nfiles = len(evtsperfile)
+    njobs = max(1,min(njobs,nfiles))
+    firstevt = cumulative(evtsperfile)
+    filesperjob,remainfiles = divmod(nfiles,njobs)
+    return fromboundaries(map(lambda i: firstevt[i*filesperjob+min(i,remainfiles)],
+        xrange(njobs+1)))
+
+def splitbybytes(evtsperfile,bytesperfile,njobs):
+    """..function:: splitbybytes(evtsperfile,bytesperfile,njobs) -> skipandperform
+
+    the same number of bytes to be read per job, assuming the events
+    have the same size inside each file
+
+    :param evtsperfile: the number of events per input file
+    :type  evtsperfile: list(int)
+    :param bytesperfile: the size of each input file
+    :type  bytesperfile: list(int)
+    :param njobs: the number of jobs
+    :type  njobs: int
+    """
+    import bisect
+
+    firstevt  = cumulative(evtsperfile)
+    firstbyte = cumulative(bytesperfile)
+    njobs = max(1,min(njobs,firstevt[-1]))
+    boundaries = [0]
+    for i in xrange(1,njobs):
+        target = firstbyte[-1]*i/float(njobs)
+        # The file containing the target byte
+        ifile = min(bisect.bisect_right(firstbyte,target),len(evtsperfile))-1
+        fraction = (target-firstbyte[ifile])/float(max(bytesperfile[ifile],1))
+        event = firstevt[ifile]+int(round(fraction*evtsperfile[ifile]))
+        boundaries.append(max(boundaries[-1],min(event,firstevt[-1])))
+    boundaries.append(firstevt[-1])
+    return fromboundaries(boundaries)
+
+def njobsforwalltime(evtmax,timeperevt,walltime):
+    """..function:: njobsforwalltime(evtmax,timeperevt,walltime) -> njobs
+
+    the number of jobs needed to process the events within a walltime
+
+    :param evtmax: the total number of events
+    :type  evtmax: int
+    :param timeperevt: the time to process an event (seconds)
+    :type  timeperevt: float
+    :param walltime: the target time per job (seconds)
+    :type  walltime: float
+    """
+    import math
+
+    if walltime <= 0 or timeperevt <= 0:
+        raise RuntimeError('The target walltime and the time per event must'\
+                ' be positive numbers')
+    return max(1,int(math.ceil(evtmax*timeperevt/float(walltime))))
+
+def splitbylpt(evtmax,evtsperfile,njobs,balanceby='events',bytesperfile=None,
+        timeperevt=None):
+    """..function:: splitbylpt(evtmax,evtsperfile,njobs[,balanceby,bytesperfile,timeperevt]) -> (skipandperform,filesperjob)
+
+    assign whole input files to the jobs balancing their estimated
+    cost (see getcostperfile and splitbycost). Only the files with the
+    first evtmax events are used (see trimtoevents): the last one is
+    partially processed, and it is always the last file of its job.
+    The jobs whose files have no events are removed
+
+    :param evtmax: the total number of events
+    :type  evtmax: int
+    :param evtsperfile: the number of events per input file
+    :type  evtsperfile: list(int)
+    :param njobs: the number of jobs
+    :type  njobs: int
+    :param balanceby: the cost estimation, one of COSTS
+    :type  balanceby: str
+    :param bytesperfile: the size of each input file
+    :type  bytesperfile: list(int)
+    :param timeperevt: the time to process an event (seconds)
+    :type  timeperevt: float
+
+    :return: the events to be skipped and processed per job (relative
+             to the input files of the job) and the indices of the
+             input files of each job
+    :rtype: (list((int,int)),list(list(int)))
+    """
+    evtsperfile,bytesperfile = trimtoevents(evtmax,evtsperfile,bytesperfile)
+    costs = getcostperfile(balanceby,evtsperfile,bytesperfile,timeperevt)
+    filesperjob = filter(lambda fl: sum(map(lambda k: evtsperfile[k],fl)) > 0,
+            splitbycost(costs,njobs))
+    return map(lambda fl: (0,sum(map(lambda k: evtsperfile[k],fl))),filesperjob),filesperjob
+
+def split(strategy,evtmax,njobs=None,**kw):
+    """..function:: split(strategy,evtmax[,njobs,...]) -> skipandperform
+
+    split the events in jobs following a strategy:
+     * events: the same number of events per job
+     * files: the same number of input files per job (needs evtsperfile)
+     * bytes: the same number of bytes per job (needs evtsperfile and
+       bytesperfile)
+     * walltime: the number of jobs is evaluated to process the events
+       of each job within a target walltime (needs timeperevt and
+       walltime), then the events are split as in the events strategy
+     * lpt: whole input files per job, balancing their cost (needs
+       evtsperfile, see splitbylpt). The events of each job are 
+       relative to its input files, given with `withfiles`
+    The strategies needing the input files fall back to the events one
+    if the files information is not available, and they only use the
+    first evtmax events of the files (see trimtoevents)
+
+    :param strategy: the strategy
+    :type  strategy: str
+    :param evtmax: the total number of events
+    :type  evtmax: int
+    :param njobs: the number of jobs (not used by the walltime strategy)
+    :type  njobs: int
+    :param evtsperfile: the number of events per input file
+    :type  evtsperfile: list(int)
+    :param bytesperfile: the size of each input file
+    :type  bytesperfile: list(int)
+    :param timeperevt: the time to process an event (seconds)
+    :type  timeperevt: float
+    :param walltime: the target time per job (seconds)
+    :type  walltime: float
+    :param balanceby: the cost estimation of the lpt strategy, one of
+                      COSTS [Default: events]
+    :type  balanceby: str
+    :param withfiles: whether to return the input files of each job as
+                      well [Default: False]
+    :type  withfiles: bool
+
+    :return: the events to be skipped and processed per job (and the
+             indices of the input files of each job with `withfiles`, 
+             None unless the lpt strategy is used)
+    :rtype: list((int,int)) (or (list((int,int)),list(list(int))))
+    """
+    if strategy not in STRATEGIES:
+        raise AttributeError('Splitting strategy not recognized: "{0}", the valid'\
+                ' ones are: {1}'.format(strategy,', '.join(STRATEGIES)))
+    evtsperfile  = kw.get('evtsperfile')
+    bytesperfile = kw.get('bytesperfile')
+    if strategy == 'walltime':
+        njobs = njobsforwalltime(evtmax,kw.get('timeperevt',0),kw.get('walltime',0))
+        strategy = 'events'
+    elif strategy in [ 'files', 'bytes', 'lpt' ] and not evtsperfile:
+        print "\033[1;33mWARNING\033[1;m The '{0}' splitting needs the number of events"\
+                " per file, using the 'events' splitting".format(strategy)
+        strategy = 'events'
+    elif strategy == 'bytes' and not bytesperfile:
+        print "\033[1;33mWARNING\033[1;m The 'bytes' splitting needs the size of the"\
+                " input files, using the 'files' splitting"
+        strategy = 'files'
+
+    filesperjob = None
+    if strategy == 'events':
+        skipandperform = splitbyevents(evtmax,int(njobs))
+    elif strategy == 'lpt':
+        skipandperform,filesperjob = splitbylpt(evtmax,evtsperfile,int(njobs),
+                kw.get('balanceby') or 'events',bytesperfile,kw.get('timeperevt'))
+    else:
+        evtsperfile,bytesperfile = trimtoevents(evtmax,evtsperfile,bytesperfile)
+        if strategy == 'files':
+            skipandperform = splitbyfiles(evtsperfile,int(njobs))
+        else:
+            skipandperform = splitbybytes(evtsperfile,bytesperfile,int(njobs))
+    if kw.get('withfiles'):
+        return skipandperform,filesperjob
+    return skipandperform
+
+def getcostperfile(balanceby,evtsperfile,bytesperfile=None,timeperevt=None):
+    """..function:: getcostperfile(balanceby,evtsperfile[,bytesperfile,timeperevt]) -> costs
+
+    the estimated cost of processing each input file:
+     * events: the number of events of the file
+     * size: the size of the file
+     * time: the number of events by the time to process an event
+
+    :param balanceby: the cost estimation, one of COSTS
+    :type  balanceby: str
+    :param evtsperfile: the number of events per input file
+    :type  evtsperfile: list(int)
+    :param bytesperfile: the size of each input file
+    :type  bytesperfile: list(int)
+    :param timeperevt: the time to process an event (seconds), a number
+                       or a list with the time for each file
+    :type  timeperevt: float or list(float)
+
+    :return: the costs
+    :rtype: list(float)
+    """
+    if balanceby not in COSTS:
+        raise AttributeError('Cost estimation not recognized: "{0}", the valid'\
+                ' ones are: {1}'.format(balanceby,', '.join(COSTS)))
+    if balanceby == 'size':
+        if not bytesperfile:
+            raise RuntimeError('The size of the input files is needed to'\
+                    ' balance by size')
+        return bytesperfile
+    if balanceby == 'time':
+        if not timeperevt:
+            raise RuntimeError('The time per event is needed to balance by time')
+        if type(timeperevt) is not list:
+            timeperevt = [timeperevt]*len(evtsperfile)
+        return map(lambda (n,t): n*t,zip(evtsperfile,timeperevt))
+    return evtsperfile
+
+def splitbycost(costperfile,njobs):
+    """..function:: splitbycost(costperfile,njobs) -> filesperjob
+
+    assign whole input files to the jobs balancing their total cost,
+    using the longest-processing-time-first algorithm: the files are
+    taken from the most to the least costly, each one assigned to the
+    job with less cost so far. The jobs without files are removed
+
+    :param costperfile: the estimated cost of each input file
+    :type  costperfile: list(float)
+    :param njobs: the number of jobs
+    :type  njobs: int
+
+    :return: the indices of the input files of each job (sorted, as
+             the input files)
+    :rtype: list(list(int))
+    """
+    import heapq
+
+    njobs = max(1,min(int(njobs),len(costperfile)))
+    # (cost,job index) of each job
+    heap = map(lambda i: (0,i),xrange(njobs))
+    filesperjob = map(lambda i: [],xrange(njobs))
+    for k in sorted(xrange(len(costperfile)),key=lambda k: costperfile[k],reverse=True):
+        cost,i = heapq.heappop(heap)
+        filesperjob[i].append(k)
+        heapq.heappush(heap,(cost+costperfile[k],i))
+    return map(sorted,filter(lambda fl: len(fl) > 0,filesperjob))
@@ -20,6 +20,9 @@ from abc import abstractmethod
 
 DEBUG=True
 JOBEVT=500
+# Target time per job (seconds) when the number of jobs is evaluated
+# from the runtime history (see setsplitting)
+AUTOWALLTIME=5400
 
 class workenv(object):
     """ ..class:: workenv
@@ -63,6 +66,15 @@ class workenv(object):
         self.jobname     = bashscriptname.split('.sh')[0]
         # Name of the script to be used to send jobs including the suffix 
         self.scriptname  = bashscriptname+'.sh'
+        # Number of events of each input file (in the same order than
+        # the input files), if they were counted
+        self.evtsperfile = None
+        # The input files of each job, when the jobs are not defined by
+        # contiguous events (see setsplitting)
+        self.jobinputfiles = None
+        # The expected walltime (seconds) of the longest job, if the 
+        # time per event is known (see setsplitting)
+        self.predictedwalltime = None
 
         # set the relevant variables used to check the kind
         # of job is
@@ -103,6 +115,209 @@ class workenv(object):
                 return False,_com,_var
         return True
     
+    def getconfigfile(self):
+        """..method:: getconfigfile() -> filename
+
+        the configuration file of the job (jobOption, steering file,...),
+        None if the kind of job has no configuration file
+        """
+        return None
+
+    def gethistorykey(self):
+        """..method:: gethistorykey() -> key
+
+        the key identifying this kind of job in the runtime history
+        (see the runhistory module): the type of job and the name of
+        its configuration file (or of the job if there is none)
+        """
+        import os
+
+        configfile = self.getconfigfile()
+        if configfile:
+            name = os.path.basename(configfile)
+        else:
+            name = self.jobname
+        return '{0}:{1}'.format(self.typealias,name)
+
+    def getprocessedevents(self,jobindex):
+        """..method:: getprocessedevents(jobindex) -> events
+
+        the events processed by a job finished successfully: the events
+        assigned to it by the splitting (skipandperform). They are only
+        trusted when they follow from the counted events of the input
+        files (see setevtsperfile) or the job has no input files (the
+        events are generated), otherwise evtmax could exceed the events
+        actually present in the files
+
+        :param jobindex: the index of the job
+        :type  jobindex: int
+
+        :return: the number of events, None if unknown
+        :rtype: int
+        """
+        skipandperform = getattr(self,'skipandperform',None)
+        if not skipandperform or jobindex >= len(skipandperform):
+            return None
+        if getattr(self,'inputfiles',None) and not getattr(self,'evtsperfile',None):
+            return None
+        return skipandperform[jobindex][1]
+
+    def setevtsperfile(self,md):
+        """..method:: setevtsperfile(md) 
+
+        store the number of events of each input file, and set the total
+        number of events (evtmax)
+
+        :param md: the number of events per file
+        :type  md: dict(str: int)
+        """
+        self.evtsperfile = map(lambda f: md[f],self.inputfiles)
+        # The first event of each file (and the total, at the end)
+        self.firstevtperfile = [0]
+        for nevts in self.evtsperfile:
+            self.firstevtperfile.append(self.firstevtperfile[-1]+nevts)
+        self.evtmax = self.firstevtperfile[-1]
+
+    def setsplitting(self,**kw):
+        """..method:: setsplitting([njobs,split_strategy,balance_by,target_walltime,time_per_event,auto_njobs])
+
+        split the events (evtmax) in jobs, building the list of events
+        to be skipped and processed per job (skipandperform), see the
+        splitting module. The number of jobs (njobs) is updated with the
+        jobs actually built. 
+        The 'lpt' strategy assigns whole input files to the jobs balancing
+        their estimated cost (see splitting.splitbylpt), the input 
+        files of each job are kept in jobinputfiles and the events to
+        be skipped and processed are relative to those files.
+        With auto_njobs, the number of jobs is evaluated to process the
+        events of each job within the target walltime, using the time
+        per event measured in previous productions of the same kind of
+        job (see the runhistory module) when it is not given. An 
+        explicit njobs takes precedence over auto_njobs
+
+        :param njobs: number of jobs [Default: evtmax/JOBEVT]
+        :type  njobs: int
+        :param split_strategy: the splitting strategy, one of 
+                               splitting.STRATEGIES [Default: events]
+        :type  split_strategy: str
+        :param balance_by: the cost estimation of the input files for
+                           the 'lpt' strategy, one of splitting.COSTS
+                           [Default: events]
+        :type  balance_by: str
+        :param target_walltime: the time per job (seconds), for the 
+                                walltime strategy
+        :type  target_walltime: float
+        :param time_per_event: the time to process an event (seconds), 
+                               for the walltime strategy
+        :type  time_per_event: float
+        :param auto_njobs: whether to evaluate the number of jobs from
+                           the runtime history (ignored if njobs is
+                           given)
+        :type  auto_njobs: bool
+        """
+        import os
+        from splitting import split,njobsforwalltime
+        from runhistory import runhistory
+
+        if kw.has_key('split_strategy') and kw['split_strategy']:
+            strategy = kw['split_strategy']
+        else:
+            strategy = 'events'
+        if kw.has_key('njobs') and kw['njobs'] is not None:
+            njobs = int(kw['njobs'])
+        else:
+            njobs = max(1,self.evtmax/JOBEVT)
+        self.jobinputfiles = None
+        timeperevt = kw.get('time_per_event')
+        # The number of jobs follows from the target walltime with
+        # auto_njobs (unless it is explicitly given), and with the 
+        # strategies sizing the jobs by their walltime when it is given
+        keepnjobs = kw.get('auto_njobs') and kw.get('njobs') is not None
+        usewalltime = kw.get('auto_njobs') or \
+                (strategy in [ 'walltime', 'lpt' ] and kw.get('target_walltime'))
+        if usewalltime and self.evtmax > 0:
+            if not timeperevt:
+                history = runhistory()
+                timeperevt = history.timeperevent(self.gethistorykey())
+                history.close()
+            if keepnjobs:
+                print "\033[1;33mWARNING\033[1;m The number of jobs is given ({0}), not"\
+                        " evaluated from the runtime history".format(njobs)
+            elif timeperevt:
+                walltime = kw.get('target_walltime') or AUTOWALLTIME
+                njobs = njobsforwalltime(self.evtmax,timeperevt,walltime)
+                print "\033[1;34mINFO\033[1;m Using {0} jobs ({1:.3g} s/event, target"\
+                        " walltime {2:.0f} s)".format(njobs,timeperevt,walltime)
+            else:
+                print "\033[1;33mWARNING\033[1;m No runtime history for '{0}', using"\
+                        " {1} jobs".format(self.gethistorykey(),njobs)
+            # The number of jobs is already decided
+            if strategy == 'walltime':
+                strategy = 'events'
+        
+        if kw.has_key('balance_by') and kw['balance_by']:
+            balanceby = kw['balance_by']
+        else:
+            balanceby = 'events'
+        bytesperfile = None
+        if self.evtsperfile and (strategy == 'bytes' or \
+                (strategy == 'lpt' and balanceby == 'size')):
+            bytesperfile = map(lambda f: os.path.getsize(f),self.inputfiles)
+        self.skipandperform,filesperjob = split(strategy,self.evtmax,njobs,
+                evtsperfile=self.evtsperfile,bytesperfile=bytesperfile,
+                timeperevt=timeperevt,walltime=kw.get('target_walltime'),
+                balanceby=balanceby,withfiles=True)
+        if filesperjob is not None:
+            self.jobinputfiles = map(lambda fl: map(lambda k: self.inputfiles[k],fl),
+                    filesperjob)
+        if len(self.skipandperform) == 0:
+            raise RuntimeError('No events to be processed (evtmax={0}), no jobs'\
+                    ' can be built'.format(self.evtmax))
+        self.njobs = len(self.skipandperform)
+        self.predictedwalltime = None
+        if timeperevt:
+            self.predictedwalltime = max(map(lambda (skip,n): n,self.skipandperform))*timeperevt
+
+    def getjobinputfiles(self,skipevts,nevents,jobindex=None):
+        """..method:: getjobinputfiles(skipevts,nevents[,jobindex]) -> (inputfiles,skipevts)
+
+        the minimal subset of input files containing the events to be
+        processed by a job (defined over all the input files), and the 
+        events to be skipped inside that subset. If the number of events
+        per file is unknown (see setevtsperfile), all the input files
+        are needed. If the input files of each job were defined by the
+        splitting (jobinputfiles), those of the job are returned
+
+        :param skipevts: events to be skipped (over all the input files)
+        :type  skipevts: int
+        :param nevents: events to be processed, a negative number means
+                        all the remaining events
+        :type  nevents: int
+        :param jobindex: the index of the job
+        :type  jobindex: int
+
+        :return: the input files and the events to be skipped on them
+        :rtype: (list(str),int)
+        """
+        import bisect
+
+        if getattr(self,'jobinputfiles',None) and jobindex is not None:
+            return self.jobinputfiles[jobindex],skipevts
+
+        if not self.evtsperfile or len(self.evtsperfile) != len(self.inputfiles) \
+                or skipevts >= self.evtmax:
+            return self.inputfiles,skipevts
+        # The file containing the first event (the last one starting 
+        # before it, i.e. skipping the files without events)
+        ifirst = bisect.bisect_right(self.firstevtperfile,skipevts)-1
+        # and the files starting before the last event
+        if nevents < 0:
+            ilast = len(self.inputfiles)
+        else:
+            ilast = max(ifirst+1,bisect.bisect_left(self.firstevtperfile,skipevts+nevents))
+            ilast = min(ilast,len(self.inputfiles))
+        return self.inputfiles[ifirst:ilast],skipevts-self.firstevtperfile[ifirst]
+
     @abstractmethod
     def checkfinishedjob(self,jobdsc):
         """..method:: checkfinishedjob(jobdsc) -> status
@@ -200,7 +415,7 @@ class blindjob(workenv):
             if len(self.specificfiles) == 0:
                 raise RuntimeError('Specific files not found %s' % specificfile)
         
-        if kw.has_key('njobs'):
+        if kw.has_key('njobs') and kw['njobs'] is not None:
             self.njobs = int(kw['njobs'])
         else:
             self.njobs= 1
@@ -357,6 +572,11 @@ class athenajob(workenv):
             number of events to be processed
         njobs: int, optional
             number of jobs to be sent
+        split_strategy, balance_by, target_walltime, time_per_event, auto_njobs: optional
+            how to split the events in jobs, see workenv.setsplitting
+        count_workers: int, optional
+            number of input files counted at the same time when
+            the number of events is evaluated [Default: number of cores]
         """
         from jobssender import getrealpaths,getremotepaths,getevt
 
@@ -418,25 +638,16 @@ class athenajob(workenv):
             self.evtmax = int(kw['evtmax'])
         else:
             if not self.remotefiles:
-                self.evtmax = getevt(self.inputfiles,treename='Events')
-
-        if kw.has_key('njobs'):
-            self.njobs = int(kw['njobs'])
-        else:
-            self.njobs= self.evtmax/JOBEVT
+                if kw.has_key('count_workers'):
+                    nworkers = kw['count_workers']
+                else:
+                    nworkers = None
+                self.setevtsperfile(getevt(self.inputfiles,treename='Events',
+                        nworkers=nworkers,perfile=True))
 
-        # Get the evtperjob
-        evtsperjob = self.evtmax/self.njobs
-        # First event:0 last: n-1
-        remainevts = (self.evtmax % self.njobs)-1
-        
-        self.skipandperform = []
         # Build a list of tuples containing the events to be skipped
         # followed by the number of events to be processed
-        for i in xrange(self.njobs-1):
-            self.skipandperform.append( (i*evtsperjob,evtsperjob) )
-        # And the remaining
-        self.skipandperform.append( ((self.njobs-1)*evtsperjob,remainevts) )
+        self.setsplitting(**kw)
 
     def __setneedenv__(self):
         """..method:: __setneedenv__() 
@@ -446,6 +657,13 @@ class athenajob(workenv):
         self.typealias = 'Athena'
         self.relevantvar =  [ ("AtlasSetup","setupATLAS"), ("CMTCONFIG","asetup") ] 
 
+    def getconfigfile(self):
+        """..method:: getconfigfile() -> filename
+
+        the jobOption (or the transformation) file
+        """
+        return self.joboption
+
     def useJOFile(self):
         """..method:: useJOFile()
 
@@ -567,6 +785,7 @@ class athenajob(workenv):
                 self.version=None
                 self.gcc =None
                 self.extra_asetup=''
+                self.inputfiles=None
 
             def haveallvars(self):
                 if not self.setupfolder or not self.version or not self.gcc:
@@ -582,6 +801,9 @@ class athenajob(workenv):
             message += " the version of the gcc compiler are needed to build the"
             message += " bashscript"
             raise RuntimeError(message)
+        # The input files of this job
+        if not ph.inputfiles:
+            ph.inputfiles = self.inputfiles
 
         ts = time.time()
         timestamp = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
@@ -597,7 +819,7 @@ class athenajob(workenv):
             # XXX: Create a separate file containing the list of input files:
             fileslist_name = "fileslist_{0}.txt".format(self.scriptname.replace(".sh",""))
             with open(fileslist_name,"w") as _f:
-                _f.write(' '.join(self.inputfiles)+' ')
+                _f.write(' '.join(ph.inputfiles)+' ')
                 _f.close()
             # convert the list of files into a space separated string (' '.join(self.inputfiles)
             bashfile += '{0} --fileValidation False --maxEvents {1}'\
@@ -609,7 +831,7 @@ class athenajob(workenv):
             # athena.py jobOption.py job
             bashfile += 'cp %s .\n' % self.joboption
             bashfile +='athena.py -c "SkipEvents=%i; EvtMax=%i; FilesInput=%s;" ' % \
-                    (ph.skipevts,ph.nevents,str(self.inputfiles))
+                    (ph.skipevts,ph.nevents,str(ph.inputfiles))
             # Introduce a new key with any thing you want to introduce in -c : kw['Name']='value'
             bashfile += self.joboption+" \n"
         bashfile +="\ncp *.root %s/\n" % os.getcwd()
@@ -661,10 +883,13 @@ class athenajob(workenv):
             foldername = "%sJob_%s_%i" % (self.typealias,self.jobname,i)
             os.mkdir(foldername)
             os.chdir(foldername)
+            # Only the input files containing the events of the job
+            jobinputfiles,jobskipevts = self.getjobinputfiles(skipevts,nevents,i)
             # create the local bashscript
             self.createbashscript(setupfolder=usersetupfolder,\
                     version=athenaversion,\
-                    gcc=gcc,skipevts=skipevts,nevents=nevents,extra_asetup=extra_asetup)
+                    gcc=gcc,skipevts=jobskipevts,nevents=nevents,extra_asetup=extra_asetup,
+                    inputfiles=jobinputfiles)
             # XXX: Provisional (or not): Some keywords to be substitute 
             # (job-index dependent)
             self.replace_str_infile("%JOBNUMBER_PLUS_ONE",i+1)
@@ -769,6 +994,11 @@ class cmsjob(workenv):
             number of events to be processed
         njobs: int, optional
             number of jobs to be sent
+        split_strategy, balance_by, target_walltime, time_per_event, auto_njobs: optional
+            how to split the events in jobs, see workenv.setsplitting
+        count_workers: int, optional
+            number of input files counted at the same time when
+            the number of events is evaluated [Default: number of cores]
         """
         from jobssender import getrealpaths,getremotepaths,getevt
 
@@ -801,25 +1031,16 @@ class cmsjob(workenv):
             self.evtmax = int(kw['evtmax'])
         else:
             if not self.remotefiles:
-                self.evtmax = getevt(self.inputfiles,treename='Events')
+                if kw.has_key('count_workers'):
+                    nworkers = kw['count_workers']
+                else:
+                    nworkers = None
+                self.setevtsperfile(getevt(self.inputfiles,treename='Events',
+                        nworkers=nworkers,perfile=True))
         
-        if kw.has_key('njobs'):
-            self.njobs = int(kw['njobs'])
-        else:
-            self.njobs= self.evtmax/JOBEVT
-
-        # Get the evtperjob
-        evts_x_job = self.evtmax/self.njobs
-        # First event:0 last: n-1
-        remain_evts = (self.evtmax % self.njobs)-1
-        
-        self.skipandperform = []
         # Build a list of tuples containing the events to be skipped
         # followed by the number of events to be processed
-        for i in xrange(self.njobs-1):
-            self.skipandperform.append( (i*evts_x_job,evts_x_job) )
-        # And the remaining
-        self.skipandperform.append( ((self.njobs-1)*evts_x_job,remain_evts) )
+        self.setsplitting(**kw)
 
     def __setneedenv__(self):
         """..method:: __setneedenv__() 
@@ -829,6 +1050,13 @@ class cmsjob(workenv):
         self.typealias = 'cms'
         self.relevantvar =  [ ("CMSSW_BASE","eval `scram runtime -sh`") ] 
 
+    def getconfigfile(self):
+        """..method:: getconfigfile() -> filename
+
+        the cmsRun configuration file
+        """
+        return self.py_cfg
+
     def py_cfg_modification(self):
         """Be sure that the FilesInput and SkipEvents are used
         accordingly in python config
@@ -912,16 +1140,29 @@ class cmsjob(workenv):
         f.close()
         os.chmod(self.scriptname,0755)
 
-    def create_cfg(self,nevents,skipevts):
+    def create_cfg(self,nevents,skipevts,jobindex=None):
         """
         skipevts
         nevents
+        jobindex
+
+        The optional wildcard @INPUTFILES@ (to be used as 
+        `cms.untracked.vstring(@INPUTFILES@)`) is substituted by the
+        input files containing the events of the job, and then the 
+        events to be skipped are relative to those files
         """
         import os 
 
         with open(self.py_cfg) as f:
             l = f.read()
         local_cfg = l
+        if l.find('@INPUTFILES@') != -1:
+            jobinputfiles,skipevts = self.getjobinputfiles(skipevts,nevents,jobindex)
+            local_cfg = local_cfg.replace('@INPUTFILES@',
+                    ','.join(map(lambda f: "'file:{0}'".format(f),jobinputfiles)))
+        elif self.jobinputfiles:
+            raise RuntimeError('The input files of each job can only be set with'\
+                    ' the "@INPUTFILES@" wildcard in the config python "{0}"'.format(self.py_cfg))
         # create the local copy and subtitute the wildcards
         for (wc,sb) in [ ('@EVTS@',nevents), ('@SKIPEVT@',skipevts) ]:
             if(l.find(wc) == -1):
@@ -998,7 +1239,7 @@ class cmsjob(workenv):
             self.createbashscript(setupfolder=usersetupfolder,\
                     extra_setup=extra_setup)
             # Create the local py_cfg
-            self.create_cfg(nevents,skipevts)
+            self.create_cfg(nevents,skipevts,i)
             # XXX: Provisional (or not): Some keywords to be substitute 
             # (job-index dependent)
             self.replace_str_infile("%JOBNUMBER_PLUS_ONE",i+1)
@@ -1093,12 +1334,17 @@ class marlinjob(workenv):
             number of events to be processed
         njobs: int, optional
             number of jobs to be sent
+        split_strategy, balance_by, target_walltime, time_per_event, auto_njobs: optional
+            how to split the events in jobs, see workenv.setsplitting
         gear_file: str, optional
             the gear file to use
         is_alibava_conversion: bool, optional
             whether or not the jobs to be send are the conversion
             from raw alibava data to LCIO, in that case, some 
             particular actions are needed
+        count_workers: int, optional
+            number of input files counted at the same time when
+            the number of events is evaluated [Default: number of cores]
         """
         from jobssender import getrealpaths,getremotepaths
         from jobssender import getevt_alibava 
@@ -1127,15 +1373,16 @@ class marlinjob(workenv):
         elif (not self.remotefiles):
             # Remember the number of processed events is Nevents-1 (which
             # Corresponds to the run number 1
+            if kw.has_key('count_workers'):
+                nworkers = kw['count_workers']
+            else:
+                nworkers = None
             if inputfiles.find('.slcio') != -1:
-                self.evtmax = getevt_lcio(self.inputfiles)
+                self.setevtsperfile(getevt_lcio(self.inputfiles,nworkers=nworkers,
+                    perfile=True))
             else:
-                self.evtmax = getevt_alibava(self.inputfiles)
-
-        if kw.has_key('njobs'):
-            self.njobs = int(kw['njobs'])
-        else:
-            self.njobs= self.evtmax/JOBEVT
+                self.setevtsperfile(getevt_alibava(self.inputfiles,nworkers=nworkers,
+                    perfile=True))
 
         if kw.has_key('gear_file'):
             self.gear_file = getrealpaths(kw['gear_file'])[0]
@@ -1149,31 +1396,27 @@ class marlinjob(workenv):
 
         # if alibava conversion allow only one job
         if self.is_alibava_conversion:
-            self.njobs = 1
-        
-        # Get the evtperjob:
-        # REMEMBER: number of events to be processed in Marlin (N) is
-        # N= number_events+run, assuming run=1 --> number_events-1 is 
-        # the real number of events processed per job
-        evtsperjob = self.evtmax/self.njobs+1
-        # First event:0 last: n (remember run+event), subtracted the number
-        # of jobs to correct the overpopulation with the +1 added in evtsperjob
-        remainevts = (self.evtmax % self.njobs)-self.njobs
+            kw['njobs'] = 1
+            kw['split_strategy'] = 'events'
+            kw['auto_njobs'] = False
         
-        self.skipandperform = []
         # Build a list of tuples containing the events to be skipped
-        # followed by the number of events to be processed
-        for i in xrange(self.njobs):
-            self.skipandperform.append( [i*evtsperjob,evtsperjob] )
-        # And the remaining, to be added to the last  
-        self.skipandperform[-1][1] = self.skipandperform[-1][1]+remainevts
-        print self.skipandperform
+        # followed by the number of events to be processed. 
+        # REMEMBER: the number of records to be processed in Marlin 
+        # (MaxRecordNumber) are the events plus the run headers, see
+        # preparejobs
+        self.setsplitting(**kw)
 
     def __setneedenv__(self):
         """Relevant environment in an Marlin job: MARLIN
         """
         self.typealias = 'Marlin'
-        self.relevantvar =  [ ("MARLIN","source") ] 
+        self.relevantvar =  [ ("MARLIN","source") ]
+
+    def getconfigfile(self):
+        """The Marlin steering file
+        """
+        return self.steering_file
 
     def _set_field_at(self,key_list,the_field,the_value,text_wanted=False):
         """Helper function (could be deattached from the class)
@@ -1384,8 +1627,17 @@ class marlinjob(workenv):
             foldername = "{0}Job_{1}_{2}".format(self.typealias,self.jobname,i)
             os.mkdir(foldername)
             os.chdir(foldername)
+            # Only the input files containing the events of the job
+            jobinputfiles,jobskipevts = self.getjobinputfiles(skipevts,nevents,i)
+            # The records to be processed are the events plus the run header
+            # of each file (assuming one run per file)
+            if self.evtsperfile:
+                nrecords = nevents+len(jobinputfiles)
+            else:
+                nrecords = nevents+1
             # create the local bashscript
-            self.createbashscript(skipevents=skipevts,nevents=nevents,iteration=i)
+            self.createbashscript(skipevents=jobskipevts,nevents=nrecords,iteration=i,
+                    inputfiles=jobinputfiles)
             # Registring the jobs in jobdescription class instances
             jdlist.append( 
                     jobdescription(path=foldername,script=self.jobname,index=i)
@@ -1406,6 +1658,8 @@ class marlinjob(workenv):
         skipevents: int
         nevents:    int
         iteration:  int
+        inputfiles: list(str), optional
+            the input files of the job [Default: all the input files]
         """
         import os
         import datetime,time
@@ -1415,6 +1669,7 @@ class marlinjob(workenv):
                 this.skipevents=None
                 this.nevents=None
                 this.iterations=None
+                this.inputfiles=None
 
             def haveallvars(this):
                 if this.skipevents is None or this.nevents is None \
@@ -1439,8 +1694,10 @@ class marlinjob(workenv):
         bashfile += 'tmpdir=`mktemp -d`\ncd $tmpdir;\n\n'
         # Marlin job
         bashfile += 'cp {0} .\n'.format(self.steering_file)
+        if not ph.inputfiles:
+            ph.inputfiles = self.inputfiles
         inputfiles_str = ''
-        for _f in self.inputfiles:
+        for _f in ph.inputfiles:
             inputfiles_str += _f+" "
         # Not including some of the options when dealing with 
         # alibava conversion jobs
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+""":pkg:`tests` -- Tests of the job_sender package
+==================================================
+
+Run them from the top folder of the repository with
+
+    python -m unittest discover -s tests -t .
+
+The job_sender package is imported from the source tree (the python
+folder is installed as job_sender, see setup.py), not from the
+installed one
+"""
+import os
+import sys
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(TOPDIR,'tests','fixtures')
+
+if 'job_sender' not in sys.modules:
+    import imp
+
+    # The xmltodict_jb package lives besides the python folder
+    if TOPDIR not in sys.path:
+        sys.path.insert(0,TOPDIR)
+    imp.load_module('job_sender',None,os.path.join(TOPDIR,'python'),
+            ('','',imp.PKG_DIRECTORY))
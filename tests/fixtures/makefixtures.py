@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""Script used to produce the ROOT fixture files of the tests. It
+needs python 3 with uproot and numpy (pip install uproot numpy), none
+of them needed to run the tests:
+ * tree.root: the TTrees 'CollectionTree' (14 entries, filled in two
+   baskets) and 'other' (3 entries)
+ * ntuple.root: 'CollectionTree' (5 entries) stored as a RNTuple,
+   which is not understood by evtreaders.rootentries
+
+Usage: python3 makefixtures.py [folder]
+"""
+import os
+import sys
+
+import numpy as np
+import uproot
+
+folder = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+
+with uproot.recreate(os.path.join(folder,'tree.root'),compression=None) as f:
+    tree = f.mktree('CollectionTree',{'x': np.int32})
+    tree.extend({'x': np.arange(7,dtype=np.int32)})
+    tree.extend({'x': np.arange(7,dtype=np.int32)})
+    other = f.mktree('other',{'y': np.float64})
+    other.extend({'y': np.arange(3,dtype=np.float64)})
+
+with uproot.recreate(os.path.join(folder,'ntuple.root')) as f:
+    f['CollectionTree'] = {'x': np.arange(5,dtype=np.int32)}
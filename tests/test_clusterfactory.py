@@ -0,0 +1,557 @@
+#!/usr/bin/env python
+"""Tests of the clusterfactory module: the answers of the batch
+systems are given by fake commands placed in the PATH
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import tests
+from job_sender import clusterfactory
+from job_sender.jobssender import jobdescription
+
+class clustertestcase(unittest.TestCase):
+    """Test case with a temporary folder in the PATH, where the fake
+    commands of the batch system are created
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['PATH'] = self.tmpdir+os.pathsep+os.environ['PATH']
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def fakecommand(self,command,output,exitcode=0):
+        """Create a command printing `output`, and logging its arguments
+        in the file `command`.log
+        """
+        datafile = os.path.join(self.tmpdir,command+'.out')
+        with open(datafile,'w') as f:
+            f.write(output)
+        script = os.path.join(self.tmpdir,command)
+        with open(script,'w') as f:
+            f.write('#!/bin/sh\necho "$@" >> {0}.log\ncat {1}\nexit {2}\n'.format(
+                script,datafile,exitcode))
+        os.chmod(script,0755)
+
+    def calls(self,command):
+        log = os.path.join(self.tmpdir,command+'.log')
+        if not os.path.isfile(log):
+            return []
+        return open(log).read().splitlines()
+
+def maketasks(ids):
+    return map(lambda (i,jobid): jobdescription(index=i,ID=jobid,state='finished',
+        status='ok'),enumerate(ids))
+
+class cernwalltimestest(clustertestcase):
+    """cerncluster.getwalltimes
+    """
+    def test_history(self):
+        # ClusterId ProcId CompletionDate JobCurrentStartDate RemoteWallClockTime
+        self.fakecommand('condor_history','\n'.join([
+            '100 0 1000 400 900.0',
+            '100 1 1300 400 900.0',
+            '200 0 undefined undefined 50.0',
+            '300 0 undefined undefined 0.0',
+            '400 0 2000 1000 1000.0', '400 1 2500 1000 1500.0' ])+'\n')
+        cluster = clusterfactory.cerncluster()
+        tasks = maketasks([ '100.0', '100.1', '200.0', '300.0', '400', '500.0' ])
+        walltimes = cluster.getwalltimes(tasks)
+        # Not found in the history, or without any walltime
+        self.assertEqual(walltimes,{ 0: 600.0, 1: 900.0, 2: 50.0, 4: 1500.0 })
+        # A single query
+        self.assertEqual(len(self.calls('condor_history')),1)
+        self.assertTrue(self.calls('condor_history')[0].find('ClusterId == 500') != -1)
+
+    def test_failed_query(self):
+        # condor_history not available
+        os.environ['PATH'] = self.tmpdir
+        cluster = clusterfactory.cerncluster()
+        self.assertEqual(cluster.getwalltimes(maketasks([ '100.0' ])),{})
+
+    def test_without_ids(self):
+        cluster = clusterfactory.cerncluster()
+        self.assertEqual(cluster.getwalltimes(maketasks([ None ])),{})
+
+PBSHISTORY = """<Data>
+<Job><Job_Id>10[0].server</Job_Id><job_state>C</job_state>
+<resources_used><cput>00:01:00</cput><walltime>01:02:03</walltime></resources_used></Job>
+<Job><Job_Id>10[1].server</Job_Id><job_state>R</job_state></Job>
+<Job><Job_Id>11.server</Job_Id><job_state>C</job_state>
+<resources_used><walltime>00:00:42</walltime></resources_used></Job>
+</Data>"""
+
+class tauwalltimestest(clustertestcase):
+    """taucluster.getwalltimes
+    """
+    def test_walltime(self):
+        self.fakecommand('qstat',PBSHISTORY)
+        cluster = clusterfactory.taucluster()
+        tasks = maketasks([ '10[0].server', '10[1].server', '11.server', '12.server' ])
+        self.assertEqual(cluster.getwalltimes(tasks),{ 0: 3723.0, 2: 42.0 })
+
+    def test_garbage(self):
+        self.fakecommand('qstat','<Data><Job><Job_Id>10')
+        cluster = clusterfactory.taucluster()
+        self.assertEqual(cluster.getwalltimes(maketasks([ '10.server' ])),{})
+
+class taustatestest(clustertestcase):
+    """taucluster.checkstates
+    """
+    def test_states(self):
+        self.fakecommand('qstat',PBSHISTORY)
+        cluster = clusterfactory.taucluster()
+        tasks = maketasks([ '10[0].server', '10[1].server', '12.server' ])
+        for task in tasks:
+            task.state = 'running'
+        self.assertEqual(cluster.checkstates(tasks),{ 0: ('finished','ok'),
+            1: ('running','ok'), 2: ('finished','ok') })
+
+    def test_unexpected(self):
+        cluster = clusterfactory.taucluster()
+        tasks = maketasks([ '10.server' ])
+        tasks[0].state = 'running'
+        for answer in [ '<Data/>', '<Data><Job><Job_Id>10.server</Job_Id></Job></Data>',
+                '<Data><Job><Job_Id>10' ]:
+            self.fakecommand('qstat',answer)
+            cluster.breaker = clusterfactory.circuitbreaker(maxfailures=1)
+            self.assertEqual(cluster.checkstates(tasks),{ 0: (clusterfactory.STALE,'ok') })
+            self.assertFalse(cluster.getbreaker().allow())
+
+class tauarraytest(clustertestcase):
+    """taucluster.submitarray
+    """
+    def test_submit(self):
+        self.fakecommand('qsub','10[].server\n')
+        tasks = []
+        for i in xrange(3):
+            path = os.path.join(self.tmpdir,'job_{0}'.format(i))
+            os.mkdir(path)
+            tasks.append(jobdescription(index=i,path=path,script='job',state='configured',
+                status='ok'))
+        cluster = clusterfactory.taucluster()
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            cluster.submitarray(tasks)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(map(lambda x: x.ID,tasks),
+                [ '10[0].server', '10[1].server', '10[2].server' ])
+        self.assertEqual(map(lambda x: x.state,tasks),[ 'submitted' ]*3)
+        # A single call, the wrapper selecting the job folder
+        self.assertEqual(len(self.calls('qsub')),1)
+        self.assertTrue(self.calls('qsub')[0].endswith('-t 0-2 job_array.sh'))
+        wrapper = open(os.path.join(self.tmpdir,'job_array.sh')).read()
+        for task in tasks:
+            self.assertTrue(wrapper.find(task.path) != -1)
+        self.assertTrue(wrapper.find('${JOBPATHS[$PBS_ARRAYID]}') != -1)
+
+    def test_error(self):
+        tasks = [ jobdescription(index=0,path=self.tmpdir,script='job',state='configured',
+            status='ok') ]
+        with open(os.path.join(self.tmpdir,'qsub'),'w') as f:
+            f.write('#!/bin/sh\necho "qsub: Bad UID" >&2\nexit 1\n')
+        os.chmod(os.path.join(self.tmpdir,'qsub'),0755)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            clusterfactory.taucluster().submitarray(tasks)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual((tasks[0].ID,tasks[0].status),(None,'fail'))
+
+class cernscripttest(clustertestcase):
+    """cerncluster.create_script_if_needed
+    """
+    def test_script(self):
+        cluster = clusterfactory.cerncluster()
+        cluster.create_script_if_needed('job',self.tmpdir)
+        script = open(os.path.join(self.tmpdir,'job.sub')).read()
+        self.assertTrue(script.find('executable              = job.sh') != -1)
+        self.assertTrue(script.endswith('queue\n'))
+        for folder in [ 'output', 'log' ]:
+            self.assertTrue(os.path.isdir(os.path.join(self.tmpdir,folder)))
+        # The folders already exist
+        cluster.create_script_if_needed('job',self.tmpdir)
+
+class statestest(unittest.TestCase):
+    """The translation of the state codes of the batch systems
+    """
+    def test_condor(self):
+        cluster = clusterfactory.cerncluster()
+        for codes,state in [ ([ 'I', '1', 'H', '5' ],'submitted'),
+                ([ 'R', '2', '>', 'S', '7' ],'running'), ([ 'C', '4' ],'finished'),
+                ([ 'X', '3' ],'aborted') ]:
+            for code in codes:
+                self.assertEqual(cluster.getstatefromcode(code),(state,'ok'))
+        self.assertEqual(cluster.getstatefromcode('?'),(None,'fail'))
+        # A held process keeps its task alive
+        self.assertEqual(cluster.mergestates(map(cluster.getstatefromcode,
+            [ 'C', 'H' ])),('submitted','ok'))
+
+    def test_pbs(self):
+        cluster = clusterfactory.taucluster()
+        for codes,state in [ ([ 'Q', 'H', 'W', 'T' ],'submitted'),
+                ([ 'R', 'S' ],'running'), ([ 'C' ],'finished') ]:
+            for code in codes:
+                self.assertEqual(cluster.getstatefromcode(code),(state,'ok'))
+
+class breakertest(clustertestcase):
+    """The circuit breaker of the queries and the STALE states
+    """
+    def test_breaker(self):
+        breaker = clusterfactory.circuitbreaker(maxfailures=2,window=60,cooldown=60)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        # The failures are kept within the window
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        # Half-open: a new failure opens it again
+        breaker.openuntil = 0
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        breaker.openuntil = 0
+        breaker.success()
+        self.assertTrue(breaker.allow())
+        self.assertIsNone(breaker.openuntil)
+
+    def test_stale(self):
+        # condor_q not available
+        os.environ['PATH'] = self.tmpdir
+        cluster = clusterfactory.cerncluster()
+        tasks = maketasks([ '10.0', '10.1' ])
+        for task in tasks:
+            task.state = 'running'
+        for i in xrange(clusterfactory.BREAKERFAILURES):
+            states = cluster.checkstates(tasks)
+            self.assertEqual(states,{ 0: (clusterfactory.STALE,'ok'),
+                1: (clusterfactory.STALE,'ok') })
+        self.assertFalse(cluster.getbreaker().allow())
+        # The last known state is kept
+        cluster.getnextstate(tasks[0],None,states[0])
+        self.assertEqual((tasks[0].state,tasks[0].status),('running','ok'))
+        self.assertIsNotNone(tasks[0].tstale)
+        # The breaker is stored with the cluster
+        import pickle
+        stored = pickle.loads(pickle.dumps(cluster))
+        self.assertFalse(stored.getbreaker().allow())
+
+class unknownsubmissiontest(clustertestcase):
+    """The submissions whose result is unknown (timeout)
+    """
+    def maketasks(self,njobs):
+        tasks = []
+        for i in xrange(njobs):
+            path = os.path.join(self.tmpdir,'job_{0}'.format(i))
+            os.mkdir(path)
+            tasks.append(jobdescription(index=i,path=path,script='job',state='configured',
+                status='ok',tsubmitted=1000.0))
+        return tasks
+
+    def submit(self,tasks):
+        with open(os.path.join(self.tmpdir,'condor_submit'),'w') as f:
+            f.write('#!/bin/sh\nsleep 5\n')
+        os.chmod(os.path.join(self.tmpdir,'condor_submit'),0755)
+        cluster = clusterfactory.cerncluster(scheduler_timeout=0.5)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            cluster.submitarray(tasks)
+        finally:
+            os.chdir(cwd)
+        return cluster
+
+    def test_timeout(self):
+        tasks = self.maketasks(2)
+        cluster = self.submit(tasks)
+        for task in tasks:
+            self.assertEqual((task.ID,task.state,task.status),(None,'submitted','ok'))
+            self.assertIsNotNone(task.tstale)
+        # Not checked until it is found
+        self.assertEqual(cluster.checkstate(tasks[0]),(clusterfactory.STALE,'ok'))
+
+    def test_reconcile(self):
+        tasks = self.maketasks(3)
+        cluster = self.submit(tasks)
+        # The first one in the queue, the second one already finished
+        self.fakecommand('condor_q','55 0 {0}\n'.format(tasks[0].path))
+        self.fakecommand('condor_history','55 1 {0}\n'.format(tasks[1].path))
+        updated = cluster.reconcile(tasks)
+        self.assertEqual(len(updated),3)
+        self.assertEqual(map(lambda x: (x.ID,x.state,x.status,x.tstale),tasks),
+                [ ('55.0','submitted','ok',None), ('55.1','submitted','ok',None),
+                    (None,'configured','fail',None) ])
+        query = self.calls('condor_q')[0]
+        self.assertTrue(query.find('Iwd == "{0}"'.format(tasks[2].path)) != -1)
+        self.assertTrue(query.find('QDate >=') != -1)
+
+    def test_reconcile_failed(self):
+        tasks = self.maketasks(1)
+        cluster = self.submit(tasks)
+        # The cluster is not answering: still unknown
+        os.environ['PATH'] = self.tmpdir
+        self.assertEqual(cluster.reconcile(tasks),[])
+        self.assertEqual((tasks[0].ID,tasks[0].state),(None,'submitted'))
+
+class killtest(clustertestcase):
+    """killarray: only the removed jobs are reset
+    """
+    def maketasks(self,ids):
+        tasks = []
+        for (i,jobid) in enumerate(ids):
+            path = os.path.join(self.tmpdir,'job_{0}'.format(i))
+            os.mkdir(path)
+            tasks.append(jobdescription(index=i,ID=jobid,path=path,script='job',
+                state='running',status='ok',tsubmitted=1000.0))
+        return tasks
+
+    def test_kill(self):
+        self.fakecommand('condor_rm','All jobs marked for removal.\n')
+        tasks = self.maketasks([ '10.0', '10.1' ])
+        clusterfactory.cerncluster().killarray(tasks)
+        self.assertEqual(self.calls('condor_rm'),[ '10.0 10.1' ])
+        self.assertEqual(map(lambda x: (x.state,x.status),tasks),[ ('configured','ok') ]*2)
+
+    def test_failed(self):
+        self.fakecommand('condor_rm','',exitcode=1)
+        tasks = self.maketasks([ '10.0' ])
+        clusterfactory.cerncluster().killarray(tasks)
+        self.assertEqual((tasks[0].state,tasks[0].status),('running','ok'))
+
+    def test_timeout(self):
+        with open(os.path.join(self.tmpdir,'condor_rm'),'w') as f:
+            f.write('#!/bin/sh\nsleep 5\n')
+        os.chmod(os.path.join(self.tmpdir,'condor_rm'),0755)
+        tasks = self.maketasks([ '10.0' ])
+        clusterfactory.cerncluster(scheduler_timeout=0.5).killarray(tasks)
+        self.assertEqual((tasks[0].state,tasks[0].status),('running','ok'))
+
+    def test_unknown(self):
+        self.fakecommand('condor_rm','All jobs marked for removal.\n')
+        tasks = self.maketasks([ None, None ])
+        for task in tasks:
+            task.state = 'submitted'
+        cluster = clusterfactory.cerncluster()
+        # The cluster is not answering: not killed, still unknown
+        cluster.killarray(tasks)
+        self.assertEqual(self.calls('condor_rm'),[])
+        self.assertEqual(map(lambda x: (x.ID,x.state),tasks),[ (None,'submitted') ]*2)
+        # The first one is found in the queue, the second one was not
+        # submitted
+        self.fakecommand('condor_q','55 0 {0}\n'.format(tasks[0].path))
+        self.fakecommand('condor_history','')
+        cluster.killarray(tasks)
+        self.assertEqual(self.calls('condor_rm'),[ '55.0' ])
+        self.assertEqual(map(lambda x: (x.ID,x.state,x.status),tasks),
+                [ ('55.0','configured','ok'), (None,'configured','fail') ])
+
+class fakeschedd(object):
+    """The HTCondor Schedd of the fake bindings: it keeps the queued
+    jobs, the calls received and the errors to be raised per method
+    """
+    def __init__(self):
+        self.nextcluster = 1000
+        self.jobs = []
+        self.calls = []
+        self.errors = {}
+
+    def transaction(self):
+        import contextlib
+
+        @contextlib.contextmanager
+        def _txn():
+            self.calls.append('transaction')
+            yield self
+        return _txn()
+
+    def xquery(self,constraint,projection):
+        self.calls.append(('xquery',constraint,projection))
+        if self.errors.has_key('xquery'):
+            raise self.errors['xquery']
+        return iter(self.jobs)
+
+    def history(self,constraint,projection,match):
+        self.calls.append(('history',constraint,projection,match))
+        return iter([])
+
+    def act(self,action,constraint):
+        self.calls.append(('act',action,constraint))
+
+class fakesubmitresult(object):
+    def __init__(self,cluster):
+        self.clusterid = cluster
+
+    def cluster(self):
+        return self.clusterid
+
+def fakehtcondor():
+    """A fake htcondor module (only the parts used by cerncluster)
+    """
+    import types
+
+    module = types.ModuleType('htcondor')
+    module.theschedd = fakeschedd()
+    module.Schedd = lambda: module.theschedd
+
+    class Submit(object):
+        def __init__(self,description):
+            self.description = description
+
+        def queue_with_itemdata(self,txn,count,itemdata):
+            schedd = module.theschedd
+            if schedd.errors.has_key('queue'):
+                raise schedd.errors['queue']
+            cluster = schedd.nextcluster
+            schedd.nextcluster += 1
+            for (procid,item) in enumerate(itemdata):
+                schedd.jobs.append({ 'ClusterId': cluster, 'ProcId': procid,
+                    'JobStatus': 1, 'jobpath': item['jobpath'] })
+            schedd.calls.append(('queue',self.description,count))
+            return fakesubmitresult(cluster)
+    module.Submit = Submit
+    module.JobAction = types.ModuleType('JobAction')
+    module.JobAction.Remove = 'Remove'
+    return module
+
+class bindingstest(clustertestcase):
+    """cerncluster with the HTCondor python bindings
+    """
+    def setUp(self):
+        import sys
+
+        super(bindingstest,self).setUp()
+        self.htcondor = fakehtcondor()
+        self.previous = sys.modules.get('htcondor')
+        sys.modules['htcondor'] = self.htcondor
+        self.schedd = self.htcondor.theschedd
+
+    def tearDown(self):
+        import sys
+
+        if self.previous is None:
+            sys.modules.pop('htcondor',None)
+        else:
+            sys.modules['htcondor'] = self.previous
+        super(bindingstest,self).tearDown()
+
+    def maketasks(self,njobs,first=0):
+        tasks = []
+        for i in xrange(first,first+njobs):
+            path = os.path.join(self.tmpdir,'job_{0}'.format(i))
+            os.mkdir(path)
+            tasks.append(jobdescription(index=i,path=path,script='job',state='configured',
+                status='ok'))
+        return tasks
+
+    def test_submit(self):
+        cluster = clusterfactory.cerncluster(condor_bindings=True)
+        tasks = self.maketasks(3)
+        cluster.submitarray(tasks)
+        # ClusterId.ProcId, the ProcId following the order of the tasks
+        self.assertEqual(map(lambda x: x.ID,tasks),[ '1000.0', '1000.1', '1000.2' ])
+        self.assertEqual(map(lambda x: x.state,tasks),[ 'submitted' ]*3)
+        self.assertEqual(map(lambda x: x['jobpath'],self.schedd.jobs),
+                map(lambda x: x.path,tasks))
+        for task in tasks:
+            self.assertTrue(os.path.isdir(os.path.join(task.path,'output')))
+        # A second submission is a new cluster
+        other = self.maketasks(1,first=3)[0]
+        cluster.submit(other)
+        self.assertEqual(other.ID,'1001.0')
+        # No command line tool used
+        self.assertEqual(self.calls('condor_submit'),[])
+
+    def test_submit_error(self):
+        self.schedd.errors['queue'] = RuntimeError('Failed to queue')
+        cluster = clusterfactory.cerncluster(condor_bindings=True)
+        tasks = self.maketasks(2)
+        cluster.submitarray(tasks)
+        self.assertEqual(map(lambda x: (x.ID,x.status),tasks),[ (None,'fail') ]*2)
+
+    def test_query(self):
+        cluster = clusterfactory.cerncluster(condor_bindings=True)
+        tasks = self.maketasks(3)
+        cluster.submitarray(tasks)
+        self.schedd.jobs[1]['JobStatus'] = 2
+        # The third job left the queue
+        self.schedd.jobs.pop()
+        states = cluster.checkstates(tasks)
+        self.assertEqual(states,{ 0: ('submitted','ok'), 1: ('running','ok'),
+            2: ('finished','ok') })
+        self.assertEqual(len(filter(lambda x: x[0] == 'xquery',self.schedd.calls)),1)
+
+    def test_query_fallback(self):
+        cluster = clusterfactory.cerncluster(condor_bindings=True)
+        tasks = self.maketasks(2)
+        cluster.submitarray(tasks)
+        self.schedd.errors['xquery'] = IOError('Failed to connect to the schedd')
+        # Not resolved: the jobs are checked one by one with condor_q
+        self.assertEqual(cluster.checkstates(tasks),{})
+        self.fakecommand('condor_q','\n'.join([ '', '-- Schedd: fake',
+            ' ID OWNER SUBMITTED RUN_TIME ST PRI SIZE CMD',
+            '1000.0 me 10/1 12:09 0+00:00:10 R 0 0.0 job.sh' ])+'\n')
+        cluster.getnextstate(tasks[0],None)
+        self.assertEqual(tasks[0].state,'running')
+        self.assertEqual(self.calls('condor_q'),[ '-nobatch 1000.0' ])
+
+    def test_remove(self):
+        cluster = clusterfactory.cerncluster(condor_bindings=True)
+        tasks = self.maketasks(2)
+        cluster.submitarray(tasks)
+        cluster.killarray(tasks)
+        acts = filter(lambda x: x[0] == 'act',self.schedd.calls)
+        self.assertEqual(acts,[ ('act','Remove','(ClusterId == 1000 && ProcId == 0) ||'\
+                ' (ClusterId == 1000 && ProcId == 1)') ])
+        self.assertEqual(map(lambda x: x.state,tasks),[ 'configured' ]*2)
+
+    def test_without_bindings(self):
+        import sys
+
+        # The module cannot be imported: the command line tools are used
+        sys.modules['htcondor'] = None
+        self.fakecommand('condor_submit','2 job(s) submitted to cluster 77.\n')
+        cluster = clusterfactory.cerncluster(condor_bindings=True)
+        self.assertIsNone(cluster.getschedd())
+        tasks = self.maketasks(2)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            cluster.submitarray(tasks)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(map(lambda x: x.ID,tasks),[ '77.0', '77.1' ])
+        self.assertEqual(len(self.calls('condor_submit')),1)
+
+    def test_schedd_not_found(self):
+        # As in the recent bindings, not a RuntimeError
+        class HTCondorException(Exception):
+            pass
+        class HTCondorLocateError(HTCondorException):
+            pass
+        self.htcondor.HTCondorException = HTCondorException
+        def _schedd():
+            raise HTCondorLocateError('Unable to locate local daemon')
+        self.htcondor.Schedd = _schedd
+        self.fakecommand('condor_submit','1 job(s) submitted to cluster 78.\n')
+        cluster = clusterfactory.cerncluster(condor_bindings=True)
+        self.assertIsNone(cluster.getschedd())
+        self.assertIs(cluster.schedd,False)
+        tasks = self.maketasks(1)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            cluster.submitarray(tasks)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(tasks[0].ID,'78.0')
+
+if __name__ == '__main__':
+    unittest.main()
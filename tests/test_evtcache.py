@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Tests of the evtcache module: the cached entries are only valid
+while the files are not modified
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import tests
+from job_sender import evtcache
+
+class evtcachetest(unittest.TestCase):
+    """evtcache with its file in a temporary folder
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ[evtcache.CACHEENV] = os.path.join(self.tmpdir,'cache','events.sqlite')
+        self.files = []
+        for i in xrange(2):
+            self.files.append(os.path.join(self.tmpdir,'f{0}.root'.format(i)))
+            with open(self.files[-1],'w') as f:
+                f.write('x'*(i+1))
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def test_cachefile(self):
+        self.assertEqual(evtcache.getcachefile(),os.environ[evtcache.CACHEENV])
+        cache = evtcache.evtcache()
+        cache.close()
+        # The folder is created
+        self.assertTrue(os.path.isfile(os.environ[evtcache.CACHEENV]))
+
+    def test_lookup(self):
+        cache = evtcache.evtcache()
+        cache.store({ self.files[0]: 10, self.files[1]: 20 },'root:T')
+        cache.close()
+        cache = evtcache.evtcache()
+        self.assertEqual(cache.lookup(self.files,'root:T'),
+                { self.files[0]: 10, self.files[1]: 20 })
+        # The kind of count is part of the key
+        self.assertEqual(cache.lookup(self.files,'root:Other'),{})
+        # Found through a link to the file
+        link = os.path.join(self.tmpdir,'link.root')
+        os.symlink(self.files[0],link)
+        self.assertEqual(cache.lookup([ link ],'root:T'),{ link: 10 })
+        cache.close()
+
+    def test_invalidation(self):
+        cache = evtcache.evtcache()
+        cache.store({ self.files[0]: 10, self.files[1]: 20 },'lcio')
+        # Same size, but modified later
+        mtime = os.stat(self.files[0]).st_mtime
+        os.utime(self.files[0],(time.time(),mtime+10))
+        # Re-written with another size
+        with open(self.files[1],'w') as f:
+            f.write('xxxxx')
+        os.utime(self.files[1],(time.time(),os.stat(self.files[1]).st_mtime))
+        self.assertEqual(cache.lookup(self.files,'lcio'),{})
+        # Replaced by another file (new inode) with the same size and time
+        cache.store({ self.files[1]: 20 },'lcio')
+        st = os.stat(self.files[1])
+        other = os.path.join(self.tmpdir,'other.root')
+        with open(other,'w') as f:
+            f.write('xxxxx')
+        os.rename(other,self.files[1])
+        os.utime(self.files[1],(st.st_atime,st.st_mtime))
+        self.assertEqual(cache.lookup(self.files,'lcio'),{})
+        cache.close()
+
+    def test_not_cached(self):
+        cache = evtcache.evtcache()
+        remote = 'root://eosserver//eos/f0.root'
+        missing = os.path.join(self.tmpdir,'missing.root')
+        cache.store({ remote: 10, missing: 20 },'root:T')
+        self.assertEqual(cache.lookup([ remote, missing ],'root:T'),{})
+        self.assertEqual(cache.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0],0)
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""Tests of the evtreaders module: the event counters of the ROOT,
+LCIO and ALIBAVA files, run over small files (the ROOT ones are in
+the fixtures folder, see fixtures/makefixtures.py)
+"""
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from tests import FIXTURES
+from job_sender import evtreaders
+
+class filetestcase(unittest.TestCase):
+    """Test case with a temporary folder to write the files
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self,name,data):
+        filename = os.path.join(self.tmpdir,name)
+        with open(filename,'wb') as f:
+            f.write(data)
+        return filename
+
+    def countwithfallback(self,getevt,command,filelist):
+        """Count the events of the files with the getevt function of
+        jobssender, being `command` (the external counter used when
+        the file is not understood) a fake one printing 42 events and
+        logging the files it is called with. The cache of events is
+        placed in the temporary folder
+        """
+        from job_sender.evtcache import CACHEENV
+
+        bindir = os.path.join(self.tmpdir,'bin')
+        os.mkdir(bindir)
+        log = os.path.join(self.tmpdir,'counter.log')
+        script = self.write(os.path.join('bin',command),
+                '#!/bin/sh\necho "$1" >> {0}\necho "Number of events: 42"\n'.format(log))
+        os.chmod(script,0755)
+        environ = dict(os.environ)
+        os.environ['PATH'] = bindir+os.pathsep+os.environ['PATH']
+        os.environ[CACHEENV] = os.path.join(self.tmpdir,'cache.sqlite')
+        try:
+            events = getevt(filelist,perfile=True)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        called = []
+        if os.path.isfile(log):
+            called = open(log).read().split()
+        return events,called
+
+def readfixture(name):
+    with open(os.path.join(FIXTURES,name),'rb') as f:
+        return f.read()
+
+def zipblock(data,algo='ZL'):
+    """A compressed block of a ROOT record: the 9 bytes header (the
+    algorithm, the method and the compressed and uncompressed sizes,
+    3 bytes little endian each) and the compressed data
+    """
+    zipped = zlib.compress(data)
+    return algo+'\x08'+struct.pack('<I',len(zipped))[:3]+\
+            struct.pack('<I',len(data))[:3]+zipped
+
+def recompress(data,treename='CollectionTree',algo='ZL',nblocks=1):
+    """Move the record of a TTree to the end of the file, compressed,
+    updating its key (the header of the record and its entry in the
+    keys list)
+    """
+    keys = evtreaders.rootkeys(data)
+    key = filter(lambda k: k['name'] == treename,keys)[0]
+    header = data[key['seekkey']:key['seekkey']+key['keylen']]
+    payload = data[key['seekkey']+key['keylen']:key['seekkey']+key['nbytes']]
+    step = (len(payload)+nblocks-1)/nblocks
+    blocks = ''.join(map(lambda i: zipblock(payload[i:i+step],algo),
+        xrange(0,len(payload),step)))
+    # The keys list entry is the other copy of the record header
+    entry = data.find(header,key['seekkey']+1)
+    if entry == -1:
+        entry = data.find(header)
+    assert entry != -1 and entry != key['seekkey']
+    if key['version'] > evtreaders.ROOTBIGKEY:
+        seek = struct.pack('>q',len(data))
+    else:
+        seek = struct.pack('>i',len(data))
+    newheader = struct.pack('>i',key['keylen']+len(blocks))+header[4:18]+\
+            seek+header[18+len(seek):]
+    data = data[:entry]+newheader+data[entry+len(newheader):]
+    return data+newheader+blocks
+
+class rootentriestest(filetestcase):
+    """evtreaders.rootentries
+    """
+    def test_entries(self):
+        filename = os.path.join(FIXTURES,'tree.root')
+        self.assertEqual(evtreaders.rootentries(filename),14)
+        self.assertEqual(evtreaders.rootentries(filename,'other'),3)
+
+    def test_missing_tree(self):
+        filename = os.path.join(FIXTURES,'tree.root')
+        self.assertIsNone(evtreaders.rootentries(filename,'nothere'))
+
+    def test_not_a_ttree(self):
+        # A RNTuple with the name of the tree
+        filename = os.path.join(FIXTURES,'ntuple.root')
+        self.assertIsNone(evtreaders.rootentries(filename))
+
+    def test_compressed_record(self):
+        data = readfixture('tree.root')
+        for nblocks in [ 1, 3 ]:
+            filename = self.write('zl.root',recompress(data,nblocks=nblocks))
+            self.assertEqual(evtreaders.rootentries(filename),14)
+            # The other tree is untouched
+            self.assertEqual(evtreaders.rootentries(filename,'other'),3)
+
+    def test_unknown_compression(self):
+        data = recompress(readfixture('tree.root'),algo='QQ')
+        filename = self.write('qq.root',data)
+        self.assertIsNone(evtreaders.rootentries(filename))
+
+    def test_unavailable_algorithm(self):
+        try:
+            import lz4.block
+            self.skipTest('the lz4 module is available')
+        except ImportError:
+            pass
+        data = recompress(readfixture('tree.root'),algo='L4')
+        filename = self.write('l4.root',data)
+        self.assertIsNone(evtreaders.rootentries(filename))
+
+    def test_corrupted_compressed_record(self):
+        data = recompress(readfixture('tree.root'))
+        # The end of the zlib stream is lost
+        filename = self.write('corrupted.root',data[:-10]+'\x00'*10)
+        self.assertIsNone(evtreaders.rootentries(filename))
+
+    def test_truncated(self):
+        data = readfixture('tree.root')
+        for size in [ 2, 64, len(data)/2, len(data)-100 ]:
+            filename = self.write('truncated.root',data[:size])
+            self.assertIsNone(evtreaders.rootentries(filename))
+        data = recompress(data)
+        filename = self.write('truncated.root',data[:-20])
+        self.assertIsNone(evtreaders.rootentries(filename))
+
+    def test_not_root(self):
+        self.assertIsNone(evtreaders.rootentries(self.write('text.root','not a root file\n'*8)))
+        self.assertIsNone(evtreaders.rootentries(self.write('empty.root','')))
+        self.assertIsNone(evtreaders.rootentries(os.path.join(self.tmpdir,'missing.root')))
+        self.assertIsNone(evtreaders.rootentries('root://eosuser.cern.ch//eos/f.root'))
+
+class rootcountertest(filetestcase):
+    """jobssender.getevt, the files not understood by rootentries are
+    counted with ROOT
+    """
+    def test_without_root(self):
+        from job_sender.evtcache import CACHEENV
+        from job_sender.jobssender import getevt
+
+        try:
+            import ROOT
+            self.skipTest('ROOT is available')
+        except ImportError:
+            pass
+        environ = dict(os.environ)
+        os.environ[CACHEENV] = os.path.join(self.tmpdir,'cache.sqlite')
+        try:
+            self.assertRaises(ImportError,getevt,[ os.path.join(FIXTURES,'ntuple.root') ],
+                    force=True)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+def siorecord(name,datalen,marker=evtreaders.SIOMARKER):
+    """A SIO record: the header (its length, the marker, the options,
+    the data lengths and the name, padded to 4 bytes) and the data,
+    padded to 4 bytes
+    """
+    padname = name+'\x00'*(-len(name) % 4)
+    header = struct.pack('>iIiiii',evtreaders.SIOHEADER+len(padname),marker,0,
+            datalen,datalen,len(name))+padname
+    return header+'\xab'*datalen+'\x00'*(-datalen % 4)
+
+def lciofile(nevents):
+    """A LCIO file: the run header and, per event, the event header and
+    the event records (with data sizes not multiple of 4)
+    """
+    records = [ siorecord('LCRunHeader',37) ]
+    for i in xrange(nevents):
+        records.append(siorecord('LCEventHeader',50+i))
+        records.append(siorecord('LCEvent',1001+3*i))
+    return ''.join(records)
+
+class lcioeventstest(filetestcase):
+    """evtreaders.lcioevents
+    """
+    def test_events(self):
+        for nevents in [ 0, 1, 7 ]:
+            filename = self.write('f.slcio',lciofile(nevents))
+            self.assertEqual(evtreaders.lcioevents(filename),nevents)
+
+    def test_truncated(self):
+        data = lciofile(5)
+        for size in [ 10, len(data)/2, len(data)-1 ]:
+            filename = self.write('truncated.slcio',data[:size])
+            self.assertIsNone(evtreaders.lcioevents(filename))
+
+    def test_bad_marker(self):
+        data = lciofile(2)+siorecord('LCEvent',8,marker=0xdeadbeef)
+        self.assertIsNone(evtreaders.lcioevents(self.write('bad.slcio',data)))
+
+    def test_short_header(self):
+        # The header length does not include the name
+        data = lciofile(1)+struct.pack('>iIiiii',evtreaders.SIOHEADER,
+                evtreaders.SIOMARKER,0,0,0,7)+'LCEvent\x00'
+        self.assertIsNone(evtreaders.lcioevents(self.write('short.slcio',data)))
+
+    def test_not_lcio(self):
+        self.assertIsNone(evtreaders.lcioevents(self.write('text.slcio','not a lcio file\n'*8)))
+        self.assertIsNone(evtreaders.lcioevents(self.write('empty.slcio','')))
+        self.assertIsNone(evtreaders.lcioevents(os.path.join(self.tmpdir,'missing.slcio')))
+
+    def test_fallback(self):
+        from job_sender.jobssender import getevt_lcio
+
+        good = self.write('good.slcio',lciofile(3))
+        bad = self.write('bad.slcio','not a lcio file\n')
+        events,called = self.countwithfallback(getevt_lcio,'lcio_event_counter',[ good, bad ])
+        self.assertEqual(events,{ good: 3, bad: 42 })
+        # The external counter is only used for the file not understood
+        self.assertEqual(called,[ bad ])
+
+def alibavafile(nevents,version=2,timesize=8,pedestals=True,eventsize=592):
+    """An ALIBAVA raw data file: the time, the run type and the header
+    string, followed by either the pedestals and noise and the blocks
+    (versioned files: a data block per event, and some other blocks)
+    or the fixed size events (files without version)
+    """
+    if version:
+        header = 'V{0}|a run header'.format(version)
+    else:
+        header = 'a run header without version'
+    data = '\x01'*timesize+struct.pack('<iI',2,len(header))+header
+    if not version:
+        return data+'\x07'*(eventsize*nevents)
+    if pedestals:
+        data += struct.pack('<{0}d'.format(2*evtreaders.ALIBAVANCHANNELS),
+                *([ 0.5 ]*(2*evtreaders.ALIBAVANCHANNELS)))
+    def _block(code,size):
+        return struct.pack('<II',(evtreaders.ALIBAVAMARKER << 16) | code,size)+'\x07'*size
+    blocks = [ _block(1,16) ]
+    for i in xrange(nevents):
+        blocks.append(_block(evtreaders.ALIBAVADATABLOCK,500+i))
+        if i % 2:
+            blocks.append(_block(3,12))
+    return data+''.join(blocks)
+
+class alibavaeventstest(filetestcase):
+    """evtreaders.alibavaevents
+    """
+    def test_versioned(self):
+        for nevents in [ 0, 1, 9 ]:
+            for timesize in [ 8, 4 ]:
+                for pedestals in [ True, False ]:
+                    filename = self.write('f.dat',alibavafile(nevents,timesize=timesize,
+                        pedestals=pedestals))
+                    self.assertEqual(evtreaders.alibavaevents(filename),nevents)
+
+    def test_without_version(self):
+        for eventsize in evtreaders.ALIBAVAEVENTSIZES:
+            filename = self.write('f.dat',alibavafile(6,version=0,eventsize=eventsize))
+            self.assertEqual(evtreaders.alibavaevents(filename),6)
+        # Not a whole number of events
+        filename = self.write('f.dat',alibavafile(6,version=0)+'\x07'*10)
+        self.assertIsNone(evtreaders.alibavaevents(filename))
+
+    def test_truncated(self):
+        data = alibavafile(5)
+        for size in [ 6, len(data)/2, len(data)-1 ]:
+            filename = self.write('truncated.dat',data[:size])
+            self.assertIsNone(evtreaders.alibavaevents(filename))
+
+    def test_bad_marker(self):
+        data = alibavafile(3)+struct.pack('<II',0xbeef0002,8)+'\x07'*8
+        self.assertIsNone(evtreaders.alibavaevents(self.write('bad.dat',data)))
+
+    def test_not_alibava(self):
+        self.assertIsNone(evtreaders.alibavaevents(self.write('binary.dat','\xff'*64)))
+        self.assertIsNone(evtreaders.alibavaevents(self.write('empty.dat','')))
+        self.assertIsNone(evtreaders.alibavaevents(os.path.join(self.tmpdir,'missing.dat')))
+
+    def test_fallback(self):
+        from job_sender.jobssender import getevt_alibava
+
+        good = self.write('good.dat',alibavafile(4))
+        bad = self.write('bad.dat','\xff'*64)
+        events,called = self.countwithfallback(getevt_alibava,'genfa',[ good, bad ])
+        self.assertEqual(events,{ good: 4, bad: 42 })
+        # genfa is only used for the file not understood
+        self.assertEqual(called,[ bad ])
+
+if __name__ == '__main__':
+    unittest.main()
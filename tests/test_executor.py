@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Tests of the executor module: both executors run the commands,
+report their failures and kill them (with the processes they start)
+on timeout
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import tests
+from job_sender import executor
+
+class executortestcase(object):
+    """The tests common to both executors, `kind` is the executor
+    """
+    kind = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.executor = executor.setexecutor(self.kind)
+
+    def tearDown(self):
+        self.executor.close()
+        # Back to the default executor
+        executor.EXECUTOR = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_command(self):
+        self.assertEqual(self.executor.run([ 'echo', 'a b' ]),('a b\n','',0))
+        out,err,returncode = self.executor.run('echo out; echo err >&2; exit 3')
+        self.assertEqual((out,err,returncode),('out\n','err\n',3))
+        self.assertEqual(self.executor.run([ 'pwd' ],cwd=self.tmpdir)[0].strip(),
+                os.path.realpath(self.tmpdir))
+
+    def test_timeout(self):
+        # A wrapper script whose child keeps the output open
+        script = os.path.join(self.tmpdir,'wrapper.sh')
+        with open(script,'w') as f:
+            f.write('#!/bin/sh\nsleep 30\n')
+        os.chmod(script,0755)
+        start = time.time()
+        out,err,returncode = self.executor.run([ script ],timeout=0.5)
+        self.assertTrue(time.time()-start < 10)
+        self.assertIsNone(returncode)
+        self.assertTrue(err.find('timed out') != -1)
+        # The executor is still usable
+        self.assertEqual(self.executor.run([ 'echo', 'ok' ])[0],'ok\n')
+
+    def test_threads(self):
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(8)
+        try:
+            results = pool.map(lambda i: self.executor.run([ 'echo', str(i) ],timeout=30),
+                    xrange(64))
+        finally:
+            pool.close()
+        self.assertEqual(results,map(lambda i: ('{0}\n'.format(i),'',0),xrange(64)))
+
+    def test_session(self):
+        # The command leads its own process group
+        out = self.executor.run('ps -o pgid= -p $$; echo $$')[0].split()
+        if executor.insession('true')[0] == executor.SHELL:
+            self.skipTest('setsid is not available')
+        self.assertEqual(out[0],out[1])
+
+    def test_not_found(self):
+        out,err,returncode = self.executor.run([ os.path.join(self.tmpdir,'nothere') ])
+        self.assertIsNone(returncode)
+        self.assertTrue(err.find('could not be executed') != -1)
+        # Not executable
+        script = os.path.join(self.tmpdir,'script.sh')
+        with open(script,'w') as f:
+            f.write('#!/bin/sh\nexit 1\n')
+        self.assertIsNone(self.executor.run([ script ])[2])
+        # The failures of the commands are kept
+        os.chmod(script,0755)
+        self.assertEqual(self.executor.run([ script ])[2],1)
+        with open(script,'w') as f:
+            f.write('#!/bin/sh\necho "setsid: failed to execute {0}: x" >&2\nexit 2\n'.format(
+                script))
+        self.assertEqual(self.executor.run([ script ])[2],2)
+        # The shell reports it
+        self.assertEqual(self.executor.run('nothere_command_')[2],127)
+
+    def test_setsid_resolved_once(self):
+        executor.insession('true')
+        resolved = executor.SETSIDPATH
+        self.assertIsNotNone(resolved)
+        os.environ['PATH'],path = '',os.environ['PATH']
+        try:
+            self.assertEqual(executor.insession('true'),executor.insession('true'))
+            self.assertEqual(executor.SETSIDPATH,resolved)
+        finally:
+            os.environ['PATH'] = path
+
+class popenexecutortest(executortestcase,unittest.TestCase):
+    kind = 'popen'
+
+    def test_inherited_files(self):
+        # The descriptors of the python process are not inherited
+        rfd,wfd = os.pipe()
+        try:
+            out = self.executor.run('ls /proc/$$/fd')[0].split()
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+        self.assertFalse(str(rfd) in out or str(wfd) in out)
+
+class shellexecutortest(executortestcase,unittest.TestCase):
+    kind = 'shell'
+
+if __name__ == '__main__':
+    unittest.main()
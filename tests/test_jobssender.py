@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""Tests of the jobssender module: the counting of the events, the
+submission rate, the state index of the tasks, their storage (journal
+and compaction) and the array submission, kill and resubmission, with
+the batch system commands faked in the PATH (see test_clusterfactory)
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import tests
+from tests.test_clusterfactory import clustertestcase
+from job_sender import clusterfactory
+from job_sender import jobssender
+from job_sender import jobstore
+from job_sender.evtcache import CACHEENV
+from job_sender.jobssender import jobdescription,job
+from job_sender.runhistory import HISTORYENV
+
+class fakecluster(object):
+    """A cluster only counting the walltime queries
+    """
+    def __init__(self):
+        self.nwalltimes = 0
+
+    def getwalltimes(self,jobdsclist):
+        self.nwalltimes += 1
+        return {}
+
+class fakeworkenv(object):
+    """A workenv without events
+    """
+    def gethistorykey(self):
+        return 'fakeworkenv'
+
+    def getprocessedevents(self,jobindex):
+        return None
+
+    def checkfinishedjob(self,jobdsc):
+        return 'ok'
+
+def maketasks(path,n):
+    tasks = []
+    for i in xrange(n):
+        jobpath = os.path.join(path,'job_{0}'.format(i))
+        os.mkdir(jobpath)
+        tasks.append(jobdescription(index=i,path=jobpath,script='job',
+            state='configured',status='ok'))
+    return tasks
+
+class jobssendertestcase(clustertestcase):
+    """The event cache and the runtime history in the temporary folder
+    """
+    def setUp(self):
+        super(jobssendertestcase,self).setUp()
+        os.environ[CACHEENV] = os.path.join(self.tmpdir,'cache.sqlite')
+        os.environ[HISTORYENV] = os.path.join(self.tmpdir,'history.sqlite')
+
+    def makejob(self,n,cluster=None):
+        js = job(cluster or fakecluster(),fakeworkenv())
+        js.tasklist = maketasks(self.tmpdir,n)
+        js.buildindex()
+        return js
+
+class evtsperfiletest(jobssendertestcase):
+    """getevtsperfile and runcounter
+    """
+    def setUp(self):
+        super(evtsperfiletest,self).setUp()
+        self.files = []
+        for i in xrange(3):
+            self.files.append(os.path.join(self.tmpdir,'f{0}.slcio'.format(i)))
+            open(self.files[-1],'w').close()
+        self.counted = []
+
+    def counter(self,files):
+        for f in files:
+            self.counted.append(f)
+            if f == self.files[2]:
+                yield f,None,'corrupted'
+            else:
+                yield f,10*(self.files.index(f)+1),None
+
+    def test_cache(self):
+        self.assertRaises(RuntimeError,jobssender.getevtsperfile,self.files,'lcio',self.counter)
+        # The counted ones were kept
+        self.counted = []
+        md = jobssender.getevtsperfile(self.files[:2],'lcio',self.counter)
+        self.assertEqual(md,{ self.files[0]: 10, self.files[1]: 20 })
+        self.assertEqual(self.counted,[])
+        self.assertRaises(RuntimeError,jobssender.getevtsperfile,self.files,'lcio',self.counter)
+        self.assertEqual(self.counted,[ self.files[2] ])
+        # Counted again
+        self.counted = []
+        jobssender.getevtsperfile(self.files[:2],'lcio',self.counter,force=True)
+        self.assertEqual(sorted(self.counted),self.files[:2])
+
+    def test_batches(self):
+        from job_sender import evtcache
+
+        stored = []
+        store = evtcache.evtcache.store
+        batch = jobssender.CACHEBATCH
+        def _store(cache,md,kind):
+            stored.append(len(md))
+            store(cache,md,kind)
+        evtcache.evtcache.store = _store
+        try:
+            jobssender.CACHEBATCH = 2
+            self.assertRaises(RuntimeError,jobssender.getevtsperfile,self.files,'lcio',
+                    self.counter)
+            self.assertEqual(stored,[ 2 ])
+            # Interrupted: the files counted are kept
+            def _interrupted(files):
+                yield files[0],10,None
+                raise KeyboardInterrupt
+            stored[:] = []
+            self.assertRaises(KeyboardInterrupt,jobssender.getevtsperfile,self.files,
+                    'other',_interrupted)
+            self.assertEqual(stored,[ 1 ])
+        finally:
+            evtcache.evtcache.store = store
+            jobssender.CACHEBATCH = batch
+        self.counted = []
+        jobssender.getevtsperfile(self.files[:1],'other',self.counter)
+        self.assertEqual(self.counted,[])
+
+    def test_runcounter(self):
+        self.fakecommand('counter','Number of events: 42\n')
+        results = sorted(jobssender.runcounter('counter',self.files,nworkers=2))
+        self.assertEqual(results,map(lambda f: (f,42,None),self.files))
+        self.assertEqual(sorted(self.calls('counter')),self.files)
+        self.fakecommand('counter','no such file\n',exitcode=2)
+        f,nevts,error = list(jobssender.runcounter('counter',self.files[:1]))[0]
+        self.assertIsNone(nevts)
+        self.assertTrue(error.find('exit code 2') != -1)
+
+class tokenbuckettest(unittest.TestCase):
+    """tokenbucket
+    """
+    def test_rate(self):
+        bucket = jobssender.tokenbucket(20.0,burst=1)
+        start = time.time()
+        for i in xrange(5):
+            bucket.acquire()
+        # The first token is available at once
+        self.assertTrue(time.time()-start >= 0.19)
+
+    def test_burst(self):
+        for bucket in [ jobssender.tokenbucket(), jobssender.tokenbucket(0.1,burst=5) ]:
+            start = time.time()
+            for i in xrange(5):
+                bucket.acquire()
+            self.assertTrue(time.time()-start < 0.5)
+
+class stateindextest(jobssendertestcase):
+    """The state index of the tasks (job.settaskstate)
+    """
+    def test_index(self):
+        js = self.makejob(4)
+        self.assertEqual(js.getindicesof('configured'),set([ 0, 1, 2, 3 ]))
+        self.assertEqual(js.getactiveindices(),set())
+        tasks = js.getlistoftasks()
+        tasks[0].state = 'submitted'
+        tasks[1].state = 'running'
+        tasks[2].state,tasks[2].status = 'finished','ok'
+        tasks[3].state,tasks[3].status = 'finished','fail'
+        for task in tasks:
+            js.settaskstate(task)
+        self.assertEqual(js.getactiveindices(),set([ 0, 1 ]))
+        self.assertEqual(js.getindicesof('finished'),set([ 2, 3 ]))
+        self.assertEqual(js.getindicesof('finished','fail'),set([ 3 ]))
+        self.assertEqual(js.getindicesof('configured'),set())
+        self.assertEqual(js.dirty,set([ 0, 1, 2, 3 ]))
+        self.assertEqual(js.completed,set([ 2 ]))
+        self.assertIsNotNone(tasks[0].tsubmitted)
+        self.assertIsNotNone(tasks[2].tfinished)
+        self.assertEqual(map(lambda x: x.index,js.gettasks([ 3, 1, 10 ])),[ 1, 3 ])
+
+class storagetest(jobssendertestcase):
+    """The storage of the job (bookeepingjobs, accessingjobsinfo)
+    """
+    def setUp(self):
+        super(storagetest,self).setUp()
+        self.filename = os.path.join(self.tmpdir,jobstore.STOREFILE)
+        self.compactevery = jobstore.COMPACTEVERY
+
+    def tearDown(self):
+        jobstore.COMPACTEVERY = self.compactevery
+        super(storagetest,self).tearDown()
+
+    def test_replay(self):
+        js = self.makejob(3)
+        jobssender.bookeepingjobs(js,self.filename)
+        task = js.getlistoftasks()[0]
+        task.state,task.ID = 'submitted','10.0'
+        js.settaskstate(task)
+        # Interrupted before the next bookeepingjobs
+        recovered = jobssender.accessingjobsinfo(self.filename)
+        self.assertEqual(map(lambda x: (x.ID,x.state,x.tsubmitted),recovered.getlistoftasks()),
+                map(lambda x: (x.ID,x.state,x.tsubmitted),js.getlistoftasks()))
+        self.assertEqual(recovered.getindicesof('submitted'),set([ 0 ]))
+        self.assertEqual(recovered.dirty,set([ 0 ]))
+        jobssender.bookeepingjobs(recovered)
+        self.assertEqual(os.path.getsize(recovered.store.journalfile),0)
+        self.assertEqual(map(lambda x: x.ID,jobstore.jobstore(self.filename).loadtasks()),
+                [ '10.0', None, None ])
+
+    def test_compaction(self):
+        jobstore.COMPACTEVERY = 3
+        js = self.makejob(3)
+        jobssender.bookeepingjobs(js,self.filename)
+        js.cluster.marker = True
+        tasks = js.getlistoftasks()
+        tasks[0].state = 'submitted'
+        js.settaskstate(tasks[0])
+        tasks[1].state = 'submitted'
+        js.settaskstate(tasks[1])
+        tasks[0].state = 'finished'
+        js.settaskstate(tasks[0])
+        store = jobstore.jobstore(self.filename)
+        self.assertEqual(os.path.getsize(store.journalfile),0)
+        self.assertEqual(map(lambda x: x.state,store.loadtasks()),
+                [ 'finished', 'submitted', 'configured' ])
+        self.assertEqual(js.dirty,set())
+        # The configuration and the runtime history are left to the
+        # next bookeepingjobs
+        self.assertFalse(hasattr(store.loadconfig()[0],'marker'))
+        self.assertEqual(js.cluster.nwalltimes,0)
+        self.assertEqual(js.completed,set([ 0 ]))
+        jobssender.bookeepingjobs(js)
+        self.assertTrue(jobstore.jobstore(self.filename).loadconfig()[0].marker)
+        self.assertEqual(js.cluster.nwalltimes,1)
+
+class arraytest(jobssendertestcase):
+    """Submission, kill and resubmission of an array of tasks
+    """
+    def submitarray(self,js,tasks):
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            js.submitarray(tasks)
+        finally:
+            os.chdir(cwd)
+
+    def test_kill_resubmit(self):
+        self.fakecommand('condor_submit','3 job(s) submitted to cluster 77.\n')
+        js = self.makejob(3,clusterfactory.cerncluster())
+        tasks = js.getlistoftasks()
+        self.submitarray(js,tasks)
+        self.assertEqual(map(lambda x: x.ID,tasks),[ '77.0', '77.1', '77.2' ])
+        self.assertEqual(js.getindicesof('submitted'),set([ 0, 1, 2 ]))
+        # The kill failed: kept as they were
+        self.fakecommand('condor_rm','',exitcode=1)
+        js.kill(tasks[:2])
+        self.assertEqual(js.getindicesof('submitted'),set([ 0, 1, 2 ]))
+        self.fakecommand('condor_rm','All jobs marked for removal.\n')
+        js.kill(tasks[:2])
+        self.assertEqual(self.calls('condor_rm')[-1],'77.0 77.1')
+        self.assertEqual(js.getindicesof('configured'),set([ 0, 1 ]))
+        # Only the killed ones are sent again, in a new cluster
+        self.fakecommand('condor_submit','2 job(s) submitted to cluster 78.\n')
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            js.resubmit(tasks)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(map(lambda x: x.ID,tasks),[ '78.0', '78.1', '77.2' ])
+        self.assertEqual(js.getindicesof('submitted'),set([ 0, 1, 2 ]))
+        self.assertEqual(len(self.calls('condor_submit')),2)
+
+if __name__ == '__main__':
+    unittest.main()
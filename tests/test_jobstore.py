@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Tests of the jobstore module: the tasks and the configuration of a
+production, and the journal of the transitions not stored yet
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import tests
+from job_sender import jobstore
+from job_sender.jobssender import jobdescription
+
+def maketasks(n):
+    return map(lambda i: jobdescription(index=i,path='/work/job_{0}'.format(i),
+        script='job',state='configured',status='ok'),xrange(n))
+
+class jobstoretest(unittest.TestCase):
+    """jobstore in a temporary folder
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir,jobstore.STOREFILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_config(self):
+        store = jobstore.jobstore(self.filename)
+        self.assertFalse(store.hasconfig())
+        self.assertRaises(RuntimeError,store.loadconfig)
+        store.storeconfig({ 'cluster': 1 },[ 'workenv' ])
+        store.close()
+        store = jobstore.jobstore(self.filename)
+        self.assertTrue(store.hasconfig())
+        self.assertEqual(store.loadconfig(),({ 'cluster': 1 },[ 'workenv' ]))
+        # Not re-written if it did not change
+        store.conn.execute("DELETE FROM config WHERE key='workenv'")
+        store.storeconfig({ 'cluster': 2 },[ 'workenv' ])
+        self.assertEqual(map(lambda x: str(x[0]),store.conn.execute("SELECT key FROM config")),
+                [ 'cluster' ])
+        store.close()
+
+    def test_tasks(self):
+        store = jobstore.jobstore(self.filename)
+        tasks = maketasks(3)
+        tasks[1].ID = '10.1'
+        tasks[2].ID = 12
+        tasks[2].state = 'submitted'
+        tasks[2].tsubmitted = 1000.0
+        store.storetasks(tasks)
+        store.close()
+        loaded = jobstore.jobstore(self.filename).loadtasks()
+        self.assertEqual(map(lambda x: (x.index,x.path,x.ID,x.state,x.status,x.tsubmitted),loaded),
+                map(lambda x: (x.index,x.path,x.ID,x.state,x.status,x.tsubmitted),tasks))
+
+    def test_journal(self):
+        store = jobstore.jobstore(self.filename)
+        tasks = maketasks(2)
+        store.storetasks(tasks)
+        tasks[0].state,tasks[0].ID = 'submitted','10.0'
+        store.journal(tasks[0],('configured','ok'))
+        tasks[0].state = 'running'
+        store.journal(tasks[0],('submitted','ok'))
+        self.assertEqual(store.njournal,2)
+        # The process died while writing the last line
+        with open(store.journalfile,'a') as f:
+            f.write('{"index": 1, "old": ["conf')
+        store = jobstore.jobstore(self.filename)
+        entries = store.replay()
+        self.assertEqual(map(lambda x: (x['index'],tuple(x['old']),x['new'],x['ID']),entries),
+                [ (0,('configured','ok'),('submitted','ok'),'10.0'),
+                    (0,('submitted','ok'),('running','ok'),'10.0') ])
+        self.assertEqual(store.njournal,2)
+
+    def test_compact(self):
+        store = jobstore.jobstore(self.filename)
+        tasks = maketasks(2)
+        store.storetasks(tasks)
+        tasks[1].state = 'submitted'
+        store.journal(tasks[1],('configured','ok'))
+        store.compact([ tasks[1] ])
+        self.assertEqual(os.path.getsize(store.journalfile),0)
+        self.assertEqual(store.njournal,0)
+        self.assertEqual(map(lambda x: x.state,store.loadtasks()),[ 'configured', 'submitted' ])
+        # The journal is re-opened afterwards
+        store.journal(tasks[1],('submitted','ok'))
+        self.assertEqual(len(store.replay()),1)
+        store.close()
+
+    def test_needscompact(self):
+        store = jobstore.jobstore(self.filename)
+        task = maketasks(1)[0]
+        for i in xrange(jobstore.COMPACTEVERY-1):
+            store.journal(task,('configured','ok'))
+        self.assertFalse(store.needscompact())
+        store.journal(task,('configured','ok'))
+        self.assertTrue(store.needscompact())
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""Tests of the splitting module: whatever the strategy and the input
+files, the jobs must cover the events [0,evtmax) exactly once. The
+properties are checked over randomly generated productions (with a
+fixed seed, so the failures can be reproduced)
+"""
+import random
+import unittest
+
+import tests
+from job_sender import splitting
+
+# Number of random productions checked per strategy
+NCASES = 500
+
+def randomproduction(rnd):
+    """A random production: the events and the size of each input file
+    (some of them empty), the events to be processed (at most all the
+    events of the files) and the number of jobs
+    """
+    nfiles = rnd.choice([ 0, 1, 2, 5, 40 ])
+    evtsperfile = map(lambda i: rnd.choice([ 0, 1, rnd.randint(0,50), rnd.randint(0,5000) ]),
+            xrange(nfiles))
+    bytesperfile = map(lambda n: n*rnd.randint(1,2000)+rnd.randint(0,100),evtsperfile)
+    total = sum(evtsperfile)
+    evtmax = rnd.choice([ total, rnd.randint(0,total), 0 ])
+    njobs = rnd.choice([ 1, 2, rnd.randint(1,30), rnd.randint(1,3*max(evtmax,1)) ])
+    return evtmax,evtsperfile,bytesperfile,njobs
+
+class coveragetest(unittest.TestCase):
+    """The jobs cover [0,evtmax) exactly, without overlaps nor empty jobs
+    """
+    def assertcovers(self,skipandperform,evtmax,njobs=None,message=''):
+        nextevt = 0
+        for (skip,nevents) in skipandperform:
+            if skip != nextevt or nevents <= 0:
+                self.fail('gap, overlap or empty job at event {0} in {1} {2}'.format(
+                    nextevt,skipandperform,message))
+            nextevt += nevents
+        self.assertEqual(nextevt,evtmax,'{0} events covered instead of {1} {2}'.format(
+            nextevt,evtmax,message))
+        if njobs is not None:
+            self.assertTrue(len(skipandperform) <= max(njobs,1),
+                    '{0} jobs instead of {1} {2}'.format(len(skipandperform),njobs,message))
+
+    def checkstrategy(self,strategy,seed):
+        rnd = random.Random(seed)
+        for i in xrange(NCASES):
+            evtmax,evtsperfile,bytesperfile,njobs = randomproduction(rnd)
+            message = '(case {0}: {1})'.format(i,(strategy,evtmax,evtsperfile,bytesperfile,njobs))
+            skipandperform = splitting.split(strategy,evtmax,njobs,evtsperfile=evtsperfile,
+                    bytesperfile=bytesperfile,timeperevt=rnd.uniform(0.01,10),
+                    walltime=rnd.uniform(1,5000))
+            if strategy == 'walltime':
+                self.assertcovers(skipandperform,evtmax,message=message)
+            else:
+                self.assertcovers(skipandperform,evtmax,njobs,message)
+
+    def test_events(self):
+        self.checkstrategy('events',1)
+
+    def test_files(self):
+        self.checkstrategy('files',2)
+
+    def test_bytes(self):
+        self.checkstrategy('bytes',3)
+
+    def test_walltime(self):
+        self.checkstrategy('walltime',4)
+
+    def test_without_files(self):
+        # The files strategies fall back to the events one
+        for strategy in splitting.STRATEGIES:
+            self.assertcovers(splitting.split(strategy,1000,7,timeperevt=1,walltime=100),1000)
+
+    def test_no_events(self):
+        for strategy in splitting.STRATEGIES:
+            self.assertEqual(splitting.split(strategy,0,5,evtsperfile=[ 0, 0 ],
+                bytesperfile=[ 10, 10 ],timeperevt=1,walltime=100),[])
+
+    def test_lpt(self):
+        # The jobs take whole files, each one exactly once, without
+        # empty jobs
+        rnd = random.Random(7)
+        for i in xrange(NCASES):
+            evtmax,evtsperfile,bytesperfile,njobs = randomproduction(rnd)
+            message = '(case {0}: {1})'.format(i,(evtmax,evtsperfile,njobs))
+            skipandperform,filesperjob = splitting.split('lpt',evtmax,njobs,
+                    evtsperfile=evtsperfile,withfiles=True)
+            if not evtsperfile:
+                # The events splitting
+                self.assertIsNone(filesperjob)
+                self.assertcovers(skipandperform,evtmax,njobs,message)
+                continue
+            trimmed = splitting.trimtoevents(evtmax,evtsperfile)[0]
+            self.assertEqual(len(skipandperform),len(filesperjob),message)
+            self.assertTrue(len(skipandperform) <= max(njobs,1),message)
+            self.assertEqual(sum(map(lambda (skip,n): n,skipandperform)),evtmax,message)
+            for (skip,n),files in zip(skipandperform,filesperjob):
+                self.assertEqual((skip,n),(0,sum(map(lambda k: trimmed[k],files))),message)
+                self.assertTrue(n > 0,message)
+            assigned = sorted(sum(filesperjob,[]))
+            self.assertEqual(len(assigned),len(set(assigned)),message)
+            # Only the files without events are left out
+            self.assertEqual(filter(lambda k: k not in assigned,xrange(len(trimmed))),
+                    filter(lambda k: trimmed[k] == 0 and k not in assigned,xrange(len(trimmed))),
+                    message)
+
+class strategiestest(unittest.TestCase):
+    """The distribution of the events of each strategy
+    """
+    def test_events_balanced(self):
+        rnd = random.Random(5)
+        for i in xrange(NCASES):
+            evtmax,njobs = rnd.randint(1,10**6),rnd.randint(1,1000)
+            nevents = map(lambda (skip,n): n,splitting.splitbyevents(evtmax,njobs))
+            self.assertEqual(len(nevents),min(njobs,evtmax))
+            self.assertTrue(max(nevents)-min(nevents) <= 1)
+
+    def test_files_whole(self):
+        # The jobs start at the beginning of a file
+        rnd = random.Random(6)
+        for i in xrange(NCASES):
+            evtmax,evtsperfile,bytesperfile,njobs = randomproduction(rnd)
+            firstevt = set(splitting.cumulative(evtsperfile))
+            for (skip,n) in splitting.split('files',sum(evtsperfile),njobs,
+                    evtsperfile=evtsperfile):
+                self.assertTrue(skip in firstevt)
+
+    def test_walltime_njobs(self):
+        self.assertEqual(splitting.njobsforwalltime(1000,2.0,500),4)
+        self.assertEqual(splitting.njobsforwalltime(1001,2.0,500),5)
+        self.assertEqual(len(splitting.split('walltime',1000,timeperevt=2.0,walltime=500)),4)
+        self.assertRaises(RuntimeError,splitting.njobsforwalltime,1000,0,500)
+
+    def test_unknown_strategy(self):
+        self.assertRaises(AttributeError,splitting.split,'nothere',100,2)
+
+    def test_lpt_balanced(self):
+        # The longest job is at most the average plus the largest file
+        rnd = random.Random(8)
+        for i in xrange(NCASES):
+            evtsperfile = map(lambda i: rnd.randint(1,5000),xrange(rnd.randint(1,60)))
+            njobs = rnd.randint(1,20)
+            nevents = map(lambda (skip,n): n,splitting.split('lpt',sum(evtsperfile),njobs,
+                evtsperfile=evtsperfile))
+            self.assertTrue(max(nevents) <= sum(evtsperfile)/float(len(nevents))+\
+                    max(evtsperfile))
+        # Balanced by time per file
+        skipandperform,filesperjob = splitting.split('lpt',40,2,evtsperfile=[ 10, 10, 10, 10 ],
+                balanceby='time',timeperevt=[ 3.0, 1.0, 1.0, 1.0 ],withfiles=True)
+        self.assertEqual(sorted(filesperjob),[ [ 0 ], [ 1, 2, 3 ] ])
+        # Only the first events, the last file partially
+        self.assertEqual(sorted(splitting.split('lpt',25,3,evtsperfile=[ 10, 10, 10 ],
+            withfiles=True)[0]),[ (0,5), (0,10), (0,10) ])
+
+    def test_trimtoevents(self):
+        self.assertEqual(splitting.trimtoevents(25,[ 10, 10, 10 ],[ 100, 200, 300 ]),
+                ([ 10, 10, 5 ],[ 100, 200, 150 ]))
+        self.assertEqual(splitting.trimtoevents(20,[ 10, 10, 10 ]),([ 10, 10 ],None))
+        self.assertEqual(splitting.trimtoevents(0,[ 10, 10 ],[ 1, 1 ]),([],[]))
+        self.assertEqual(splitting.trimtoevents(50,[ 10, 10 ]),([ 10, 10 ],None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Tests of the splitting of the productions in jobs done by the
+workenv classes (workenv.setsplitting), with the runtime history
+placed in a temporary folder
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import tests
+from job_sender import workenvfactory
+from job_sender.runhistory import runhistory,HISTORYENV
+
+def makejob(evtmax,evtsperfile):
+    """A workenv with its input files (not created, only their events
+    per file are used) and the events to be processed, without going
+    through the setup of the real job types
+    """
+    job = workenvfactory.blindjob.__new__(workenvfactory.blindjob)
+    job.typealias = 'testjob'
+    job.jobname = 'testjob'
+    job.getconfigfile = lambda: None
+    job.inputfiles = map(lambda i: 'f{0}.root'.format(i),xrange(len(evtsperfile)))
+    job.evtsperfile = evtsperfile
+    job.evtmax = evtmax
+    return job
+
+class setsplittingtest(unittest.TestCase):
+    """workenv.setsplitting
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ[HISTORYENV] = os.path.join(self.tmpdir,'history.sqlite')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def recordrate(self,job,timeperevt):
+        history = runhistory()
+        history.record(job.gethistorykey(),[ (1000,1000*timeperevt,float(i)) for i in xrange(5) ])
+        history.close()
+
+    def test_lpt_evtmax(self):
+        # Only the first 250 events, the third file partially
+        evtsperfile = [ 100, 100, 100, 100 ]
+        job = makejob(250,evtsperfile)
+        job.setsplitting(njobs=2,split_strategy='lpt')
+        self.assertEqual(sum(map(lambda (skip,n): n,job.skipandperform)),250)
+        self.assertEqual(sorted(sum(job.jobinputfiles,[])),[ 'f0.root', 'f1.root', 'f2.root' ])
+        for (skip,n),files in zip(job.skipandperform,job.jobinputfiles):
+            self.assertEqual(skip,0)
+            # The partially processed file is the last one of its job
+            self.assertEqual(n,sum(map(lambda f: evtsperfile[int(f[1])],files[:-1]))+\
+                    min(evtsperfile[int(files[-1][1])],250-100*int(files[-1][1])))
+        self.assertEqual(job.njobs,len(job.skipandperform))
+
+    def test_lpt_without_empty_jobs(self):
+        job = makejob(150,[ 100, 100, 0, 0 ])
+        job.setsplitting(njobs=4,split_strategy='lpt')
+        self.assertEqual(job.njobs,2)
+        self.assertEqual(sum(map(lambda (skip,n): n,job.skipandperform)),150)
+
+    def test_target_walltime_njobs(self):
+        # The same number of jobs with the time per event given and
+        # taken from the history
+        for strategy in [ 'walltime', 'lpt' ]:
+            job = makejob(400,[ 100 ]*4)
+            job.setsplitting(njobs=1,split_strategy=strategy,target_walltime=200,
+                    time_per_event=1.0)
+            self.assertEqual(job.njobs,2)
+        job = makejob(400,[ 100 ]*4)
+        self.recordrate(job,1.0)
+        for strategy in [ 'walltime', 'lpt' ]:
+            job.setsplitting(njobs=1,split_strategy=strategy,target_walltime=200)
+            self.assertEqual(job.njobs,2)
+            self.assertEqual(job.predictedwalltime,200)
+
+    def test_auto_njobs(self):
+        job = makejob(4000,[ 1000 ]*4)
+        self.recordrate(job,1.0)
+        job.setsplitting(njobs=None,auto_njobs=True,target_walltime=1000)
+        self.assertEqual(job.njobs,4)
+        # The number of jobs given is respected
+        job.setsplitting(njobs=2,auto_njobs=True,target_walltime=1000)
+        self.assertEqual(job.njobs,2)
+        self.assertEqual(job.predictedwalltime,2000)
+
+    def test_processed_events(self):
+        job = makejob(250,[ 100, 100, 100 ])
+        job.setsplitting(njobs=2)
+        self.assertEqual(map(job.getprocessedevents,[ 0, 1, 2 ]),[ 125, 125, None ])
+        # The events of the input files were not counted
+        job.evtsperfile = None
+        self.assertIsNone(job.getprocessedevents(0))
+        # The events are generated
+        job.inputfiles = None
+        self.assertEqual(job.getprocessedevents(0),125)
+
+    def test_jobinputfiles(self):
+        job = makejob(None,[ 100, 0, 100, 100 ])
+        job.setevtsperfile(dict(zip(job.inputfiles,job.evtsperfile)))
+        self.assertEqual(job.evtmax,300)
+        # The file without events is skipped
+        self.assertEqual(job.getjobinputfiles(100,50),([ 'f2.root' ],0))
+        self.assertEqual(job.getjobinputfiles(150,100),([ 'f2.root', 'f3.root' ],50))
+        self.assertEqual(job.getjobinputfiles(0,100),([ 'f0.root' ],0))
+        # All the remaining events
+        self.assertEqual(job.getjobinputfiles(250,-1),([ 'f3.root' ],50))
+        # The files defined by the splitting
+        job.jobinputfiles = [ [ 'f3.root' ], [ 'f0.root', 'f2.root' ] ]
+        self.assertEqual(job.getjobinputfiles(10,50,jobindex=1),([ 'f0.root', 'f2.root' ],10))
+        # Without the events per file, all the files are needed
+        job = makejob(300,[])
+        job.inputfiles = [ 'f0.root', 'f1.root' ]
+        self.assertEqual(job.getjobinputfiles(100,50),([ 'f0.root', 'f1.root' ],100))
+
+    def test_no_events(self):
+        job = makejob(0,[ 0, 0 ])
+        self.assertRaises(RuntimeError,job.setsplitting,njobs=2,split_strategy='lpt')
+
+if __name__ == '__main__':
+    unittest.main()